@@ -0,0 +1,201 @@
+"""
+Packet loop and API throughput under each event loop implementation.
+
+Runs, on one event loop, for --duration seconds:
+    - --servers simulated game servers streaming status packets over TCP to a listener that reads them the way
+      ClientConnection does (length prefixed, readexactly, GameManagerParser.handle_packet, then a 1ms yield)
+    - an in process uvicorn API server, as the manager runs it, with --api-clients keep-alive HTTP clients requesting
+      a small JSON endpoint and /metrics
+and reports packets handled per second, API requests per second, API p99 latency and p99 event loop lag.
+
+Loops compared, each in its own process (nest_asyncio patches asyncio for the life of the process):
+    asyncio         what man_event_loop 'asyncio' runs: the standard loop, made re-entrant by nest_asyncio
+    asyncio-plain   the standard loop without nest_asyncio, for reference (nest_asyncio swaps in pure python Tasks / Futures)
+    uvloop          what man_event_loop 'auto' runs on linux, when uvloop is installed
+
+Requires fastapi and uvicorn (in requirements.txt), and uvloop for the uvloop run.
+
+Usage:
+    python benchmarks/event_loop.py [--duration 10] [--servers 50] [--api-clients 10]
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+LOOPS = ['asyncio', 'asyncio-plain', 'uvloop']
+STATUS_PACKET = bytes([0x42, 0x03]) + (12345).to_bytes(4, 'little') + (2500).to_bytes(4, 'little') + bytes(44)
+FRAMED_STATUS_PACKET = len(STATUS_PACKET).to_bytes(2, 'little') + STATUS_PACKET
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_load(duration, servers, api_clients):
+    import logging
+    import uvicorn
+    from fastapi import FastAPI, Response
+    from cogs.TCP.packet_parser import GameManagerParser
+    from cogs.TCP.game_packet_lsnr import ClientConnection
+    from cogs.misc.metrics import render_metrics
+
+    quiet = logging.getLogger("benchmark")
+    quiet.addHandler(logging.NullHandler())
+    quiet.propagate = False
+    quiet.setLevel(logging.WARNING)
+
+    stop = asyncio.Event()
+    handled = [0]
+
+    # the game server listener
+    async def handle_game_server(reader, writer):
+        connection = ClientConnection(reader, writer, writer.get_extra_info('peername'), None)
+        parser = GameManagerParser(id(connection), logger=quiet)
+        try:
+            while not stop.is_set():
+                packet = await connection.receive_packet()
+                await parser.handle_packet(packet)
+                handled[0] += 1
+                await asyncio.sleep(0.001)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    async def game_server(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while not stop.is_set():
+                writer.write(FRAMED_STATUS_PACKET * 4)
+                await writer.drain()
+                await asyncio.sleep(0.004)
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # the API server
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"status": "OK"}
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    latencies = []
+
+    async def api_client(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode()
+        while not stop.is_set():
+            started = time.perf_counter()
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = next(int(line.split(b":")[1]) for line in headers.split(b"\r\n") if line.lower().startswith(b"content-length"))
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+        writer.close()
+
+    lags = []
+
+    async def measure_lag():
+        while not stop.is_set():
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - before - 0.01)
+
+    listener = await asyncio.start_server(handle_game_server, "127.0.0.1", 0)
+    listener_port = listener.sockets[0].getsockname()[1]
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off")
+    api_server = uvicorn.Server(config)
+    api_task = asyncio.create_task(api_server.serve())
+    while not api_server.started:
+        await asyncio.sleep(0.01)
+    api_port = api_server.servers[0].sockets[0].getsockname()[1]
+
+    load = [asyncio.create_task(game_server(listener_port)) for _ in range(servers)]
+    load += [asyncio.create_task(api_client(api_port, "/metrics" if number % 2 else "/api/ping")) for number in range(api_clients)]
+    load.append(asyncio.create_task(measure_lag()))
+
+    await asyncio.sleep(1)  # warm up
+    handled[0] = 0
+    latencies.clear()
+    lags.clear()
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    packets, requests, request_latencies, loop_lags = handled[0], len(latencies), list(latencies), list(lags)
+
+    stop.set()
+    await asyncio.wait(load, timeout=5)
+    listener.close()
+    api_server.should_exit = True
+    await api_task
+    return {
+        'packets_per_second': packets / elapsed,
+        'requests_per_second': requests / elapsed,
+        'p99_request_ms': percentile(request_latencies, 0.99) * 1000,
+        'p99_loop_lag_ms': percentile(loop_lags, 0.99) * 1000
+    }
+
+
+def run_child(loop_name, duration, servers, api_clients):
+    if loop_name == 'asyncio-plain':
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        description = f"asyncio ({type(loop).__name__})"
+    else:
+        from cogs.misc.event_loop import create_event_loop
+        loop, description, warning = create_event_loop(loop_name)
+        if warning:
+            print(json.dumps({'error': warning}))
+            return
+    result = loop.run_until_complete(run_load(duration, servers, api_clients))
+    result['loop'] = description
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet loop and API throughput under each event loop implementation")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to measure each loop for")
+    parser.add_argument("--servers", type=int, default=50, help="Simulated game servers")
+    parser.add_argument("--api-clients", type=int, default=10, help="Concurrent keep-alive API clients")
+    parser.add_argument("--loops", nargs="+", choices=LOOPS, default=LOOPS)
+    parser.add_argument("--child", choices=LOOPS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.duration, args.servers, args.api_clients)
+        return
+
+    print(f"{args.servers} game servers and {args.api_clients} API clients on one event loop, {args.duration:.0f}s per loop\n")
+    print(f"{'loop':<16}{'packets/s':>12}{'API req/s':>12}{'API p99':>12}{'p99 loop lag':>16}   implementation")
+    for loop_name in args.loops:
+        output = subprocess.run([sys.executable, __file__, "--child", loop_name, "--duration", str(args.duration),
+                                 "--servers", str(args.servers), "--api-clients", str(args.api_clients)],
+                                capture_output=True, text=True)
+        try:
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            print(f"{loop_name:<16}failed: {output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'no output'}")
+            continue
+        if 'error' in result:
+            print(f"{loop_name:<16}skipped: {result['error']}")
+            continue
+        print(f"{loop_name:<16}{result['packets_per_second']:>12.0f}{result['requests_per_second']:>12.0f}"
+              f"{result['p99_request_ms']:>9.2f} ms{result['p99_loop_lag_ms']:>13.2f} ms   {result['loop']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Simulated game servers, to exercise the manager without the HoN server binary.
+
+Each simulated server is an asyncio client. It connects to the manager port and announces itself (0x40), as a real
+server does, and then:
+    - streams status packets (0x42) at --rate a second, with its status, game phase, uptime, CPU load and players
+    - plays scripted matches: lobby created (0x44), players joining, the pick / ban / loading phases, the match with
+      long frames (0x43) at --long-frame-chance per status packet, replay updates (0x4A), then lobby closed (0x45)
+    - obeys the manager's commands: sleep, wake, shutdown and restart (after the current match, as a real server does),
+      and counts the messages and console commands it is sent
+    - reconnects if the manager drops the connection
+
+The manager treats each as the instance whose game port it announces. Instances are svr_starting_gamePort + id - 1, so
+with the default configuration --first-port 10001 and --count svr_total line the simulated servers up with the
+manager's. The manager still tries to launch the real servers, so it's best run with them disabled, or not installed.
+
+As a library, the packet builders build the packets the manager's parser reads, for benchmarks and tests:
+    from benchmarks.game_server_simulator import SimulatedFleet, MatchScript, status_packet
+    fleet = SimulatedFleet(count=200, manager_port=1134, rate=4, script=MatchScript(time_scale=0.1))
+    await fleet.run(duration=60)
+    print(fleet.summary())
+
+Usage:
+    python benchmarks/game_server_simulator.py [--count 10] [--manager-host 127.0.0.1] [--manager-port 1134] [--first-port 10001]
+        [--rate 4] [--players 10] [--time-scale 1] [--long-frame-chance 0.01] [--duration 0]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cogs.handlers.events import GameStatus, GamePhase, GameServerCommands
+
+COMMAND_SHUTDOWN = GameServerCommands.SHUTDOWN_BYTES.value[0]
+COMMAND_RESTART = GameServerCommands.RESTART_BYTES.value[0]
+COMMAND_SLEEP = GameServerCommands.SLEEP_BYTES.value[0]
+COMMAND_WAKE = GameServerCommands.WAKE_BYTES.value[0]
+COMMAND_MESSAGE = GameServerCommands.MESSAGE_BYTES.value[0]
+COMMAND_CONSOLE = GameServerCommands.COMMAND_BYTES.value[0]
+COMMAND_NAMES = {COMMAND_SHUTDOWN: 'shutdown', COMMAND_RESTART: 'restart', COMMAND_SLEEP: 'sleep', COMMAND_WAKE: 'wake',
+                 COMMAND_MESSAGE: 'message', COMMAND_CONSOLE: 'command'}
+RECONNECT_DELAY = 1     # seconds between attempts to connect to the manager
+MAPS = ['caldavar', 'midwars', 'riftwars']
+MODES = ['normal', 'single draft', 'all random', 'captains mode']
+
+
+"""Packet builders. Each returns the packet, without the length prefix (see frame)."""
+
+def frame(packet):
+    return len(packet).to_bytes(2, 'little') + packet
+
+
+def announce_packet(port):
+    """0x40 Server announce."""
+    return bytes([0x40]) + port.to_bytes(2, 'little')
+
+
+def server_closed_packet():
+    """0x41 Server closed."""
+    return bytes([0x41])
+
+
+def status_packet(status, game_phase, uptime=0, cpu_util=0.0, match_started=False, players=()):
+    """
+    0x42 Server status, laid out as GameManagerParser.server_status reads it.
+
+    Args:
+        players (list): dicts with account_id, ip, name, location, and optionally minping / avgping / maxping.
+    """
+    packet = bytearray(54)
+    packet[0] = 0x42
+    packet[1] = status & 0xFF
+    packet[2:6] = (uptime & 0xFFFFFFFF).to_bytes(4, 'little')
+    packet[6:10] = int(cpu_util * 100).to_bytes(4, 'little')
+    packet[10] = len(players)
+    packet[11] = 1 if match_started else 0
+    packet[40] = game_phase & 0xFF
+    packet[48:52] = b'\xff\xff\xff\xff'
+    packet[53] = len(players)
+    for player in players:
+        packet += player['account_id'].to_bytes(4, 'little')
+        packet += player['ip'].encode() + b'\x00' + player['name'].encode() + b'\x00' + player['location'].encode() + b'\x00'
+        for ping in (player.get('minping', 30), player.get('avgping', 45), player.get('maxping', 80)):
+            packet += ping.to_bytes(2, 'little')
+        packet += bytes(16)     # reliable / unreliable packet counters
+    return bytes(packet)
+
+
+def long_frame_packet(skipped_ms):
+    """0x43 Long frame."""
+    return bytes([0x43]) + min(skipped_ms, 0xFFFF).to_bytes(2, 'little')
+
+
+def lobby_created_packet(match_id, map_name, game_name, mode):
+    """0x44 Lobby created."""
+    return bytes([0x44]) + match_id.to_bytes(4, 'little') + b'\x00' + map_name.encode() + b'\x00' + game_name.encode() + b'\x00' + mode.encode() + b'\x00' + b'\x00'
+
+
+def lobby_closed_packet():
+    """0x45 Lobby closed."""
+    return bytes([0x45])
+
+
+def replay_update_packet(match_id, progress):
+    """0x4A Replay update, naming the match's replay directory, which is where the manager takes the match id from."""
+    return bytes([0x4A]) + f"replays/{match_id}/M{match_id}.honreplay".encode() + b'\x00' + bytes([progress & 0xFF])
+
+
+def fake_player(rng, number):
+    return {
+        'account_id': rng.randint(1, 10_000_000),
+        'ip': f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+        'name': f"player{number}",
+        'location': rng.choice(['AU', 'NEWERTH', 'EU', 'US']),
+        'minping': rng.randint(10, 60),
+        'avgping': rng.randint(40, 120),
+        'maxping': rng.randint(100, 300)
+    }
+
+
+class MatchScript:
+    """The match lifecycle the simulated servers play, in seconds per phase, multiplied by time_scale."""
+    PHASES = [
+        (GamePhase.IN_LOBBY, 20),
+        (GamePhase.BANNING_PHASE, 10),
+        (GamePhase.PICKING_PHASE, 20),
+        (GamePhase.LOADING_INTO_MATCH, 10),
+        (GamePhase.PREPERATION_PHASE, 10),
+        (GamePhase.MATCH_STARTED, 120),
+        (GamePhase.GAME_ENDING, 10),
+        (GamePhase.GAME_ENDED, 10)
+    ]
+
+    def __init__(self, time_scale=1.0, idle_seconds=(10, 30), players=10, long_frame_chance=0.01, phases=None):
+        """
+        Args:
+            time_scale (float): multiplies every phase and idle time. 0.1 plays matches ten times faster.
+            idle_seconds (tuple): the range of seconds a server waits between matches, picked at random.
+            players (int): the players in a full lobby.
+            long_frame_chance (float): the chance of a long frame with each status packet, during a match.
+            phases (list): (GamePhase, seconds) in the order played, instead of PHASES.
+        """
+        self.time_scale = time_scale
+        self.idle_seconds = idle_seconds
+        self.players = players
+        self.long_frame_chance = long_frame_chance
+        self.phases = phases or self.PHASES
+
+    def idle_time(self, rng):
+        return rng.uniform(*self.idle_seconds) * self.time_scale
+
+
+class SimulatedGameServer:
+    def __init__(self, port, manager_port, manager_host="127.0.0.1", rate=4, script=None, seed=None, reconnect=True):
+        """
+        Args:
+            port (int): the game port the server announces.
+            rate (float): status packets a second.
+        """
+        self.port = port
+        self.manager_host = manager_host
+        self.manager_port = manager_port
+        self.rate = rate
+        self.script = script or MatchScript()
+        self.rng = random.Random(port if seed is None else seed)
+        self.reconnect = reconnect
+        self.started = time.monotonic()
+        self.writer = None
+        self.status = GameStatus.READY.value
+        self.game_phase = GamePhase.IDLE.value
+        self.players = []
+        self.match_id = None
+        self.sleeping = False
+        self.shutdown_requested = None     # 'shutdown' or 'restart', carried out once the server is idle
+        self.stopped = False
+        self.sent = Counter()               # packets sent, by packet type
+        self.commands = Counter()           # commands received, by name
+        self.matches = 0
+        self.connects = 0
+
+    async def run(self, stop):
+        """Connect, and keep the server running until `stop` is set, or the server is shut down."""
+        while not stop.is_set() and not self.stopped:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.manager_host, self.manager_port)
+            except OSError:
+                if not self.reconnect:
+                    return
+                await self.wait(stop, RECONNECT_DELAY)
+                continue
+            self.connects += 1
+            self.send(announce_packet(self.port))
+            tasks = [asyncio.create_task(self.stream_status(stop)), asyncio.create_task(self.play_matches(stop)), asyncio.create_task(self.read_commands(reader))]
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait(tasks + [stopping], return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks + [stopping]:
+                task.cancel()
+            self.writer.close()
+            self.writer = None
+            if self.shutdown_requested == 'restart':
+                # a restarted server comes back as a fresh process
+                self.shutdown_requested = None
+                self.reset()
+                self.started = time.monotonic()
+                self.stopped = False
+            elif not self.reconnect:
+                return
+            if not stop.is_set() and not self.stopped:
+                await self.wait(stop, RECONNECT_DELAY)
+
+    @staticmethod
+    async def wait(stop, seconds):
+        try:
+            await asyncio.wait_for(stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def send(self, packet):
+        if self.writer is None or self.writer.is_closing():
+            return
+        self.writer.write(frame(packet))
+        self.sent[packet[0]] += 1
+
+    def reset(self):
+        self.status = GameStatus.SLEEPING.value if self.sleeping else GameStatus.READY.value
+        self.game_phase = GamePhase.IDLE.value
+        self.players = []
+        self.match_id = None
+
+    async def stream_status(self, stop):
+        interval = 1 / self.rate
+        # spread out, as real servers aren't in step
+        await asyncio.sleep(self.rng.uniform(0, interval))
+        while not stop.is_set():
+            in_match = self.game_phase == GamePhase.MATCH_STARTED.value
+            cpu_util = self.rng.uniform(20, 60) if in_match else self.rng.uniform(0.5, 3)
+            self.send(status_packet(self.status, self.game_phase, uptime=int((time.monotonic() - self.started) * 1000),
+                                    cpu_util=cpu_util, match_started=in_match, players=self.players))
+            if in_match and self.rng.random() < self.script.long_frame_chance:
+                self.send(long_frame_packet(self.rng.randint(50, 400)))
+            try:
+                await self.writer.drain()
+            except (ConnectionError, AttributeError):
+                return
+            await asyncio.sleep(interval)
+
+    async def play_matches(self, stop):
+        while not stop.is_set():
+            await asyncio.sleep(self.script.idle_time(self.rng))
+            if self.shutdown_requested:
+                self.close()
+                return
+            if self.sleeping:
+                continue
+            await self.play_match()
+            if self.shutdown_requested:
+                self.close()
+                return
+
+    async def play_match(self):
+        self.matches += 1
+        self.match_id = self.rng.randint(1_000_000, 0xFFFFFFFF)
+        self.status = GameStatus.OCCUPIED.value
+        self.send(lobby_created_packet(self.match_id, self.rng.choice(MAPS), f"Simulated game {self.port}-{self.matches}", self.rng.choice(MODES)))
+        for phase, seconds in self.script.phases:
+            self.game_phase = phase.value
+            seconds *= self.script.time_scale
+            if phase == GamePhase.IN_LOBBY:
+                # players join through the lobby phase
+                for number in range(self.script.players):
+                    await asyncio.sleep(seconds / self.script.players)
+                    self.players = self.players + [fake_player(self.rng, number)]
+                continue
+            if phase == GamePhase.GAME_ENDING:
+                for progress in (25, 50, 75, 100):
+                    self.send(replay_update_packet(self.match_id, progress))
+                    await asyncio.sleep(seconds / 4)
+                continue
+            await asyncio.sleep(seconds)
+        self.send(lobby_closed_packet())
+        self.reset()
+
+    async def read_commands(self, reader):
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), 'little')
+                command = await reader.readexactly(length)
+                if command:
+                    self.handle_command(command)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+    def handle_command(self, command):
+        kind = command[0]
+        self.commands[COMMAND_NAMES.get(kind, f"0x{kind:02x}")] += 1
+        if kind == COMMAND_SLEEP:
+            self.sleeping = True
+            if self.status == GameStatus.READY.value:
+                self.status = GameStatus.SLEEPING.value
+        elif kind == COMMAND_WAKE:
+            self.sleeping = False
+            if self.status == GameStatus.SLEEPING.value:
+                self.status = GameStatus.READY.value
+        elif kind in (COMMAND_SHUTDOWN, COMMAND_RESTART):
+            self.shutdown_requested = 'restart' if kind == COMMAND_RESTART else 'shutdown'
+            if self.match_id is None:
+                self.close()
+
+    def close(self):
+        """Shut down, as the real server does: announce it, and drop the connection."""
+        self.send(server_closed_packet())
+        if self.shutdown_requested != 'restart':
+            self.stopped = True
+        if self.writer:
+            self.writer.close()
+
+
+class SimulatedFleet:
+    def __init__(self, count, manager_port, manager_host="127.0.0.1", first_port=10001, rate=4, script=None, connect_spread=1.0):
+        """
+        Args:
+            count (int): simulated game servers, on game ports first_port to first_port + count - 1.
+            connect_spread (float): seconds the servers' first connections are spread over, so they don't all arrive at once.
+        """
+        self.script = script or MatchScript()
+        self.connect_spread = connect_spread
+        self.servers = [SimulatedGameServer(first_port + number, manager_port, manager_host=manager_host, rate=rate, script=self.script) for number in range(count)]
+        self.stop = None
+
+    async def run(self, duration=None):
+        """Run the fleet for `duration` seconds, or until stop() is called."""
+        self.stop = asyncio.Event()
+        tasks = [asyncio.create_task(self.start_server(number, server)) for number, server in enumerate(self.servers)]
+        if duration:
+            asyncio.get_running_loop().call_later(duration, self.stop.set)
+        await asyncio.gather(*tasks)
+
+    async def start_server(self, number, server):
+        await asyncio.sleep(self.connect_spread * number / max(1, len(self.servers)))
+        await server.run(self.stop)
+
+    def stop_fleet(self):
+        if self.stop:
+            self.stop.set()
+
+    def summary(self):
+        sent = Counter()
+        commands = Counter()
+        for server in self.servers:
+            sent.update(server.sent)
+            commands.update(server.commands)
+        return {
+            'servers': len(self.servers),
+            'connected': sum(1 for server in self.servers if server.writer is not None),
+            'connects': sum(server.connects for server in self.servers),
+            'matches': sum(server.matches for server in self.servers),
+            'packets_sent': {f"0x{packet_type:02x}": count for packet_type, count in sorted(sent.items())},
+            'commands_received': dict(commands)
+        }
+
+
+async def run_cli(args):
+    script = MatchScript(time_scale=args.time_scale, players=args.players, long_frame_chance=args.long_frame_chance)
+    fleet = SimulatedFleet(args.count, args.manager_port, manager_host=args.manager_host, first_port=args.first_port, rate=args.rate, script=script)
+    fleet_task = asyncio.create_task(fleet.run(duration=args.duration or None))
+    started = time.monotonic()
+    try:
+        while not fleet_task.done():
+            await asyncio.wait([fleet_task], timeout=10)
+            summary = fleet.summary()
+            print(f"[{time.monotonic() - started:>6.0f}s] connected {summary['connected']}/{summary['servers']}, matches {summary['matches']}, "
+                  f"packets {summary['packets_sent']}, commands {summary['commands_received']}", flush=True)
+    finally:
+        fleet.stop_fleet()
+        await fleet_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated game servers, to exercise the manager without the HoN server binary")
+    parser.add_argument("--count", type=int, default=10, help="Simulated game servers")
+    parser.add_argument("--manager-host", default="127.0.0.1")
+    parser.add_argument("--manager-port", type=int, default=1134, help="The manager's svr_managerPort")
+    parser.add_argument("--first-port", type=int, default=10001, help="The first game port announced (svr_starting_gamePort)")
+    parser.add_argument("--rate", type=float, default=4, help="Status packets a second, per server")
+    parser.add_argument("--players", type=int, default=10, help="Players in a full lobby")
+    parser.add_argument("--time-scale", type=float, default=1, help="Multiplies the match phase and idle times. 0.1 plays matches ten times faster")
+    parser.add_argument("--long-frame-chance", type=float, default=0.01, help="Chance of a long frame with each status packet, during a match")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds to run for. 0 runs until interrupted")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_cli(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+Micro benchmarks of the manager's hot paths, with results to compare between branches.
+
+Each benchmark times one call of a path the manager runs many times a second, or for every API request:
+    server_status[N players]        GameManagerParser.server_status, with 0, 5 and 10 players, on an unchanged state
+    game_state_update[changed]      GameState.update changing a monitored key, and its listener dispatch
+    game_state_update[unchanged]    GameState.update with what the state already holds
+    handle_packet                   ClientConnection.handle_packet, dispatching a status packet to the parser
+    increment_skipped_frames        GameServer.increment_skipped_frames, with --history entries already recorded
+    manager_status                  GameServerManager.manager_status, over --instances game servers
+    pretty_status_for_webui         GameServer.get_pretty_status_for_webui, for each of --instances game servers
+    parse_chat                      MatchParser.parse_chat, on a UTF-16 match log of --log-lines lines
+    autoping_response               AutoPingListener building and sending the response to an AutoPing request
+    verify_token+has_permission     the API's authorisation path, for a token already verified with discord
+
+The game servers are real GameServer objects, with their background tasks cancelled. The benchmarks run in a scratch
+home directory, so their logs, fleet state table and roles database never touch the manager's.
+
+Each benchmark is called in rounds, with enough calls in a round for it to take --min-time, and the time per call
+is the median of --rounds rounds. --output saves the results as JSON. --compare reads the results of another run
+(another branch), and exits with 1 if any benchmark got slower by more than --threshold percent, or the threshold set
+for it with --threshold-for.
+
+Usage:
+    python benchmarks/hot_paths.py [--output results.json] [--compare baseline.json] [--threshold 10]
+        [--threshold-for parse_chat=25 ...] [--filter server_status ...] [--rounds 7] [--min-time 0.05]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+HOME_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HOME_PATH))
+
+BENCHMARKS = []     # (name, setup coroutine function, argument)
+DISCORD_USER_ID = "123456789012345678"
+
+
+def benchmark(name, *arguments):
+    """
+    Register a benchmark. The decorated coroutine function sets it up, and returns the function to time, which may be
+    a coroutine function. With arguments, one benchmark is registered for each, with the argument in its name.
+    """
+    def register(setup):
+        for argument in arguments or [None]:
+            BENCHMARKS.append((name.format(argument), setup, argument))
+        return setup
+    return register
+
+
+class Fixture:
+    """What the benchmarks share: the scratch home, the configuration and the game servers."""
+    def __init__(self, home, args):
+        self.home = home
+        self.args = args
+        self.rng = random.Random(1)
+        self.global_config = {
+            'hon_data': {
+                'hon_install_directory': home / "hon",
+                'hon_home_directory': home / "hon",
+                'hon_logs_directory': home / "hon" / "logs",
+                'hon_executable_name': "hon_x64",
+                'svr_login': "benchmark",
+                'svr_password': "",
+                'svr_name': "Benchmark",
+                'svr_ip': "127.0.0.1",
+                'svr_location': "NEWERTH",
+                'svr_total': args.instances,
+                'svr_total_per_core': 1.0,
+                'svr_override_affinity': False,
+                'svr_starting_gamePort': 10001,
+                'svr_starting_voicePort': 10061,
+                'svr_enableBotMatch': True,
+                'svr_restart_between_games': False,
+                'man_enableProxy': False,
+                'man_use_cgroups': False
+            }
+        }
+        self.game_servers = {}
+
+    def create_game_server(self, instance_id):
+        from cogs.game.game_server import GameServer
+        from cogs.handlers.events import EventBus
+        game_server = GameServer(instance_id, 10000 + instance_id, self.global_config, None, EventBus())
+        game_server.cancel_tasks()
+        return game_server
+
+    def populate(self):
+        """--instances game servers, in the mix of states a busy fleet is in."""
+        from cogs.handlers.events import GameStatus, GamePhase
+        from benchmarks.game_server_simulator import fake_player
+        states = [
+            (GameStatus.READY, GamePhase.IDLE, 0),
+            (GameStatus.OCCUPIED, GamePhase.IN_LOBBY, 4),
+            (GameStatus.OCCUPIED, GamePhase.PICKING_PHASE, 10),
+            (GameStatus.OCCUPIED, GamePhase.MATCH_STARTED, 10),
+            (GameStatus.OCCUPIED, GamePhase.MATCH_STARTED, 9),
+            (GameStatus.SLEEPING, GamePhase.IDLE, 0),
+            (GameStatus.STARTING, GamePhase.UNKNOWN, 0)
+        ]
+        for instance_id in range(1, self.args.instances + 1):
+            status, game_phase, players = states[instance_id % len(states)]
+            game_server = self.create_game_server(instance_id)
+            game_server.game_state._state.update({
+                'status': status.value,
+                'game_phase': game_phase.value,
+                'num_clients': players,
+                'match_started': 1 if game_phase == GamePhase.MATCH_STARTED else 0,
+                'current_match_id': 1000 + instance_id if players else 0,
+                'uptime': self.rng.randint(0, 48 * 3600 * 1000),
+                'cpu_core_util': self.rng.uniform(0, 100),
+                'players': [fake_player(self.rng, number) for number in range(players)]
+            })
+            game_server.game_state._state['match_info']['duration'] = self.rng.randint(0, 3600) if players else 0
+            self.game_servers[instance_id] = game_server
+
+
+@benchmark("server_status[{} players]", 0, 5, 10)
+async def server_status(fixture, players):
+    from cogs.handlers.events import GameStatus, GamePhase
+    from benchmarks.game_server_simulator import status_packet, fake_player
+    game_server = fixture.create_game_server(900 + players)
+    # a match id, so the first status packet doesn't look for one in the game server's logs
+    game_server.game_state._state['current_match_id'] = 1000
+    packet = status_packet(GameStatus.OCCUPIED.value if players else GameStatus.READY.value,
+                           GamePhase.IN_LOBBY.value if players else GamePhase.IDLE.value,
+                           uptime=3600000, cpu_util=25.0, players=[fake_player(fixture.rng, number) for number in range(players)])
+    parser = game_server.game_manager_parser
+    # the state changes once, as the server's status is first received, and is unchanged from then on, as between changes
+    await parser.server_status(packet, game_server=game_server)
+    await asyncio.sleep(0)
+
+    async def call():
+        await parser.server_status(packet, game_server=game_server)
+    return call
+
+
+@benchmark("game_state_update[{}]", "changed", "unchanged")
+async def game_state_update(fixture, kind):
+    from cogs.game.game_server import GameState
+    game_server = fixture.game_servers[1]
+    game_state = GameState(950, game_server.config.local)
+    game_state.clear()
+
+    async def listener(key, value, old_value):
+        pass
+    game_state.add_listener(listener)
+    updates = [{'status': 1, 'num_clients': 0, 'uptime': 1000}, {'status': 3, 'num_clients': 1, 'uptime': 2000}]
+    if kind == "unchanged":
+        updates = updates[:1]
+    count = [0]
+
+    async def call():
+        count[0] += 1
+        game_state.update(updates[count[0] % len(updates)])
+        # the listener tasks run before the next update, as they would between packets
+        await asyncio.sleep(0)
+    return call
+
+
+@benchmark("handle_packet")
+async def handle_packet(fixture, _):
+    from cogs.TCP.game_packet_lsnr import ClientConnection
+    from benchmarks.game_server_simulator import status_packet, fake_player
+    game_server = fixture.create_game_server(960)
+    game_server.game_state._state['current_match_id'] = 1000
+    connection = ClientConnection(None, None, ("127.0.0.1", 0), None)
+    connection.set_game_server(game_server=game_server)
+    data = status_packet(3, 6, uptime=3600000, cpu_util=50.0, match_started=False, players=[fake_player(fixture.rng, number) for number in range(10)])
+    packet = (len(data), data)
+    await connection.handle_packet(packet)
+    await asyncio.sleep(0)
+
+    async def call():
+        await connection.handle_packet(packet)
+    return call
+
+
+@benchmark("increment_skipped_frames")
+async def increment_skipped_frames(fixture, _):
+    from cogs.handlers.events import GamePhase
+    game_server = fixture.create_game_server(970)
+    game_server.game_state._state['game_phase'] = GamePhase.MATCH_STARTED.value
+    now = datetime.now().timestamp()
+    # spread over the last day, so none are old enough to be removed
+    game_server.game_state._performance['skipped_frames_detailed'] = {now - 86000 + index * 86000 / fixture.args.history: 50 for index in range(fixture.args.history)}
+    count = [0]
+
+    async def call():
+        count[0] += 1
+        await game_server.increment_skipped_frames(50, now + count[0] / 1000)
+    return call
+
+
+@benchmark("manager_status")
+async def manager_status(fixture, _):
+    from cogs.game.game_server_manager import GameServerManager
+    # manager_status only reads the manager's game servers
+    manager = SimpleNamespace(game_servers=fixture.game_servers)
+
+    def call():
+        GameServerManager.manager_status(manager)
+    return call
+
+
+@benchmark("pretty_status_for_webui")
+async def pretty_status_for_webui(fixture, _):
+    game_servers = list(fixture.game_servers.values())
+
+    def call():
+        [game_server.get_pretty_status_for_webui() for game_server in game_servers]
+    return call
+
+
+@benchmark("parse_chat")
+async def parse_chat(fixture, _):
+    from cogs.game.match_parser import MatchParser
+    log_path = fixture.home / "M1000.log"
+    lines = [f'PLAYER_CONNECT player:{number} name:"player{number}" id:{100000 + number} psr:{1500 + number}.0000\n' for number in range(10)]
+    for line_number in range(fixture.args.log_lines - len(lines)):
+        player = line_number % 10
+        if line_number % 5 == 0:
+            lines.append(f'PLAYER_CHAT time:{line_number * 50} player:{player} target:"{"team" if player % 2 else "all"}" msg:"message {line_number} from player {player}"\n')
+        else:
+            lines.append(f'PLAYER_POSITION time:{line_number * 50} player:{player} x:{line_number % 16000} y:{(line_number * 7) % 16000}\n')
+    log_path.write_text("".join(lines), encoding='utf-16-le')
+    parser = MatchParser(1000, log_path)
+
+    def call():
+        parser.player_details = {}
+        parser.parse_chat()
+    return call
+
+
+@benchmark("autoping_response")
+async def autoping_response(fixture, _):
+    from cogs.TCP.auto_ping_lsnr import AutoPingListener
+    listener = AutoPingListener({'hon_data': {'svr_name': "Benchmark", 'svr_version': "4.10.8.0"}}, 0)
+    request = bytearray(46)
+    request[43] = 0xCA
+    request[44:46] = b'\x12\x34'
+    request = bytes(request)
+    address = ("127.0.0.1", 50000)
+
+    class Sink:
+        """Stands in for the listener's socket."""
+        def sendto(self, data, address):
+            pass
+    sink = Sink()
+
+    def call():
+        listener._handle_datagram(request, address, sink)
+    return call
+
+
+@benchmark("verify_token+has_permission")
+async def verify_token_has_permission(fixture, _):
+    from cogs.connectors import api_server
+    token = "benchmark-token"
+    api_server.user_info_cache[token] = {'data': {"token": token, "user_info": {"id": DISCORD_USER_ID, "username": "owner"}}, 'timestamp': datetime.now()}
+
+    async def call():
+        token_and_user_info = await api_server.verify_token(None, token)
+        if not api_server.has_permission(token_and_user_info["user_info"], "control"):
+            raise RuntimeError("The benchmark user is missing the control permission.")
+    return call
+
+
+async def time_calls(call, asynchronous, number):
+    started = time.perf_counter()
+    if asynchronous:
+        for _ in range(number):
+            await call()
+    else:
+        for _ in range(number):
+            call()
+    return time.perf_counter() - started
+
+
+async def autorange(call, asynchronous, min_time):
+    """As timeit's autorange: the fewest calls, of 1, 2, 5, 10, 20, 50..., that take min_time."""
+    scale = 1
+    while True:
+        for multiple in (1, 2, 5):
+            number = scale * multiple
+            if await time_calls(call, asynchronous, number) >= min_time:
+                return number
+        scale *= 10
+
+
+async def measure(call, rounds, min_time):
+    """Seconds per call: the median, fastest and slowest of the rounds, and the calls in each round."""
+    asynchronous = asyncio.iscoroutinefunction(call)
+    number = await autorange(call, asynchronous, min_time)
+    timings = []
+    for _ in range(rounds):
+        gc.collect()
+        gc.disable()
+        try:
+            timings.append(await time_calls(call, asynchronous, number) / number)
+        finally:
+            gc.enable()
+    return statistics.median(timings), min(timings), max(timings), number
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=HOME_PATH).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+
+async def run(args, home):
+    from cogs.misc.logger import set_roles_database
+    from cogs.db.roles_db_connector import RolesDatabase
+    roles_database = RolesDatabase(str(home / "roles.db"))
+    roles_database.add_default_data(discord_id=DISCORD_USER_ID)
+    set_roles_database(roles_database)
+
+    fixture = Fixture(home, args)
+    fixture.populate()
+    selected = [entry for entry in BENCHMARKS if not args.filter or any(name in entry[0] for name in args.filter)]
+
+    results = {}
+    print(f"{'benchmark':<32}{'median':>12}{'min':>12}{'max':>12}{'calls/round':>13}")
+    for name, setup, argument in selected:
+        call = await setup(fixture, argument)
+        median, fastest, slowest, number = await measure(call, args.rounds, args.min_time)
+        results[name] = {'median': median, 'min': fastest, 'max': slowest, 'rounds': args.rounds, 'calls_per_round': number}
+        print(f"{name:<32}{format_time(median):>12}{format_time(fastest):>12}{format_time(slowest):>12}{number:>13}")
+    return results
+
+
+def compare(results, baseline, threshold, thresholds):
+    """Print the change in each benchmark's median from the baseline. Returns the benchmarks slower than their threshold."""
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'the baseline'} ({baseline.get('created', 'unknown date')}):")
+    print(f"{'benchmark':<32}{'baseline':>12}{'now':>12}{'change':>10}{'allowed':>10}")
+    for name, result in results.items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            print(f"{name:<32}{'-':>12}{format_time(result['median']):>12}{'new':>10}")
+            continue
+        change = (result['median'] / before['median'] - 1) * 100
+        allowed = thresholds.get(name, threshold)
+        regressed = change > allowed
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<32}{format_time(before['median']):>12}{format_time(result['median']):>12}{change:>+9.1f}%{allowed:>9.0f}%{'  REGRESSION' if regressed else ''}")
+    for name in baseline['benchmarks']:
+        if name not in results:
+            print(f"{name:<32}{'not run':>12}")
+    return regressions
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        name, _, percent = value.rpartition("=")
+        if not name:
+            raise argparse.ArgumentTypeError(f"--threshold-for takes <benchmark>=<percent>, not {value}")
+        thresholds[name] = float(percent)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the manager's hot paths")
+    parser.add_argument("--output", help="Save the results as JSON, to compare other runs with")
+    parser.add_argument("--compare", help="Results saved by --output, from another run. Exits with 1 if a benchmark got slower than allowed")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent a benchmark's median may get slower by, compared with --compare")
+    parser.add_argument("--threshold-for", action="append", default=[], metavar="BENCHMARK=PERCENT", help="The threshold for one benchmark")
+    parser.add_argument("--filter", nargs="+", help="Only run the benchmarks with one of these in their name")
+    parser.add_argument("--rounds", type=int, default=7, help="Rounds of calls timed, for each benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Seconds each round takes, at least")
+    parser.add_argument("--instances", type=int, default=100, help="Game servers, for manager_status and pretty_status_for_webui")
+    parser.add_argument("--history", type=int, default=20000, help="Skipped frame entries already recorded, for increment_skipped_frames")
+    parser.add_argument("--log-lines", type=int, default=100000, help="Lines in the match log, for parse_chat")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks, and exit")
+    args = parser.parse_args()
+    thresholds = parse_thresholds(args.threshold_for)
+
+    if args.list:
+        for name, _, _ in BENCHMARKS:
+            print(name)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="honfigurator-benchmark-") as directory:
+        home = Path(directory)
+        # As in main.py, logging and the shared objects are set up before the modules that read them at import are imported.
+        from cogs.misc.logger import set_home, set_logger, set_misc, set_setup, get_logger, stop_logger
+        set_home(home)
+        set_logger(log_file_name='benchmark.log')
+        get_logger().setLevel(logging.WARNING)
+        from cogs.misc.utilities import Misc
+        set_misc(Misc())
+        # the API server module reads the setup environment at import. The benchmarks don't use it, and creating one
+        # looks the host's region up online
+        set_setup(None)
+
+        from cogs.misc.event_loop import create_event_loop
+        loop, _, _ = create_event_loop('auto')
+        try:
+            results = loop.run_until_complete(run(args, home))
+        finally:
+            loop.close()
+            stop_logger()
+
+    output = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(output, indent=2))
+        print(f"\nWrote the results to {args.output}")
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold, thresholds)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than allowed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Log throughput under game server packet load.
+
+Feeds synthetic game server packets (status updates, long frames, unknown packets) through GameManagerParser for a number
+of simulated servers, on one event loop, and reports:
+    - packets handled per second
+    - how long the event loop was held up, p99 and worst case (measured by a 1ms ticker task)
+for the logging set ups below:
+    direct          handlers write from the event loop, as before the queued pipeline
+    queued          handlers run on the writer thread (cogs.misc.logger.start_log_listener)
+    queued-json     as queued, with the file handler writing JSON lines
+and for debug messages on the packet paths built regardless of level (unguarded), against checked first (guarded).
+
+The console is replaced by a sink that blocks for --stall-ms on every --stall-every'th write, standing in for a slow
+terminal, or a disk flush / log rotation. Use --stall-ms 0 to measure the pipeline's CPU cost alone.
+
+Usage:
+    python benchmarks/log_throughput.py [--packets 100000] [--servers 20] [--info-every 10] [--stall-every 200] [--stall-ms 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cogs.misc.logger import FileFormatter, ColorFormatter, JsonFormatter, start_log_listener, stop_logger
+from cogs.TCP.packet_parser import GameManagerParser
+
+STATUS_PACKET = bytes([0x42, 0x03]) + (12345).to_bytes(4, 'little') + (2500).to_bytes(4, 'little') + bytes(44)
+LONG_FRAME_PACKET = bytes([0x43]) + (120).to_bytes(2, 'little')
+UNKNOWN_PACKET = bytes([0x4F, 0x00, 0x00, 0x10, 0x20])
+
+
+class SlowSink:
+    def __init__(self, stall_every, stall_ms):
+        self.stall_every = stall_every
+        self.stall_ms = stall_ms
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        if self.stall_ms and self.writes % self.stall_every == 0:
+            time.sleep(self.stall_ms / 1000)
+
+    def flush(self):
+        pass
+
+
+def make_logger(log_dir, mode, sink):
+    logger = logging.getLogger(f"benchmark-{mode}-{time.monotonic_ns()}")
+    logger.propagate = False
+    file_handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, f"{mode}.log"), maxBytes=10*1024*1024, backupCount=2)
+    file_handler.setFormatter(JsonFormatter() if mode == 'queued-json' else FileFormatter())
+    file_handler.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler(sink)
+    console_handler.setFormatter(ColorFormatter())
+    console_handler.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+    if mode == 'direct':
+        logger.setLevel(logging.INFO)
+    else:
+        start_log_listener(logger)
+    return logger, [file_handler, console_handler]
+
+
+async def measure_stalls(stop, stalls):
+    interval = 0.001
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - before - interval)
+
+
+async def run_load(logger, packets, servers, info_every, guarded):
+    parsers = [GameManagerParser(server_id, logger=logger) for server_id in range(1, servers + 1)]
+    if not guarded:
+        for parser in parsers:
+            parser.debug_enabled = lambda: True
+    load = [STATUS_PACKET] * 8 + [LONG_FRAME_PACKET, UNKNOWN_PACKET]
+
+    stop = asyncio.Event()
+    stalls = []
+    ticker = asyncio.create_task(measure_stalls(stop, stalls))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    for number in range(packets):
+        parser = parsers[number % servers]
+        packet = load[number % len(load)]
+        await parser.handle_packet((len(packet), packet))
+        if info_every and number % info_every == 0:
+            logger.info(f"GameServer #{parser.id} - handled packet {number} ({hex(packet[0])})")
+        if number % 50 == 0:
+            await asyncio.sleep(0)  # let the ticker run, as the listener would between reads
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    stalls.sort()
+    return packets / elapsed, stalls[int(len(stalls) * 0.99)], stalls[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Log throughput under game server packet load")
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--info-every", type=int, default=10, help="Log an INFO line every N packets. 0 to disable")
+    parser.add_argument("--stall-every", type=int, default=200, help="Block every N console writes")
+    parser.add_argument("--stall-ms", type=float, default=5, help="How long each blocked console write takes")
+    args = parser.parse_args()
+
+    print(f"{args.packets} packets across {args.servers} servers, an INFO line every {args.info_every or 'no'} packets, "
+          f"console writes blocking {args.stall_ms}ms every {args.stall_every} writes\n")
+    print(f"{'logging':<14}{'debug lines':<14}{'packets/s':>12}{'p99 loop stall':>18}{'max loop stall':>18}")
+    with tempfile.TemporaryDirectory() as log_dir:
+        for mode in ('direct', 'queued', 'queued-json'):
+            for guarded in (False, True):
+                logger, handlers = make_logger(log_dir, mode, SlowSink(args.stall_every, args.stall_ms))
+                rate, p99_stall, max_stall = asyncio.run(run_load(logger, args.packets, args.servers, args.info_every, guarded))
+                if mode != 'direct':
+                    stop_logger()   # writes out the backlog, outside the timed section
+                for handler in handlers:
+                    handler.close()
+                print(f"{mode:<14}{'guarded' if guarded else 'unguarded':<14}{rate:>12.0f}{p99_stall * 1000:>15.2f} ms{max_stall * 1000:>15.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
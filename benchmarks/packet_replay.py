@@ -0,0 +1,241 @@
+"""
+Replay packet captures into the manager's parsers.
+
+A capture is recorded on a running manager with the CLI command "capture start" / "capture stop" (see
+cogs/TCP/packet_capture.py), and holds the packets it received from its game servers, the cowmaster and the chat server.
+This feeds them, in the order they were received, into GameManagerParser.handle_packet and ManagerChatParser.handle_packet,
+with stand-ins for the game servers and the cowmaster, which keep their state in the manager's GameState. It reports:
+    - packets replayed, and packets a second, by source
+    - time spent in the parser, per packet type
+
+Replaying the same capture gives the same result, so a capture from production doubles as a regression test for parser
+changes: --write-expected saves the state the replay ends in (every game server's state, and what the chat parser
+returned), and --expect compares a replay with it, exiting with 1 if they differ.
+
+Usage:
+    python benchmarks/packet_replay.py <capture> [<capture> ...] [--speed 0] [--repeat 1]
+        [--write-expected expected.json | --expect expected.json]
+
+--speed 1 replays at the speed the packets were received, 10 ten times faster. 0, the default, as fast as possible.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+HOME_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HOME_PATH))
+
+# game state the replay's result leaves out, as it differs from one replay to the next
+UNSTABLE_KEYS = ('skipped_frames_detailed',)
+
+
+def create_game_state(client_id):
+    """
+    The manager's GameState, so a replay runs its update logic as the manager does. Publishing to the fleet state
+    table is left out, so replays don't write to a running manager's table.
+    """
+    from cogs.game.game_server import GameState
+    port = 10000 + client_id
+    local_config = {
+        'name': f"replay-{client_id}",
+        'params': {
+            'svr_port': port,
+            'svr_proxyPort': port,
+            'svr_proxyLocalVoicePort': port + 60,
+            'svr_proxyRemoteVoicePort': port + 60,
+            'man_enableProxy': False,
+            'host_affinity': ''
+        }
+    }
+    game_state = GameState(client_id, local_config)
+    game_state.publish = lambda: None
+    game_state.clear()
+    return game_state
+
+
+class ReplayGameServer:
+    """The parts of GameServer (and CowMaster) the parser calls, around the manager's GameState."""
+    def __init__(self, client_id):
+        from cogs.TCP.packet_parser import GameManagerParser
+        self.id = client_id
+        self.game_state = create_game_state(client_id)
+        self.game_manager_parser = GameManagerParser(client_id, logger=quiet_logger())
+        self.forks = {'succeeded': 0, 'failed': 0}
+
+    def get_dict_value(self, attribute, default=None):
+        if attribute in self.game_state._state:
+            return self.game_state._state[attribute]
+        return self.game_state._performance.get(attribute, default)
+
+    def update_dict_value(self, attribute, value):
+        if attribute not in self.game_state._state and attribute not in self.game_state._performance:
+            raise KeyError(f"Attribute '{attribute}' not found in game_state or performance dictionary.")
+        if attribute in self.game_state._state:
+            self.game_state.update({attribute: value})
+
+    def reset_game_state(self):
+        self.game_state.clear()
+
+    reset_cowmaster_state = reset_game_state
+
+    def reset_skipped_frames(self):
+        self.game_state._performance['now_ingame_skipped_frames'] = 0
+
+    async def increment_skipped_frames(self, frames, time):
+        if self.get_dict_value('game_phase') in [5, 6, 7]:
+            performance = self.game_state._performance
+            performance['total_ingame_skipped_frames'] += frames
+            performance['now_ingame_skipped_frames'] += frames
+            performance['monitored_skipped_frames'] += frames
+            performance['skipped_frames_detailed'][time] = frames
+
+    def fork_acknowledged(self, port, success):
+        self.forks['succeeded' if success else 'failed'] += 1
+
+    def result(self):
+        performance = {key: value for key, value in self.game_state._performance.items() if key not in UNSTABLE_KEYS}
+        return {'state': self.game_state._state, 'performance': performance, 'forks': self.forks}
+
+
+def quiet_logger():
+    logger = logging.getLogger("packet_replay")
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        logger.setLevel(logging.WARNING)
+    return logger
+
+
+class Replay:
+    def __init__(self):
+        from cogs.TCP.packet_parser import ManagerChatParser
+        self.game_servers = {}
+        self.cowmasters = {}
+        self.chat_parser = ManagerChatParser(quiet_logger())
+        self.chat_results = []
+        self.packets = defaultdict(int)         # source name: packets replayed
+        self.parse_time = defaultdict(float)    # "source 0x.." : seconds in the parser
+        self.parse_count = defaultdict(int)
+
+    async def replay(self, path, speed):
+        from cogs.TCP.packet_capture import CaptureReader, SOURCE_GAME_SERVER, SOURCE_COWMASTER, SOURCE_CHAT, SOURCE_NAMES
+        started = time.perf_counter()
+        with CaptureReader(path) as capture:
+            for record in capture:
+                if speed > 0:
+                    delay = record.offset / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                data = record.data
+                if not data:
+                    continue
+                if record.source == SOURCE_CHAT:
+                    packet_type = int.from_bytes(data[:2], byteorder='little')
+                    before = time.perf_counter()
+                    parsed = await self.chat_parser.handle_packet(packet_type, len(data), data, "receiving")
+                    label = f"chat 0x{packet_type:04x}"
+                    if parsed is not None:
+                        self.chat_results.append(parsed)
+                elif record.source in (SOURCE_GAME_SERVER, SOURCE_COWMASTER):
+                    cowmaster = record.source == SOURCE_COWMASTER
+                    clients = self.cowmasters if cowmaster else self.game_servers
+                    client = clients.get(record.client_id)
+                    if client is None:
+                        client = clients[record.client_id] = ReplayGameServer(record.client_id)
+                    before = time.perf_counter()
+                    if cowmaster:
+                        await client.game_manager_parser.handle_packet((len(data), data), cowmaster=client)
+                    else:
+                        await client.game_manager_parser.handle_packet((len(data), data), game_server=client)
+                    label = f"{SOURCE_NAMES[record.source]} 0x{data[0]:02x}"
+                else:
+                    continue
+                self.parse_time[label] += time.perf_counter() - before
+                self.parse_count[label] += 1
+                self.packets[SOURCE_NAMES[record.source]] += 1
+
+    def result(self):
+        return {
+            'game_servers': {str(client_id): client.result() for client_id, client in sorted(self.game_servers.items())},
+            'cowmasters': {str(client_id): client.result() for client_id, client in sorted(self.cowmasters.items())},
+            'chat': self.chat_results
+        }
+
+
+def differences(expected, actual, path=""):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        found = []
+        for key in sorted(set(expected) | set(actual)):
+            if key not in actual:
+                found.append(f"{path}/{key}: missing from the replay")
+            elif key not in expected:
+                found.append(f"{path}/{key}: not expected ({json.dumps(actual[key])[:80]})")
+            else:
+                found.extend(differences(expected[key], actual[key], f"{path}/{key}"))
+        return found
+    if expected != actual:
+        return [f"{path}: expected {json.dumps(expected)[:80]}, replayed {json.dumps(actual)[:80]}"]
+    return []
+
+
+async def run(args):
+    # As in main.py, the shared objects are set up before the modules that read them at import are imported.
+    from cogs.misc.logger import set_home, set_misc
+    set_home(HOME_PATH)
+    from cogs.misc.utilities import Misc
+    set_misc(Misc())
+
+    elapsed = 0
+    for repeat in range(max(args.repeat, 1)):
+        replay = Replay()
+        started = time.perf_counter()
+        for path in args.captures:
+            await replay.replay(path, args.speed)
+        elapsed += time.perf_counter() - started
+
+    packets = sum(replay.packets.values())
+    print(f"{packets} packets from {len(args.captures)} capture(s), replayed {args.repeat} time(s) in {elapsed:.2f}s: "
+          f"{packets * args.repeat / elapsed if elapsed else 0:.0f} packets/s")
+    for source, count in sorted(replay.packets.items()):
+        print(f"    {source:<12}{count:>10} packets")
+    print(f"\n{'packet':<20}{'count':>10}{'mean parse':>14}{'total':>10}")
+    for label in sorted(replay.parse_count):
+        count = replay.parse_count[label]
+        print(f"{label:<20}{count:>10}{replay.parse_time[label] / count * 1e6:>11.1f} us{replay.parse_time[label] * 1000:>7.0f} ms")
+
+    result = json.loads(json.dumps(replay.result(), default=str))
+    if args.write_expected:
+        Path(args.write_expected).write_text(json.dumps(result, indent=2, sort_keys=True))
+        print(f"\nWrote the replay's result to {args.write_expected}")
+    if args.expect:
+        found = differences(json.loads(Path(args.expect).read_text()), result)
+        if found:
+            print(f"\nThe replay differs from {args.expect}:")
+            for difference in found[:50]:
+                print(f"    {difference}")
+            if len(found) > 50:
+                print(f"    ... and {len(found) - 50} more")
+            return 1
+        print(f"\nThe replay matches {args.expect}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay packet captures into the manager's parsers")
+    parser.add_argument("captures", nargs="+", type=Path, help="Capture files, written by the CLI command: capture start / capture stop")
+    parser.add_argument("--speed", type=float, default=0, help="1 replays at the speed the packets were received, 10 ten times faster. 0 as fast as possible")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the captures this many times, for steadier timings")
+    parser.add_argument("--write-expected", help="Save the state the replay ends in, as JSON, to compare later replays with")
+    parser.add_argument("--expect", help="Compare the state the replay ends in with one saved by --write-expected. Exits with 1 if they differ")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Game server packet latency as the number of instances grows, with and without connection shards (man_shards).
+
+For each instance count, and each mode, runs for --duration seconds:
+    - the manager's side: a listener accepting game server connections and reading their server hello, as
+      handle_client_connection does, then reading the connection itself (unsharded, ClientConnection.run) or handing it
+      to --shards connection shards (ClientConnection.run_sharded). Packets are handled by GameManagerParser
+    - --generators processes of simulated game servers, each sending --rate status packets a second, and changing its
+      number of clients once a second
+and reports, for the manager's process:
+    - packets handled per second, by the manager's parser
+    - latency of a state change, from the game server sending it to the manager's parser handling it, p50 and p99
+    - p99 event loop lag
+    - CPU used by the manager's process, and by the shards, in percent of a core
+
+Latency is measured on the packets that change a server's state, which shards forward straight away. Unchanged status
+packets are coalesced by the shards, so aren't comparable. Timestamps are CLOCK_MONOTONIC, which is shared by every
+process on the host. Linux only, for the sharded mode.
+
+Usage:
+    python benchmarks/sharding.py [--instances 50 100 200 400] [--shards 4] [--rate 20] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+HOME_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HOME_PATH))
+
+MODES = ['unsharded', 'sharded']
+BASE_PORT = 20000
+WARM_UP = 3     # seconds for the shards to start and every simulated server to connect
+STAMP = struct.Struct("<dB")    # send time and "state changed" flag, in status packet bytes 12-21, which the parser doesn't read
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def status_packet(num_clients, changed):
+    packet = bytearray(54)
+    packet[0] = 0x42
+    packet[1] = 3 if num_clients else 1
+    packet[2:6] = (12345).to_bytes(4, 'little')
+    packet[6:10] = (2500).to_bytes(4, 'little')
+    packet[10] = num_clients
+    STAMP.pack_into(packet, 12, time.monotonic(), 1 if changed else 0)
+    return len(packet).to_bytes(2, 'little') + bytes(packet)
+
+
+async def simulate_game_server(port, manager_port, rate, seconds):
+    reader, writer = await asyncio.open_connection("127.0.0.1", manager_port)
+    hello = bytes([0x40]) + port.to_bytes(2, 'little')
+    writer.write(len(hello).to_bytes(2, 'little') + hello)
+    interval = 1 / rate
+    deadline = time.monotonic() + seconds
+    num_clients = 0
+    next_change = time.monotonic() + 1
+    # spread out, as real servers aren't in step
+    await asyncio.sleep(interval * (port % 97) / 97)
+    try:
+        while time.monotonic() < deadline:
+            changed = time.monotonic() >= next_change
+            if changed:
+                num_clients = (num_clients + 1) % 10
+                next_change += 1
+            writer.write(status_packet(num_clients, changed))
+            await writer.drain()
+            await asyncio.sleep(interval)
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def run_generator(first_port, count, manager_port, rate, seconds):
+    await asyncio.gather(*(simulate_game_server(first_port + number, manager_port, rate, seconds) for number in range(count)))
+
+
+async def run_manager(mode, instances, shards, rate, duration, generators):
+    import psutil
+    from cogs.misc.logger import set_home
+    set_home(HOME_PATH)
+    from cogs.TCP.packet_parser import GameManagerParser
+    from cogs.TCP.game_packet_lsnr import ClientConnection
+    from cogs.TCP.shard_pool import ShardPool
+
+    quiet = logging.getLogger("benchmark")
+    quiet.addHandler(logging.NullHandler())
+    quiet.propagate = False
+    quiet.setLevel(logging.WARNING)
+
+    handled = [0]
+    latencies = []
+
+    class GameState:
+        def __init__(self):
+            self._state = {'num_clients': 0, 'players': []}
+
+        def update(self, values):
+            self._state.update(values)
+
+    class LatencyParser(GameManagerParser):
+        async def handle_packet(self, packet, game_server=None, cowmaster=None):
+            await super().handle_packet(packet, game_server=game_server, cowmaster=cowmaster)
+            handled[0] += 1
+            sent, changed = STAMP.unpack_from(packet[1], 12)
+            if changed:
+                latencies.append(time.monotonic() - sent)
+
+    class Manager:
+        global_config = {'hon_data': {'man_event_loop': 'auto'}}
+
+        async def remove_client_connection(self, client_connection):
+            pass
+
+        async def start_game_servers(self, game_servers, service_recovery=False):
+            pass
+
+    manager = Manager()
+    pool = ShardPool(manager, shards) if mode == 'sharded' else None
+
+    async def handle_client(reader, writer):
+        connection = ClientConnection(reader, writer, writer.get_extra_info('peername'), manager)
+        length, hello = await connection.receive_packet()
+        port = await GameManagerParser.server_announce(None, hello)
+        game_server = SimpleNamespace(id=port - BASE_PORT + 1, port=port, game_state=GameState(), game_manager_parser=LatencyParser(port, logger=quiet))
+        connection.set_game_server(game_server=game_server)
+        try:
+            if pool:
+                await connection.run_sharded(pool)
+            else:
+                await connection.run(game_server=game_server)
+        except Exception:
+            pass
+
+    lags = []
+    stop = asyncio.Event()
+
+    async def measure_lag():
+        while not stop.is_set():
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - before - 0.01)
+
+    pool_task = asyncio.create_task(pool.run()) if pool else None
+    listener = await asyncio.start_server(handle_client, "127.0.0.1", 0)
+    manager_port = listener.sockets[0].getsockname()[1]
+    per_generator = -(-instances // generators)
+    load = []
+    for number in range(generators):
+        count = min(per_generator, instances - number * per_generator)
+        if count > 0:
+            load.append(subprocess.Popen([sys.executable, __file__, "--generator", str(BASE_PORT + number * per_generator), str(count),
+                                          str(manager_port), str(rate), str(WARM_UP + duration + 1)]))
+    lag_task = asyncio.create_task(measure_lag())
+
+    await asyncio.sleep(WARM_UP)
+    shard_processes = [psutil.Process(shard.process.pid) for shard in pool.shards] if pool else []
+    manager_cpu = time.process_time()
+    shard_cpu = sum(sum(process.cpu_times()[:2]) for process in shard_processes)
+    handled[0] = 0
+    latencies.clear()
+    lags.clear()
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    result = {
+        'packets_per_second': handled[0] / elapsed,
+        'p50_latency_ms': percentile(latencies, 0.5) * 1000,
+        'p99_latency_ms': percentile(latencies, 0.99) * 1000,
+        'p99_loop_lag_ms': percentile(lags, 0.99) * 1000,
+        'manager_cpu': (time.process_time() - manager_cpu) / elapsed * 100,
+        'shard_cpu': (sum(sum(process.cpu_times()[:2]) for process in shard_processes) - shard_cpu) / elapsed * 100
+    }
+
+    stop.set()
+    for process in load:
+        process.terminate()
+        process.wait()
+    listener.close()
+    lag_task.cancel()
+    if pool_task:
+        pool_task.cancel()
+        try:
+            await pool_task
+        except asyncio.CancelledError:
+            pass
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game server packet latency as the number of instances grows, with and without connection shards")
+    parser.add_argument("--instances", type=int, nargs="+", default=[50, 100, 200, 400], help="Simulated game server counts to measure")
+    parser.add_argument("--shards", type=int, default=4, help="Connection shards, in the sharded mode (man_shards)")
+    parser.add_argument("--rate", type=float, default=20, help="Status packets a second, per simulated game server")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to measure each run for")
+    parser.add_argument("--generators", type=int, default=4, help="Processes simulating the game servers")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--generator", nargs=5, type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generator:
+        first_port, count, manager_port, rate, seconds = args.generator
+        asyncio.run(run_generator(int(first_port), int(count), int(manager_port), rate, seconds))
+        return
+
+    if args.child:
+        from cogs.misc.event_loop import create_event_loop
+        loop, _, _ = create_event_loop('auto')
+        result = loop.run_until_complete(run_manager(args.child, args.instances[0], args.shards, args.rate, args.duration, args.generators))
+        print(json.dumps(result))
+        return
+
+    print(f"{args.rate:.0f} status packets a second per game server, a state change a second, {args.shards} shards, {args.duration:.0f}s per run\n")
+    print(f"{'instances':>10}  {'mode':<11}{'handled/s':>11}{'p50 change':>13}{'p99 change':>13}{'p99 loop lag':>15}{'manager CPU':>13}{'shard CPU':>11}")
+    for instances in args.instances:
+        for mode in args.modes:
+            output = subprocess.run([sys.executable, __file__, "--child", mode, "--instances", str(instances), "--shards", str(args.shards),
+                                     "--rate", str(args.rate), "--duration", str(args.duration), "--generators", str(args.generators)],
+                                    capture_output=True, text=True, cwd=HOME_PATH)
+            try:
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                print(f"{instances:>10}  {mode:<11}failed: {output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'no output'}")
+                continue
+            print(f"{instances:>10}  {mode:<11}{result['packets_per_second']:>11.0f}{result['p50_latency_ms']:>10.2f} ms{result['p99_latency_ms']:>10.2f} ms"
+                  f"{result['p99_loop_lag_ms']:>12.2f} ms{result['manager_cpu']:>12.0f}%{result['shard_cpu']:>10.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Local stand-ins for the master server and the chat server, for benchmarking the manager's upstream paths offline.
+
+Master server (HTTP, served with uvicorn as the manager's API is):
+    /server_requester.php   f=replay_auth               server id, session cookie, and this emulator's chat server
+                            f=sm_upload_request         an upload TargetURL on this emulator
+                            f=get_spectator_header      a fixed header
+    /upload/<file name>     the upload sink. Reads and counts the replay, and answers 204
+    /stats_requester.php    f=resubmit_stats            accepts the resubmitted stats
+    /patcher/patcher.php    the latest version, --latest-version, which is 0.0.0.0 by default, so the manager never patches
+
+Chat server (TCP, the manager's chat protocol):
+    0x1600 handshake        answered with 0x1700 (handshake accepted) and 0x1703 (policies)
+    0x1602 server info      the manager is registered, and can be sent replay requests
+    0x2A00 heartbeat        answered with 0x2A01
+    0x1704 replay request   sent to connected managers at --replay-requests a second, for --match-ids
+    0x1603 replay status    the manager's answers. Requests are timed until a final status (uploaded, or a failure)
+
+Each has latency (--latency, plus up to --jitter) and failure injection: the master server answers --failure-rate of
+requests, and the upload sink --upload-failure-rate of uploads, with a 503. The chat server drops a connection with
+--chat-drop-rate chance on each heartbeat, and can drop every connection at once every --storm-every seconds, for
+reconnect storms.
+
+To point a manager at the emulator, set svr_masterServer to <host>:<master port> in its config. The chat server is
+handed out in the replay_auth response.
+
+Usage:
+    python benchmarks/upstream_emulator.py [--host 127.0.0.1] [--master-port 8080] [--chat-port 11031]
+        [--latency 0] [--jitter 0] [--failure-rate 0] [--upload-failure-rate 0] [--chat-drop-rate 0] [--storm-every 0]
+        [--replay-requests 0] [--match-ids 1000 1001] [--summary-every 10]
+
+Requires fastapi, uvicorn and phpserialize (in requirements.txt).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import secrets
+import struct
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qs
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cogs.handlers.events import ReplayStatus
+
+CHAT_HANDSHAKE = 0x1600
+CHAT_SERVER_INFO = 0x1602
+CHAT_REPLAY_STATUS = 0x1603
+CHAT_HANDSHAKE_ACCEPTED = 0x1700
+CHAT_POLICIES = 0x1703
+CHAT_REPLAY_REQUEST = 0x1704
+CHAT_SHUTDOWN_NOTICE = 0x0400
+CHAT_HEARTBEAT = 0x2A00
+CHAT_HEARTBEAT_RECEIVED = 0x2A01
+# replay statuses which end a replay request
+FINAL_REPLAY_STATUSES = {status.value for status in (ReplayStatus.GENERAL_FAILURE, ReplayStatus.DOES_NOT_EXIST, ReplayStatus.INVALID_HOST,
+                                                      ReplayStatus.ALREADY_UPLOADED, ReplayStatus.UPLOAD_COMPLETE)}
+SPECTATOR_HEADER = "HoNfigurator upstream emulator spectator header"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Faults:
+    """Latency and failures injected into a service's answers."""
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def fail(self):
+        return self.failure_rate and self.rng.random() < self.failure_rate
+
+
+class MasterServerEmulator:
+    def __init__(self, host="127.0.0.1", port=8080, chat_address="127.0.0.1", chat_port=11031, faults=None, upload_faults=None,
+                 accounts=None, latest_version="0.0.0.0"):
+        """
+        Args:
+            accounts (dict): login (without the trailing ':') to password. Any login is accepted if None.
+            latest_version (str): the version the patcher endpoint reports.
+        """
+        self.host = host
+        self.port = port
+        self.chat_address = chat_address
+        self.chat_port = chat_port
+        self.faults = faults or Faults()
+        self.upload_faults = upload_faults or Faults()
+        self.accounts = accounts
+        self.latest_version = latest_version
+        self.server_ids = {}        # login: server id, kept for the emulator's life as on the real master server
+        self.requests = Counter()   # by function
+        self.failures = Counter()   # injected, by function
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.server = None
+
+    def build_app(self):
+        import phpserialize
+        from fastapi import FastAPI, Request, Response
+
+        app = FastAPI()
+
+        async def answer(function, build):
+            self.requests[function] += 1
+            faults = self.upload_faults if function == 'upload' else self.faults
+            await faults.delay()
+            if faults.fail():
+                self.failures[function] += 1
+                return Response(status_code=503, content="Service Unavailable (injected)")
+            return build()
+
+        async def form(request):
+            values = {key: value[0] for key, value in parse_qs((await request.body()).decode('utf-8', errors='replace'), keep_blank_values=True).items()}
+            values.update(request.query_params)
+            return values
+
+        def php(value):
+            return Response(content=phpserialize.dumps(value), media_type="text/html")
+
+        @app.post("/server_requester.php")
+        async def server_requester(request: Request):
+            data = await form(request)
+            function = data.get('f', '')
+            if function == 'replay_auth':
+                return await answer(function, lambda: self.replay_auth(data, php))
+            if function == 'sm_upload_request':
+                return await answer(function, lambda: php({
+                    'TargetURL': f"{self.host}:{self.port}/upload/M{data.get('match_id')}.{data.get('file_extension', 'honreplay')}",
+                    'UploadHost': f"{self.host}:{self.port}"
+                }))
+            if function == 'get_spectator_header':
+                return await answer(function, lambda: Response(content=SPECTATOR_HEADER, media_type="text/plain"))
+            self.requests[function] += 1
+            return Response(status_code=400, content=f"Unknown function '{function}'")
+
+        @app.post("/upload/{file_name}")
+        async def upload(file_name: str, request: Request):
+            body = await request.body()
+
+            def accept():
+                self.uploads += 1
+                self.upload_bytes += len(body)
+                return Response(status_code=204)
+            return await answer('upload', accept)
+
+        @app.post("/stats_requester.php")
+        async def stats_requester(request: Request):
+            data = await form(request)
+            match_id = data.get('resubmission_key', '').split('_')[0]
+            return await answer(data.get('f', 'resubmit_stats'), lambda: php({'match_id': match_id, 'resubmitted': 'OK'}))
+
+        @app.post("/patcher/patcher.php")
+        async def patcher(request: Request):
+            return await answer('patcher', lambda: php({'latest': self.latest_version, 'version': self.latest_version}))
+
+        return app
+
+    def replay_auth(self, data, php):
+        from fastapi import Response
+        login = data.get('login', '').rstrip(':')
+        if self.accounts is not None:
+            password = self.accounts.get(login)
+            if password is None or hashlib.md5(password.encode()).hexdigest() != data.get('pass'):
+                return Response(status_code=401, content="Invalid credentials")
+        if login not in self.server_ids:
+            self.server_ids[login] = len(self.server_ids) + 1
+        return php({
+            'server_id': self.server_ids[login],
+            'session': secrets.token_hex(16),
+            'chat_address': self.chat_address,
+            'chat_port': self.chat_port,
+            'leaverthreshold': 0.05
+        })
+
+    async def serve(self):
+        import uvicorn
+        config = uvicorn.Config(self.build_app(), host=self.host, port=self.port, log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        await self.server.serve()
+
+    def stop(self):
+        if self.server:
+            self.server.should_exit = True
+
+    def summary(self):
+        return {
+            'requests': dict(self.requests),
+            'injected_failures': dict(self.failures),
+            'uploads': self.uploads,
+            'upload_bytes': self.upload_bytes
+        }
+
+
+class ChatConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.server_id = None
+        self.server_name = None
+        self.registered = False
+
+    def send(self, msg_type, payload=b''):
+        packet = struct.pack('<H', msg_type) + payload
+        self.writer.write(struct.pack('<H', len(packet)) + packet)
+
+
+class ChatServerEmulator:
+    def __init__(self, host="127.0.0.1", port=11031, faults=None, drop_rate=0.0, storm_every=0, replay_requests=0.0, match_ids=(), seed=None):
+        """
+        Args:
+            faults (Faults): latency added before each answer. Its failure_rate is the chance a handshake is refused, by closing the connection.
+            drop_rate (float): the chance of dropping a connection on each heartbeat.
+            storm_every (float): seconds between dropping every connection at once. 0 never does.
+            replay_requests (float): replay requests a second, sent round robin to the registered managers.
+            match_ids (list): the matches replays are requested for, in turn.
+        """
+        self.host = host
+        self.port = port
+        self.faults = faults or Faults()
+        self.drop_rate = drop_rate
+        self.storm_every = storm_every
+        self.replay_requests = replay_requests
+        self.match_ids = list(match_ids)
+        self.rng = random.Random(seed)
+        self.connections = []
+        self.received = Counter()           # packets received, by type
+        self.handshakes = 0
+        self.drops = 0
+        self.storms = 0
+        self.pending_replays = {}           # (match id, account id): time requested
+        self.replay_results = Counter()     # final replay statuses, by ReplayStatus name
+        self.replay_times = []              # seconds from request to final status
+        self.server = None
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        tasks = []
+        if self.storm_every:
+            tasks.append(asyncio.create_task(self.storms_loop()))
+        if self.replay_requests and self.match_ids:
+            tasks.append(asyncio.create_task(self.replay_requests_loop()))
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stop(self):
+        if self.server:
+            self.server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+
+    async def handle_connection(self, reader, writer):
+        connection = ChatConnection(reader, writer)
+        self.connections.append(connection)
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), 'little')
+                data = await reader.readexactly(length)
+                if len(data) < 2:
+                    continue
+                msg_type = int.from_bytes(data[:2], 'little')
+                self.received[f"0x{msg_type:04x}"] += 1
+                if not await self.handle_packet(connection, msg_type, data):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            writer.close()
+
+    async def handle_packet(self, connection, msg_type, data):
+        """Returns False to drop the connection."""
+        if msg_type == CHAT_HANDSHAKE:
+            await self.faults.delay()
+            if self.faults.fail():
+                return False
+            self.handshakes += 1
+            connection.server_id = int.from_bytes(data[2:6], 'little')
+            connection.send(CHAT_HANDSHAKE_ACCEPTED)
+            connection.send(CHAT_POLICIES, b'\x00\x00\x00\x00')
+        elif msg_type == CHAT_SERVER_INFO:
+            username, _, remaining = data[6:].partition(b'\x00')
+            _, _, remaining = remaining.partition(b'\x00')
+            server_name, _, _ = remaining.partition(b'\x00')
+            connection.server_name = server_name.decode('utf-8', errors='replace')
+            connection.registered = True
+        elif msg_type == CHAT_HEARTBEAT:
+            if self.drop_rate and self.rng.random() < self.drop_rate:
+                self.drops += 1
+                return False
+            await self.faults.delay()
+            connection.send(CHAT_HEARTBEAT_RECEIVED)
+        elif msg_type == CHAT_REPLAY_STATUS:
+            match_id = int.from_bytes(data[2:6], 'little')
+            account_id = int.from_bytes(data[6:10], 'little')
+            status = data[10] if len(data) > 10 else None
+            if status in FINAL_REPLAY_STATUSES:
+                requested = self.pending_replays.pop((match_id, account_id), None)
+                if requested is not None:
+                    self.replay_times.append(time.monotonic() - requested)
+                self.replay_results[ReplayStatus(status).name] += 1
+        return True
+
+    def request_replay(self, connection, match_id, account_id, extension="honreplay"):
+        """Send a 0x1704 replay request, laid out as ManagerChatParser.chat_replay_request reads it."""
+        payload = account_id.to_bytes(4, 'little') + match_id.to_bytes(4, 'little')
+        payload += extension.encode() + b'\x00' + b'emulator\x00' + b'replays\x00' + b'\x01\x00' + b'\x00'
+        self.pending_replays[(match_id, account_id)] = time.monotonic()
+        connection.send(CHAT_REPLAY_REQUEST, payload)
+
+    async def replay_requests_loop(self):
+        interval = 1 / self.replay_requests
+        number = 0
+        while True:
+            await asyncio.sleep(interval)
+            registered = [connection for connection in self.connections if connection.registered]
+            if not registered:
+                continue
+            connection = registered[number % len(registered)]
+            self.request_replay(connection, self.match_ids[number % len(self.match_ids)], account_id=100000 + number)
+            number += 1
+
+    async def storms_loop(self):
+        while True:
+            await asyncio.sleep(self.storm_every)
+            self.storms += 1
+            for connection in list(self.connections):
+                connection.send(CHAT_SHUTDOWN_NOTICE)
+                connection.writer.close()
+
+    def summary(self):
+        return {
+            'connected': len(self.connections),
+            'registered': sum(1 for connection in self.connections if connection.registered),
+            'handshakes': self.handshakes,
+            'packets_received': dict(self.received),
+            'drops': self.drops,
+            'storms': self.storms,
+            'replay_requests_pending': len(self.pending_replays),
+            'replay_results': dict(self.replay_results),
+            'replay_p50_seconds': round(percentile(self.replay_times, 0.5), 4),
+            'replay_p99_seconds': round(percentile(self.replay_times, 0.99), 4)
+        }
+
+
+async def run_cli(args):
+    master = MasterServerEmulator(
+        host=args.host, port=args.master_port, chat_address=args.host, chat_port=args.chat_port,
+        faults=Faults(args.latency, args.jitter, args.failure_rate), upload_faults=Faults(args.latency, args.jitter, args.upload_failure_rate),
+        latest_version=args.latest_version
+    )
+    chat = ChatServerEmulator(
+        host=args.host, port=args.chat_port, faults=Faults(args.latency, args.jitter), drop_rate=args.chat_drop_rate,
+        storm_every=args.storm_every, replay_requests=args.replay_requests, match_ids=args.match_ids
+    )
+    tasks = [asyncio.create_task(master.serve()), asyncio.create_task(chat.serve())]
+    print(f"Master server emulator on http://{args.host}:{args.master_port} (set svr_masterServer to {args.host}:{args.master_port}), chat server emulator on {args.host}:{args.chat_port}", flush=True)
+    try:
+        while not any(task.done() for task in tasks):
+            await asyncio.wait(tasks, timeout=args.summary_every)
+            print(json.dumps({'master': master.summary(), 'chat': chat.summary()}), flush=True)
+    finally:
+        master.stop()
+        chat.stop()
+        await asyncio.wait(tasks, timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for the master server and the chat server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--master-port", type=int, default=8080)
+    parser.add_argument("--chat-port", type=int, default=11031)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added before every answer")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many seconds more, at random")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Share of master server requests answered with a 503")
+    parser.add_argument("--upload-failure-rate", type=float, default=0, help="Share of replay uploads answered with a 503")
+    parser.add_argument("--chat-drop-rate", type=float, default=0, help="Chance of dropping a chat connection on each heartbeat")
+    parser.add_argument("--storm-every", type=float, default=0, help="Seconds between dropping every chat connection at once. 0 never does")
+    parser.add_argument("--replay-requests", type=float, default=0, help="Replay requests a second, to the connected managers")
+    parser.add_argument("--match-ids", type=int, nargs="+", default=[], help="Matches to request replays of")
+    parser.add_argument("--latest-version", default="0.0.0.0", help="The version the patcher reports")
+    parser.add_argument("--summary-every", type=float, default=10, help="Seconds between printing the counters")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_cli(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import traceback
 from datetime import datetime
 from cogs.misc.logger import get_logger
 from cogs.handlers.events import stop_event
+from cogs.misc.metrics import AUTOPING_REQUESTS
 
 LOGGER = get_logger()
 
@@ -149,6 +150,7 @@ class AutoPingListener:
             # Update activity tracking
             self.last_activity = datetime.now()
             self.packet_count += 1
+            AUTOPING_REQUESTS.inc()
             
             # Validate packet format
             if len(data) != 46:
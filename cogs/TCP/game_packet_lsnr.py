@@ -2,10 +2,12 @@ import traceback
 import asyncio
 import inspect
 from cogs.TCP.packet_parser import GameManagerParser
+from cogs.TCP.packet_capture import get_packet_capture, SOURCE_GAME_SERVER, SOURCE_COWMASTER
 from cogs.handlers.events import stop_event
 from cogs.misc.logger import get_logger
 
 LOGGER = get_logger()
+PACKET_CAPTURE = get_packet_capture()
 
 class ClientConnection:
     def __init__(self, reader, writer, addr, game_server_manager):
@@ -17,6 +19,7 @@ class ClientConnection:
         self.game_server_manager = game_server_manager
         self.closed = False
         self.id = None
+        self.shard_pool = None
 
     def set_game_server(self,game_server=None, cowmaster = None):
         self.game_server = game_server
@@ -70,13 +73,7 @@ class ClientConnection:
                 return
 
             except (asyncio.TimeoutError, TimeoutError) as e:
-                LOGGER.error(f"Client #{self.id} Timeout. The connection has timed out between the GameServer and the Manager. {timeout} seconds without receiving any data. Shutting down Game Server.")
-                if self.game_server:
-                    # await self.game_server.schedule_task(self.game_server.tail_game_log_then_close(), 'orphan_game_server_disconnect')
-                    await game_server.stop_server_exe(disable=False, kill=True)
-                    await self.close()
-                    await self.game_server_manager.start_game_servers([game_server], service_recovery=True)
-        
+                await self.handle_timeout(timeout)
                 return # exit the loop and continue to the post loop actions (clear game state, close connection, etc)
 
             except asyncio.exceptions.IncompleteReadError:
@@ -88,16 +85,44 @@ class ClientConnection:
                 LOGGER.exception(f"Client #{self.id} An error occurred while handling the {inspect.currentframe().f_code.co_name} function: {traceback.format_exc()}")
                 break # exit the loop and continue to the post loop actions (clear game state, close connection, etc)
             
-            if self.game_server:
-                await self.game_server.game_manager_parser.handle_packet(packet,game_server=self.game_server)
-            else:
-                await self.cowmaster.game_manager_parser.handle_packet(packet,cowmaster=self.cowmaster)
+            await self.handle_packet(packet)
 
             # Add a small delay to allow other clients to send packets
             await asyncio.sleep(0.001)
             
         await self.close()
 
+    async def run_sharded(self, shard_pool):
+        """
+        Hand the connection to a connection shard (man_shards), which reads it, and handle the packets it forwards.
+        Runs the connection here if no shard is available.
+        """
+        reason = await shard_pool.hand_over(self)
+        if reason is None:
+            await self.run(game_server=self.game_server)
+            return
+        if reason == 'timeout':
+            await self.handle_timeout(shard_pool.connection_timeout)
+        elif reason == 'shard_lost':
+            LOGGER.error(f"Client #{self.id} The connection shard reading this connection has stopped. Closing connection..")
+        await self.close()
+
+    async def handle_packet(self, packet):
+        if PACKET_CAPTURE.active:
+            PACKET_CAPTURE.record(SOURCE_GAME_SERVER if self.game_server else SOURCE_COWMASTER, self.id, packet[1])
+        if self.game_server:
+            await self.game_server.game_manager_parser.handle_packet(packet,game_server=self.game_server)
+        else:
+            await self.cowmaster.game_manager_parser.handle_packet(packet,cowmaster=self.cowmaster)
+
+    async def handle_timeout(self, timeout):
+        LOGGER.error(f"Client #{self.id} Timeout. The connection has timed out between the GameServer and the Manager. {timeout} seconds without receiving any data. Shutting down Game Server.")
+        if self.game_server:
+            # await self.game_server.schedule_task(self.game_server.tail_game_log_then_close(), 'orphan_game_server_disconnect')
+            await self.game_server.stop_server_exe(disable=False, kill=True)
+            await self.close()
+            await self.game_server_manager.start_game_servers([self.game_server], service_recovery=True)
+
     async def send_packet(self, packet, send_len=False):
         try:
             if not self.writer.is_closing():
@@ -115,6 +140,8 @@ class ClientConnection:
         if not self.closed:
             self.closed = True
             LOGGER.warn(f"Terminating client #{self.id}..")
+            if self.shard_pool:
+                self.shard_pool.release(self)
             self.writer.close()
             try:
                 await self.writer.wait_closed()
@@ -176,7 +203,10 @@ async def handle_client_connection(client_reader, client_writer, game_server_man
         # register the game server in the client connection and run the client connection coroutine
         if game_server:
             client_connection.set_game_server(game_server=game_server)
-            await client_connection.run(game_server=game_server)
+            if game_server_manager.shard_pool:
+                await client_connection.run_sharded(game_server_manager.shard_pool)
+            else:
+                await client_connection.run(game_server=game_server)
         elif cowmaster:
             client_connection.set_game_server(cowmaster=cowmaster)
             await client_connection.run(cowmaster=cowmaster)
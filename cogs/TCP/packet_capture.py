@@ -0,0 +1,142 @@
+"""
+Packet capture.
+
+Records the packets the manager receives from game servers, the cowmaster and the chat server to a capture file, as
+they are handled, so real traffic can be replayed into the parsers later (see benchmarks/packet_replay.py). Started
+and stopped from the CLI (capture start / capture stop). While no capture is running, recording is a single attribute
+check.
+
+File layout (little endian):
+    header, HEADER.size bytes:  magic b"HONCAPTR", version (u16), unix time the capture started (f64)
+    records, one after another:
+        offset (u64)        nanoseconds since the capture started
+        source (u8)         SOURCE_GAME_SERVER, SOURCE_COWMASTER or SOURCE_CHAT
+        client_id (u16)     the game server's instance id. The cowmaster's id, or 0 for the chat server
+        length (u16)        of the packet
+        the packet, without its length prefix
+
+With man_shards set, game server packets are recorded as the manager handles them, after the connection shards have
+coalesced the unchanged status packets.
+"""
+
+import mmap
+import struct
+import time
+from collections import namedtuple
+from cogs.misc.logger import get_logger
+
+LOGGER = get_logger()
+
+MAGIC = b"HONCAPTR"
+VERSION = 1
+HEADER = struct.Struct("<8sHd")
+RECORD = struct.Struct("<QBHH")
+SOURCE_GAME_SERVER = 0
+SOURCE_COWMASTER = 1
+SOURCE_CHAT = 2
+SOURCE_NAMES = {SOURCE_GAME_SERVER: "game_server", SOURCE_COWMASTER: "cowmaster", SOURCE_CHAT: "chat"}
+WRITE_BUFFER = 1024 * 1024              # bytes buffered before the capture file is written to
+MAX_CAPTURE_BYTES = 1024 * 1024 * 1024  # a capture is stopped once its file reaches this size
+
+CaptureRecord = namedtuple("CaptureRecord", ["offset", "source", "client_id", "data"])
+
+
+class PacketCapture:
+    def __init__(self):
+        self.active = False
+        self.file = None
+        self.path = None
+        self.started = 0
+        self.packets = 0
+        self.size = 0
+
+    def start(self, path):
+        if self.active:
+            raise RuntimeError(f"A capture is already running, to {self.path}.")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER)
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.path = path
+        self.started = time.monotonic_ns()
+        self.packets = 0
+        self.size = HEADER.size
+        self.active = True
+        LOGGER.info(f"Capturing packets to {path}")
+
+    def stop(self):
+        """Stop the capture, if one is running. Returns the number of packets captured."""
+        if not self.active:
+            return 0
+        self.active = False
+        self.file.close()
+        self.file = None
+        LOGGER.info(f"Stopped capturing packets. {self.packets} packets ({self.size / 1024 / 1024:.1f} MB) written to {self.path}")
+        return self.packets
+
+    def record(self, source, client_id, data):
+        if not self.active:
+            return
+        try:
+            self.file.write(RECORD.pack(time.monotonic_ns() - self.started, source, client_id or 0, len(data)))
+            self.file.write(data)
+        except (OSError, struct.error):
+            LOGGER.exception(f"Could not write to the packet capture {self.path}. Stopping it.")
+            self.stop()
+            return
+        self.packets += 1
+        self.size += RECORD.size + len(data)
+        if self.size >= MAX_CAPTURE_BYTES:
+            LOGGER.warn(f"The packet capture {self.path} reached {MAX_CAPTURE_BYTES // 1024 // 1024} MB. Stopping it.")
+            self.stop()
+
+
+class CaptureReader:
+    """
+    Reads a capture file through mmap, one CaptureRecord at a time, in the order the packets were received.
+    A record cut short, by the manager stopping mid write, ends the capture.
+
+        with CaptureReader(path) as capture:
+            for record in capture:
+                ...
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path} is empty, not a packet capture.")
+        magic, version, self.started = HEADER.unpack_from(self.map, 0) if len(self.map) >= HEADER.size else (b"", 0, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a packet capture (version {VERSION}).")
+
+    def __iter__(self):
+        data, offset, end = self.map, HEADER.size, len(self.map)
+        while offset + RECORD.size <= end:
+            nanoseconds, source, client_id, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + length > end:
+                return
+            yield CaptureRecord(nanoseconds / 1e9, source, client_id, data[offset:offset + length])
+            offset += length
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+PACKET_CAPTURE = None
+
+def get_packet_capture():
+    global PACKET_CAPTURE
+    if PACKET_CAPTURE is None:
+        PACKET_CAPTURE = PacketCapture()
+    return PACKET_CAPTURE
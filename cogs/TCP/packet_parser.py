@@ -1,9 +1,14 @@
 import traceback
 import inspect
+import logging
 import re
 import asyncio
 import struct
 import datetime
+import time
+from cogs.misc.metrics import GAMESERVER_PACKETS, GAMESERVER_PACKET_PARSE_SECONDS
+
+PACKET_TYPE_LABELS = [f"0x{packet_type:02x}" for packet_type in range(256)]
 
 def read_int(data, offset):
     val = int.from_bytes(data[offset:offset+4], byteorder='little')
@@ -47,6 +52,10 @@ class GameManagerParser:
         else:
             print(message)
 
+    def debug_enabled(self):
+        """Checked before building debug messages on the per-packet paths, so they cost nothing while debug logging is off."""
+        return self.logger is None or self.logger.isEnabledFor(logging.DEBUG)
+
     def update_client_id(self, new_id):
         self.id = new_id
 
@@ -54,17 +63,22 @@ class GameManagerParser:
         packet_len, packet_data = packet
         packet_type = packet_data[0]
 
-        if packet_len != len(packet_data):
+        if packet_len != len(packet_data) and self.debug_enabled():
             self.log("debug",f"GameServer #{self.id} - LEN DOESNT MATCH PACKET: {len} and {len(packet_data)}")
 
         # Retrieve the packet handler function based on the packet_type
         handler = self.packet_handlers.get(packet_type, self.unhandled_packet)
 
         # Call the handler with the split_packet as an argument
+        started = time.perf_counter()
         try:
             await handler(packet_data,game_server,cowmaster)
         except Exception as e:
             self.log("exception",f"GameServer #{self.id} - An error occurred while handling the {inspect.currentframe().f_code.co_name} function: {traceback.format_exc()} with this packet type: {hex(packet_type)}")
+        finally:
+            label = PACKET_TYPE_LABELS[packet_type]
+            GAMESERVER_PACKETS.labels(label).inc()
+            GAMESERVER_PACKET_PARSE_SECONDS.labels(label).observe(time.perf_counter() - started)
 
     async def server_announce_preflight(packet):
         """ 0x40  Server announce
@@ -96,13 +110,15 @@ class GameManagerParser:
 
         """
         if game_server:
-            self.log("debug",f"GameServer #{self.id} - Received server closed packet: {packet}")
+            if self.debug_enabled():
+                self.log("debug",f"GameServer #{self.id} - Received server closed packet: {packet}")
             game_server.reset_game_state()
             # await game_server.save_gamestate_to_file()
             game_server.reset_skipped_frames()
             self.publish_event(topic="game_server/status", data={ "type":"server_closed", **game_server.game_state._state})  
         else:
-            self.log("debug",f"CowMaster #{self.id} - Received server closed packet: {packet}")
+            if self.debug_enabled():
+                self.log("debug",f"CowMaster #{self.id} - Received server closed packet: {packet}")
             cowmaster.reset_cowmaster_state()
 
 
@@ -231,7 +247,8 @@ class GameManagerParser:
         """
         skipped_frames = int.from_bytes(packet[1:3], byteorder='little')
         current_time = datetime.datetime.now().timestamp()  # Get current time in Unix timestamp format
-        self.log("debug", f"GameServer #{self.id} - skipped server frame: {skipped_frames}msec")
+        if self.debug_enabled():
+            self.log("debug", f"GameServer #{self.id} - skipped server frame: {skipped_frames}msec")
         if game_server:
             await game_server.increment_skipped_frames(skipped_frames, current_time)
 
@@ -283,7 +300,8 @@ class GameManagerParser:
     async def lobby_closed(self,packet, game_server=None, cowmaster=None):
         """   0x45 Lobby closed
         """
-        self.log("debug",f"GameServer #{self.id} - Received lobby closed packet: {packet}")
+        if self.debug_enabled():
+            self.log("debug",f"GameServer #{self.id} - Received lobby closed packet: {packet}")
         empty_lobby_info = {
             'match_id': '',
             'map': '',
@@ -314,7 +332,8 @@ class GameManagerParser:
 
                 This packet arrives any time someone begins connecting to the server
         """
-        self.log("debug",f"GameServer #{self.id} - Received server connection packet: {packet}")
+        if self.debug_enabled():
+            self.log("debug",f"GameServer #{self.id} - Received server connection packet: {packet}")
 
     async def cow_stats_submission(self, packet, game_server=None, cowmaster=None):
         """ 0x48 state of stats submission
@@ -345,7 +364,11 @@ class GameManagerParser:
                 Update: when failed to fork, these 4 bytes are 0000
         """
         port = int.from_bytes(packet[1:3],byteorder='little')
-        self.log('debug',f'CowMaster #{self.id} - fork response: {self.format_packet(packet)} (port: {port})')
+        success = any(packet[3:])   # trailing bytes are 0 when the fork failed
+        if self.debug_enabled():
+            self.log('debug',f'CowMaster #{self.id} - fork response: {self.format_packet(packet)} (port: {port}, success: {success})')
+        if cowmaster:
+            cowmaster.fork_acknowledged(port, success)
 
 
     async def replay_update(self,packet, game_server=None, cowmaster=None):
@@ -380,7 +403,8 @@ class GameManagerParser:
             #TODO: Python decodes the output of bytes weirdly. We want to prevent that.
 
 
-            self.log("debug",f"GameServer #{self.id} - Received unknown packet: {self.format_packet(packet)}")
+            if self.debug_enabled():
+                self.log("debug",f"GameServer #{self.id} - Received unknown packet: {self.format_packet(packet)}")
     
     def format_packet(self,packet):
         return ''.join(['\\x{:02x}'.format(byte) for byte in packet])
@@ -0,0 +1,232 @@
+"""
+The manager's side of sharding game server connections over worker processes (man_shards).
+
+On one event loop, reading 120+ game server connections, framing their packets and handling the status packets each
+one sends several times a second, keeps one core busy, however many the host has. With man_shards set, the manager
+still owns the manager port: it accepts each game server connection and reads its server hello, as it does unsharded.
+It then hands the socket to one of man_shards worker processes (see shard_worker.py), by passing the file descriptor
+over a unix socket. Game servers are assigned to a worker by instance id, so each worker reads a fixed slice of the fleet.
+
+The worker reads the connection, frames the packets, and coalesces the status (0x42) packets: one is forwarded straight
+away when it changes the server's status, game phase, clients or match state, otherwise only the latest one, every
+STATUS_INTERVAL. Every other packet is forwarded as is, in order. The forwarded packets come back in batches, and are
+handled by the manager's GameManagerParser, so game state, events and everything built on them work as unsharded.
+
+The manager keeps its end of the socket, with reading paused, to send commands to the game server.
+
+Linux only: SOCK_SEQPACKET unix sockets, and socket.send_fds (python 3.9+).
+"""
+
+import asyncio
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from cogs.misc.logger import get_logger, get_home
+from cogs.misc.metrics import GAMESERVER_PACKETS, SHARD_CONNECTIONS, SHARD_PACKETS_COALESCED
+from cogs.handlers.events import stop_event
+
+LOGGER = get_logger()
+HOME_PATH = get_home()
+
+SHARDING_SUPPORTED = sys.platform == "linux" and hasattr(socket, "send_fds")
+CONNECTION_TIMEOUT = 60     # seconds without a packet before a worker gives up on a connection, as ClientConnection.run
+MAX_MESSAGE = 256 * 1024    # bytes. The largest message on a shard socket. Batches are flushed well below it (see shard_worker.py)
+RESTART_DELAY = 1           # seconds before a worker is restarted. Doubles while it keeps failing, up to RESTART_DELAY_MAX
+RESTART_DELAY_MAX = 60
+STABLE_AFTER = 60           # seconds a worker must run for, for the restart delay to reset
+STOP_TIMEOUT = 5            # seconds a worker is given to exit, before it is killed
+
+
+class Shard:
+    """One worker process, and the manager's end of its socket."""
+    def __init__(self, number):
+        self.number = number
+        self.sock = None
+        self.process = None
+        self.connections = {}   # key: (ClientConnection, future resolved with the reason the worker stopped reading it)
+        self.reader_task = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None and self.sock is not None
+
+
+class ShardPool:
+    def __init__(self, manager, count):
+        """
+        Args:
+            manager (GameServerManager): the manager the workers read connections for.
+            count (int): the number of worker processes.
+        """
+        self.manager = manager
+        self.shards = [Shard(number) for number in range(count)]
+        self.next_key = 0
+        self.connection_timeout = CONNECTION_TIMEOUT
+        self.event_loop = manager.global_config['hon_data'].get('man_event_loop', 'auto')
+
+    async def run(self):
+        """Start the workers, and restart any that exit, until the manager stops."""
+        try:
+            await asyncio.gather(*(self.supervise(shard) for shard in self.shards))
+        finally:
+            for shard in self.shards:
+                self.stop_shard(shard)
+
+    def start_shard(self, shard):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            shard.process = subprocess.Popen(
+                [sys.executable, "-m", "cogs.TCP.shard_worker", "--shard", str(shard.number), "--socket-fd", str(child_sock.fileno()),
+                 "--parent-pid", str(os.getpid()), "--event-loop", self.event_loop],
+                cwd=HOME_PATH,
+                pass_fds=[child_sock.fileno()]
+            )
+        finally:
+            child_sock.close()
+        parent_sock.setblocking(False)
+        shard.sock = parent_sock
+        shard.reader_task = asyncio.create_task(self.read_shard(shard))
+        LOGGER.info(f"Connection shard {shard.number} running (pid {shard.process.pid}). Its log is logs/shard{shard.number}.log")
+
+    async def supervise(self, shard):
+        delay = RESTART_DELAY
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.start_shard(shard)
+            # polled, as for the API process (see api_process.py)
+            while shard.process.poll() is None and not shard.reader_task.done() and not stop_event.is_set():
+                try:
+                    await asyncio.wait_for(stop_event.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+            if stop_event.is_set():
+                return
+            self.stop_shard(shard)
+            if time.monotonic() - started > STABLE_AFTER:
+                delay = RESTART_DELAY
+            LOGGER.error(f"Connection shard {shard.number} exited with code {shard.process.returncode}. Restarting it in {delay} seconds.")
+            try:
+                await asyncio.wait_for(stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    def stop_shard(self, shard):
+        if shard.reader_task:
+            shard.reader_task.cancel()
+            shard.reader_task = None
+        if shard.sock:
+            shard.sock.close()
+            shard.sock = None
+        # the worker's connections end with it. The manager closes them, and the game servers reconnect to a running worker
+        for _, closed in shard.connections.values():
+            if not closed.done():
+                closed.set_result('shard_lost')
+        shard.connections.clear()
+        SHARD_CONNECTIONS.labels(str(shard.number)).set(0)
+        if shard.process is None or shard.process.poll() is not None:
+            return
+        shard.process.terminate()
+        try:
+            shard.process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            shard.process.kill()
+
+    def shard_for(self, client_connection):
+        shard = self.shards[client_connection.game_server.id % len(self.shards)]
+        return shard if shard.running else None
+
+    async def hand_over(self, client_connection):
+        """
+        Hand the connection to its worker, which reads it from now on.
+
+        Returns:
+            str: why the worker stopped reading the connection ('closed', 'timeout' or 'shard_lost'), once it has.
+            None if the worker isn't running, and the connection wasn't handed over.
+        """
+        shard = self.shard_for(client_connection)
+        if shard is None:
+            return None
+        transport = client_connection.writer.transport
+        transport.pause_reading()
+        # anything already read past the server hello is passed along, so the worker reads the stream from where the manager stopped
+        buffered = bytes(client_connection.reader._buffer)
+        client_connection.reader._buffer.clear()
+        self.next_key += 1
+        key = self.next_key
+        message = pickle.dumps(('connection', key, client_connection.game_server.port, buffered, self.connection_timeout))
+        closed = asyncio.get_running_loop().create_future()
+        shard.connections[key] = (client_connection, closed)
+        try:
+            await self.send(shard, message, [transport.get_extra_info('socket').fileno()])
+        except OSError:
+            shard.connections.pop(key, None)
+            LOGGER.error(f"Client #{client_connection.id} Could not hand the connection to connection shard {shard.number}. {traceback.format_exc()}")
+            client_connection.reader.feed_data(buffered)
+            transport.resume_reading()
+            return None
+        client_connection.shard_pool = self
+        SHARD_CONNECTIONS.labels(str(shard.number)).set(len(shard.connections))
+        LOGGER.debug(f"Client #{client_connection.id} Handed to connection shard {shard.number}.")
+        try:
+            return await closed
+        finally:
+            shard.connections.pop(key, None)
+            SHARD_CONNECTIONS.labels(str(shard.number)).set(len(shard.connections))
+
+    @staticmethod
+    async def send(shard, message, fds):
+        while True:
+            try:
+                socket.send_fds(shard.sock, [message], fds)
+                return
+            except BlockingIOError:
+                await asyncio.sleep(0.01)
+
+    @staticmethod
+    def release(client_connection):
+        """
+        The manager closed a connection a worker is reading. Shutting the socket down, rather than just closing the
+        manager's descriptor, ends it for the worker and the game server too.
+        """
+        try:
+            client_connection.writer.transport.get_extra_info('socket').shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+    async def read_shard(self, shard):
+        loop = asyncio.get_running_loop()
+        try:
+            while not stop_event.is_set():
+                message = await loop.sock_recv(shard.sock, MAX_MESSAGE)
+                if not message:
+                    return
+                await self.handle_message(shard, pickle.loads(message))
+        except (ConnectionError, OSError):
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            LOGGER.exception(f"Connection shard {shard.number} An error occurred while reading from the worker: {traceback.format_exc()}")
+
+    async def handle_message(self, shard, message):
+        kind = message[0]
+        if kind == 'packets':
+            _, batch, coalesced = message
+            for key, data in batch:
+                connection = shard.connections.get(key)
+                if connection:
+                    await connection[0].handle_packet((len(data), data))
+            if coalesced:
+                # counted as received, as unsharded, where every status packet is handled
+                GAMESERVER_PACKETS.labels("0x42").inc(coalesced)
+                SHARD_PACKETS_COALESCED.labels(str(shard.number)).inc(coalesced)
+        elif kind == 'closed':
+            _, key, reason = message
+            connection = shard.connections.get(key)
+            if connection and not connection[1].done():
+                connection[1].set_result(reason)
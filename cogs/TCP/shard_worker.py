@@ -0,0 +1,223 @@
+"""
+A connection shard, started by the manager when man_shards is set (see shard_pool.py).
+
+Reads the game server connections the manager hands over, and forwards their packets back to the manager in batches,
+coalescing the status packets. Exits when the manager does.
+
+    python -m cogs.TCP.shard_worker --shard <number> --socket-fd <fd> --parent-pid <manager pid> [--event-loop auto]
+"""
+
+import argparse
+import asyncio
+import pickle
+import socket
+import sys
+from pathlib import Path
+
+HOME_PATH = Path(__file__).resolve().parents[2]
+STATUS_INTERVAL = 0.5       # seconds between forwarding a server's latest status packet, while it doesn't change
+BATCH_LIMIT = 64 * 1024     # bytes of packets in a batch, before it is sent. Well under MAX_MESSAGE (see shard_pool.py)
+MAX_MESSAGE = 256 * 1024
+STATUS_PACKET = 0x42
+# bytes of a status packet which, when they change, have it forwarded straight away: status, num_clients, match_started
+# and game_phase. A change in the number of players changes the packet's length, which is compared too
+STATUS_KEY_BYTES = (1, 10, 11, 40)
+
+#   As in main.py, logging is set up before the modules that read it at import are imported.
+from cogs.misc.logger import get_logger, set_logger, set_home
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="HoNfigurator connection shard")
+    parser.add_argument("--shard", type=int, required=True, help="The shard's number")
+    parser.add_argument("--socket-fd", type=int, required=True, help="The unix socket shared with the manager")
+    parser.add_argument("--parent-pid", type=int, required=True, help="The manager's pid. The shard exits when it does")
+    parser.add_argument("--event-loop", default="auto", help="man_event_loop")
+    return parser.parse_args()
+
+
+def status_key(data):
+    if len(data) <= max(STATUS_KEY_BYTES):
+        return data
+    return (len(data),) + tuple(data[index] for index in STATUS_KEY_BYTES)
+
+
+class ShardWorker:
+    def __init__(self, number, sock):
+        self.number = number
+        self.sock = sock
+        self.logger = get_logger()
+        self.connections = {}       # key: reading task
+        self.batch = []             # (key, packet data), in the order they're forwarded
+        self.batch_size = 0
+        self.coalesced = 0
+        self.pending_status = {}    # key: the latest status packet, not yet forwarded
+        self.last_status = {}       # key: status_key of the last status packet forwarded
+        self.flush_scheduled = False
+        self.outbox = asyncio.Queue()    # one sender, so the manager gets the messages in order
+        self.closed = asyncio.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock.fileno(), self.receive)
+        tasks = [asyncio.create_task(self.forward_status()), asyncio.create_task(self.send_messages())]
+        try:
+            await self.closed.wait()
+        finally:
+            loop.remove_reader(self.sock.fileno())
+            for task in tasks:
+                task.cancel()
+            for task in list(self.connections.values()):
+                task.cancel()
+
+    def receive(self):
+        """A message from the manager: a connection to read, with its socket."""
+        try:
+            message, fds, _, _ = socket.recv_fds(self.sock, MAX_MESSAGE, 1)
+        except BlockingIOError:
+            return
+        except OSError:
+            message, fds = b'', []
+        if not message:
+            self.logger.warn(f"Connection shard {self.number}: the manager closed the shard socket. Exiting.")
+            self.closed.set()
+            return
+        kind, key, port, buffered, timeout = pickle.loads(message)
+        if kind != 'connection' or not fds:
+            return
+        self.connections[key] = asyncio.create_task(self.read_connection(key, port, socket.socket(fileno=fds[0]), buffered, timeout))
+
+    async def read_connection(self, key, port, sock, buffered, timeout):
+        from cogs.TCP.game_packet_lsnr import ClientConnection
+        loop = asyncio.get_running_loop()
+        sock.setblocking(False)
+        reader = asyncio.StreamReader()
+        if buffered:
+            reader.feed_data(buffered)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport, _ = await loop.connect_accepted_socket(lambda: protocol, sock=sock)
+        connection = ClientConnection(reader, asyncio.StreamWriter(transport, protocol, reader, loop), port, None)
+        connection.id = port
+        reason = 'closed'
+        try:
+            while True:
+                packet = await connection.receive_packet(timeout=timeout)
+                if packet is None:
+                    break
+                self.forward(key, packet[1])
+                # readexactly doesn't yield while there is data buffered, so a busy server can't hold up the others
+                await asyncio.sleep(0)
+        except (asyncio.TimeoutError, TimeoutError):
+            reason = 'timeout'
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            transport.close()
+            raise
+        except Exception:
+            self.logger.exception(f"Connection shard {self.number}: an error occurred reading the connection of the server on port {port}.")
+        transport.close()
+        self.connections.pop(key, None)
+        self.take_pending(key)
+        self.last_status.pop(key, None)
+        self.send_batch()
+        self.send(('closed', key, reason))
+
+    def forward(self, key, data):
+        if data and data[0] == STATUS_PACKET:
+            status = status_key(data)
+            if self.last_status.get(key) == status:
+                if key in self.pending_status:
+                    self.coalesced += 1
+                self.pending_status[key] = data
+                return
+            self.last_status[key] = status
+            if self.pending_status.pop(key, None) is not None:
+                self.coalesced += 1
+        else:
+            # status first, so the manager sees the packets in the order the server sent them
+            self.take_pending(key)
+        self.add(key, data)
+
+    def take_pending(self, key):
+        data = self.pending_status.pop(key, None)
+        if data is not None:
+            self.add(key, data)
+
+    def add(self, key, data):
+        self.batch.append((key, data))
+        self.batch_size += len(data)
+        if self.batch_size > BATCH_LIMIT:
+            self.send_batch()
+        elif not self.flush_scheduled:
+            # everything read in this pass of the event loop goes in one batch
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        self.send_batch()
+
+    def send_batch(self):
+        if self.batch or self.coalesced:
+            self.send(('packets', self.batch, self.coalesced))
+        self.batch, self.batch_size, self.coalesced = [], 0, 0
+
+    async def forward_status(self):
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            for key in list(self.pending_status):
+                self.take_pending(key)
+
+    def send(self, message):
+        self.outbox.put_nowait(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+    async def send_messages(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await self.outbox.get()
+            try:
+                await loop.sock_sendall(self.sock, message)
+            except OSError:
+                self.closed.set()
+                return
+
+
+async def watch_parent(parent_pid, closed):
+    import psutil
+    while not closed.is_set():
+        if not psutil.pid_exists(parent_pid):
+            get_logger().warn(f"The manager (pid {parent_pid}) is no longer running. Exiting.")
+            closed.set()
+            return
+        await asyncio.sleep(2)
+
+
+async def serve(number, sock, parent_pid):
+    worker = ShardWorker(number, sock)
+    parent_watch = asyncio.create_task(watch_parent(parent_pid, worker.closed))
+    try:
+        await worker.run()
+    finally:
+        parent_watch.cancel()
+
+
+def main():
+    args = parse_arguments()
+    set_home(HOME_PATH)
+    set_logger(log_file_name=f'shard{args.shard}.log')
+    logger = get_logger()
+
+    from cogs.misc.event_loop import create_event_loop
+    loop, description, warning = create_event_loop(args.event_loop)
+    if warning:
+        logger.warn(warning)
+    logger.info(f"Connection shard {args.shard} started. Event loop: {description}")
+    sock = socket.socket(fileno=args.socket_fd)
+    loop.run_until_complete(serve(args.shard, sock, args.parent_pid))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
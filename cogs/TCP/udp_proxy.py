@@ -0,0 +1,294 @@
+"""
+Built in UDP relay, used in place of proxy.exe (which only exists for windows).
+
+Each game server instance gets a public game port and a public voice port. Traffic arriving on
+those ports is relayed to the real svr_port / svr_proxyLocalVoicePort on 127.0.0.1.
+Every remote client gets its own upstream socket (a NAT entry), so the game server sees each player
+as a unique source address, and replies can be routed back to the right player.
+
+All instances share the one event loop in the manager, rather than running 1 proxy process per instance.
+"""
+
+import asyncio
+import socket
+import time
+import traceback
+from cogs.misc.logger import get_logger
+from cogs.handlers.events import stop_event
+
+LOGGER = get_logger()
+
+CLIENT_IDLE_TIMEOUT = 60            # seconds without traffic before a client's NAT entry is released
+SWEEP_INTERVAL = 10                 # how often idle NAT entries are checked
+MAX_CLIENTS_PER_PORT = 256          # a match has 10 players + spectators/referees. Anything above this is junk traffic.
+MAX_PENDING_PACKETS = 64            # packets buffered per client while its upstream socket is being opened
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+LATENCY_SMOOTHING = 0.1
+
+
+class ProxyStats:
+    def __init__(self):
+        self.packets_in = 0     # client -> game server
+        self.packets_out = 0    # game server -> client
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.turnaround_ms = 0.0  # smoothed time between a client packet, and the next reply from the game server
+        self.turnaround_max_ms = 0.0
+        self.started = time.time()
+
+    def record_turnaround(self, seconds):
+        ms = seconds * 1000
+        if self.turnaround_ms == 0:
+            self.turnaround_ms = ms
+        else:
+            self.turnaround_ms += (ms - self.turnaround_ms) * LATENCY_SMOOTHING
+        if ms > self.turnaround_max_ms:
+            self.turnaround_max_ms = ms
+
+    def to_dict(self):
+        uptime = max(time.time() - self.started, 1)
+        return {
+            "packets_in": self.packets_in,
+            "packets_out": self.packets_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "dropped": self.dropped,
+            "packets_per_sec": round((self.packets_in + self.packets_out) / uptime, 2),
+            "turnaround_ms": round(self.turnaround_ms, 3),
+            "turnaround_max_ms": round(self.turnaround_max_ms, 3)
+        }
+
+
+def tune_socket(transport):
+    """Enlarge the kernel buffers so that bursts of packets queue in the kernel rather than being dropped between loop iterations."""
+    sock = transport.get_extra_info('socket')
+    if sock is None:
+        return
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError:
+            pass
+
+
+class ClientSession:
+    __slots__ = ('addr', 'transport', 'pending', 'last_seen', 'awaiting_reply_since')
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.transport = None
+        self.pending = []
+        self.last_seen = time.monotonic()
+        self.awaiting_reply_since = None
+
+
+class PublicProtocol(asyncio.DatagramProtocol):
+    def __init__(self, relay):
+        self.relay = relay
+
+    def datagram_received(self, data, addr):
+        self.relay.to_server(data, addr)
+
+    def error_received(self, exc):
+        LOGGER.debug(f"[Proxy] {self.relay.name} public socket error: {exc}")
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, relay, session):
+        self.relay = relay
+        self.session = session
+
+    def datagram_received(self, data, addr):
+        self.relay.to_client(self.session, data)
+
+    def error_received(self, exc):
+        # ICMP port unreachable while the game server is restarting. Not worth more than a debug line.
+        LOGGER.debug(f"[Proxy] {self.relay.name} upstream error for {self.session.addr}: {exc}")
+
+
+class PortRelay:
+    def __init__(self, name, public_port, target_port, target_host="127.0.0.1"):
+        self.name = name
+        self.public_port = public_port
+        self.target_port = target_port
+        self.target_host = target_host
+        self.transport = None
+        self.sessions = {}
+        self.stats = ProxyStats()
+        self.closed = False
+        self.tasks = set()  # upstream connects still running. Finished ones remove themselves
+
+    async def open(self, bind_host):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: PublicProtocol(self),
+            local_addr=(bind_host, self.public_port))
+        tune_socket(self.transport)
+
+    def to_server(self, data, addr):
+        session = self.sessions.get(addr)
+        now = time.monotonic()
+        if session is None:
+            if len(self.sessions) >= MAX_CLIENTS_PER_PORT:
+                self.stats.dropped += 1
+                return
+            session = ClientSession(addr)
+            self.sessions[addr] = session
+            task = asyncio.create_task(self.connect_upstream(session))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        session.last_seen = now
+        self.stats.packets_in += 1
+        self.stats.bytes_in += len(data)
+
+        if session.transport is None:
+            if len(session.pending) < MAX_PENDING_PACKETS:
+                session.pending.append(data)
+            else:
+                self.stats.dropped += 1
+            return
+
+        if session.awaiting_reply_since is None:
+            session.awaiting_reply_since = now
+        session.transport.sendto(data)
+
+    def to_client(self, session, data):
+        now = time.monotonic()
+        session.last_seen = now
+        if session.awaiting_reply_since is not None:
+            self.stats.record_turnaround(now - session.awaiting_reply_since)
+            session.awaiting_reply_since = None
+        self.stats.packets_out += 1
+        self.stats.bytes_out += len(data)
+        if self.transport is not None:
+            self.transport.sendto(data, session.addr)
+
+    async def connect_upstream(self, session):
+        loop = asyncio.get_running_loop()
+        try:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: UpstreamProtocol(self, session),
+                remote_addr=(self.target_host, self.target_port))
+        except OSError:
+            LOGGER.warn(f"[Proxy] {self.name} failed to open an upstream socket for {session.addr}: {traceback.format_exc()}")
+            self.sessions.pop(session.addr, None)
+            return
+
+        if self.closed or self.sessions.get(session.addr) is not session:
+            transport.close()
+            return
+
+        tune_socket(transport)
+        session.transport = transport
+        pending, session.pending = session.pending, []
+        if pending:
+            session.awaiting_reply_since = time.monotonic()
+        for data in pending:
+            transport.sendto(data)
+
+    def expire_idle_sessions(self, now):
+        expired = [addr for addr, session in self.sessions.items() if now - session.last_seen > CLIENT_IDLE_TIMEOUT]
+        for addr in expired:
+            session = self.sessions.pop(addr)
+            if session.transport:
+                session.transport.close()
+        return len(expired)
+
+    def close(self):
+        self.closed = True
+        for session in self.sessions.values():
+            if session.transport:
+                session.transport.close()
+        self.sessions.clear()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def get_stats(self):
+        return {
+            "public_port": self.public_port,
+            "target_port": self.target_port,
+            "clients": len(self.sessions),
+            **self.stats.to_dict()
+        }
+
+
+class UDPProxy:
+    def __init__(self, bind_host="0.0.0.0"):
+        self.bind_host = bind_host
+        self.instances = {}     # instance id -> {name: PortRelay}
+        self.sweeper_task = None
+
+    async def register(self, instance_id, mappings):
+        """
+        Start relaying for a game server instance.
+
+        Args:
+            instance_id (int): the GameServer id
+            mappings (list): (name, public_port, target_port) tuples. e.g. [("game", 20001, 10001), ("voice", 20061, 10061)]
+        """
+        existing = self.instances.get(instance_id)
+        if existing is not None:
+            if sorted((r.name, r.public_port, r.target_port) for r in existing.values()) == sorted(mappings):
+                return False
+            self.unregister(instance_id)
+
+        relays = {}
+        try:
+            for name, public_port, target_port in mappings:
+                relay = PortRelay(f"#{instance_id} {name}", public_port, target_port)
+                await relay.open(self.bind_host)
+                relays[name] = relay
+        except OSError:
+            for relay in relays.values():
+                relay.close()
+            raise
+
+        self.instances[instance_id] = relays
+        if self.sweeper_task is None or self.sweeper_task.done():
+            self.sweeper_task = asyncio.create_task(self.sweep_idle_sessions())
+        return True
+
+    def unregister(self, instance_id):
+        relays = self.instances.pop(instance_id, None)
+        if not relays:
+            return
+        for relay in relays.values():
+            relay.close()
+
+    def is_registered(self, instance_id):
+        return instance_id in self.instances
+
+    def get_stats(self, instance_id=None):
+        if instance_id is not None:
+            relays = self.instances.get(instance_id, {})
+            return {name: relay.get_stats() for name, relay in relays.items()}
+        return {instance: {name: relay.get_stats() for name, relay in relays.items()} for instance, relays in self.instances.items()}
+
+    async def sweep_idle_sessions(self):
+        while not stop_event.is_set() and self.instances:
+            for _ in range(SWEEP_INTERVAL):
+                if stop_event.is_set():
+                    break
+                await asyncio.sleep(1)
+            now = time.monotonic()
+            for relays in list(self.instances.values()):
+                for relay in relays.values():
+                    expired = relay.expire_idle_sessions(now)
+                    if expired:
+                        LOGGER.debug(f"[Proxy] {relay.name} released {expired} idle client(s)")
+
+    def close(self):
+        for instance_id in list(self.instances):
+            self.unregister(instance_id)
+
+
+UDP_PROXY = None
+
+def get_udp_proxy():
+    global UDP_PROXY
+    if UDP_PROXY is None:
+        UDP_PROXY = UDPProxy()
+    return UDP_PROXY
@@ -0,0 +1,288 @@
+"""
+The manager's side of running the API server in its own process (man_api_process).
+
+ApiProcess publishes the state snapshot the API process serves from, answers its control requests, and keeps the API
+process running (see api_state.py for the snapshot and the control channel, and api_worker.py for the API process).
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import pickle
+import secrets
+import subprocess
+import sys
+import time
+import traceback
+from cogs.misc.logger import get_logger, get_misc, get_home
+from cogs.handlers.events import stop_event
+from cogs.connectors.api_state import StateSnapshotWriter
+from cogs.connectors.api_server import set_api_context, summarise_tasks, apply_hon_data, apply_app_data
+from cogs.game.memory_admission import get_memory_admission
+from cogs.game.lag_monitor import get_lag_monitor
+from cogs.misc.metrics import render_metrics
+
+LOGGER = get_logger()
+MISC = get_misc()
+HOME_PATH = get_home()
+
+PUBLISH_INTERVAL = 0.5          # seconds between checks for game server state changes to publish
+REFRESH_INTERVAL = 5            # seconds between rebuilds of everything else (task status, proxy stats, component status)
+RESTART_DELAY = 1               # seconds before the API process is restarted. Doubles while it keeps failing, up to RESTART_DELAY_MAX
+RESTART_DELAY_MAX = 60
+STABLE_AFTER = 60               # seconds the API process must run for, for the restart delay to reset
+STOP_TIMEOUT = 5                # seconds the API process is given to exit, before it is killed
+# events the API process may emit on the manager's event bus. The API endpoints only emit these
+CONTROL_EVENTS = ['cmd_shutdown_server', 'start_game_servers_task', 'balance_game_server_count']
+# control requests that change nothing, so don't need the snapshot refreshed after them
+READ_ONLY_COMMANDS = ['find_replay', 'metrics']
+
+
+class ApiProcess:
+    def __init__(self, manager):
+        """
+        Args:
+            manager (GameServerManager): the manager the API process serves.
+        """
+        self.manager = manager
+        self.state_path = HOME_PATH / "config" / ".api_state"
+        self.token = secrets.token_hex(32)
+        self.writer = None
+        self.process = None
+        self.publish_requested = None
+        self.publish_failing = False
+        self.parts = {}                 # snapshot key -> pickled part, as last built
+        self.game_server_parts = {}     # port -> pickled game server state, as last built
+        self.game_server_versions = {}  # port -> the GameState.version its part was built from
+        self.published = False
+
+    async def run(self):
+        manager = self.manager
+        # configuration changes from the API process are applied here, with the manager's own objects
+        set_api_context(manager.global_config, manager.game_servers, manager.tasks, manager.health_check_manager.tasks, manager.event_bus, manager.find_replay_file,
+                        start_controller=manager.server_start_controller, cowmaster=manager.cowmaster, autoscaler=manager.autoscaler, rolling_restart=manager.rolling_restart)
+        self.publish_requested = asyncio.Event()
+        self.writer = StateSnapshotWriter(self.state_path)
+        self.publish()
+        control_server = await asyncio.start_server(self.handle_control_connection, "127.0.0.1", 0)
+        control_port = control_server.sockets[0].getsockname()[1]
+        publisher = asyncio.create_task(self.publish_state())
+        try:
+            await self.supervise(control_port)
+        finally:
+            publisher.cancel()
+            control_server.close()
+            self.stop_process()
+            self.writer.close()
+
+    def build_state(self):
+        """The snapshot, apart from the game servers, which are built one by one (build_game_server_state)."""
+        manager = self.manager
+        game_servers = list(manager.game_servers.values())
+        return {
+            'global_config': manager.global_config,
+            'misc': {
+                'hon_version': MISC.hon_version,
+                'tag': MISC.tag,
+                'github_branch': MISC.github_branch,
+                'github_branch_all': MISC.github_branch_all,
+                'cpu_name': MISC.cpu_name,
+                'public_ip': MISC.public_ip
+            },
+            'manager_tasks': summarise_tasks(manager.tasks),
+            'health_check_tasks': summarise_tasks(manager.health_check_manager.tasks),
+            'start_controller': manager.server_start_controller.get_status() if manager.server_start_controller else None,
+            'autoscaler': manager.autoscaler.get_status() if manager.autoscaler else None,
+            'memory_admission': get_memory_admission().get_status(),
+            'lag_report': get_lag_monitor().get_status(game_servers),
+            # memory sharing is measured by the API process, from the pids
+            'cowmaster_stats': manager.cowmaster.get_fork_stats() if manager.cowmaster else None,
+            'rolling_restart': manager.rolling_restart.get_status()
+        }
+
+    @staticmethod
+    def build_game_server_state(game_server):
+        return {
+            'id': game_server.id,
+            'port': game_server.port,
+            'pid': game_server._pid,
+            'game_state': game_server.game_state._state,
+            'performance': game_server.game_state._performance,
+            'local_config': game_server.config.local,
+            'pretty_status': game_server.get_pretty_status_for_webui(),
+            'public_game_port': game_server.get_public_game_port(),
+            'public_voice_port': game_server.get_public_voice_port(),
+            'start_timings': game_server.start_timings,
+            'proxy_stats': game_server.get_proxy_stats(),
+            'tasks': summarise_tasks(game_server.tasks)
+        }
+
+    @staticmethod
+    def encode(value):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def update_parts(self, refresh):
+        """
+        Rebuild the parts of the snapshot that may have changed.
+
+        A game server's part is rebuilt when its GameState has been updated since (GameState.version). Everything
+        else, and the parts of a game server that don't go through its GameState, only on a refresh.
+
+        Returns:
+            bool: whether any part changed.
+        """
+        changed = False
+        if refresh:
+            for key, value in self.build_state().items():
+                encoded = self.encode(value)
+                if self.parts.get(key) != encoded:
+                    self.parts[key] = encoded
+                    changed = True
+
+        game_servers = self.manager.game_servers
+        for port in [port for port in self.game_server_parts if port not in game_servers]:
+            del self.game_server_parts[port]
+            self.game_server_versions.pop(port, None)
+            changed = True
+        for port, game_server in game_servers.items():
+            version = game_server.game_state.version
+            if not refresh and port in self.game_server_parts and self.game_server_versions.get(port) == version:
+                continue
+            self.game_server_versions[port] = version
+            encoded = self.encode(self.build_game_server_state(game_server))
+            if self.game_server_parts.get(port) != encoded:
+                self.game_server_parts[port] = encoded
+                changed = True
+        return changed
+
+    def publish(self, refresh=True):
+        """Publish the snapshot, if anything in it changed since it was last published."""
+        try:
+            if not self.update_parts(refresh) and self.published:
+                return
+            # the parts are pickled already, so this only copies them
+            self.published = self.writer.publish({**self.parts, 'game_servers': dict(self.game_server_parts)})
+            self.publish_failing = False
+        except Exception:
+            self.published = False
+            if not self.publish_failing:
+                LOGGER.error(f"Failed to publish the API state snapshot. The API is serving stale data. {traceback.format_exc()}")
+            self.publish_failing = True
+
+    async def publish_state(self):
+        """
+        Publish the game servers that changed every PUBLISH_INTERVAL, and everything every REFRESH_INTERVAL.
+        Everything is also refreshed straight after a control request, so the change shows in the API's next answer.
+        """
+        last_refresh = time.monotonic()
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(self.publish_requested.wait(), PUBLISH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            refresh = self.publish_requested.is_set() or time.monotonic() - last_refresh >= REFRESH_INTERVAL
+            self.publish_requested.clear()
+            if refresh:
+                last_refresh = time.monotonic()
+            self.publish(refresh)
+
+    async def handle_control_connection(self, reader, writer):
+        try:
+            while not stop_event.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    break
+                if not hmac.compare_digest(str(request.get('token', '')), self.token):
+                    LOGGER.warn(f"Rejected an API process control connection from {writer.get_extra_info('peername')} with an invalid token.")
+                    break
+                try:
+                    response = {'ok': True, 'result': await self.handle_control_request(request)}
+                except Exception as e:
+                    LOGGER.debug(f"API process control request {request.get('command')} failed. {traceback.format_exc()}")
+                    response = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(response, default=str).encode() + b"\n")
+                await writer.drain()
+                if request.get('command') not in READ_ONLY_COMMANDS:
+                    self.publish_requested.set()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_control_request(self, request):
+        command = request.get('command')
+        if command == 'emit':
+            if request['event'] not in CONTROL_EVENTS:
+                raise ValueError(f"The API process may not emit '{request['event']}'.")
+            args = [self.decode(arg) for arg in request.get('args', [])]
+            kwargs = {key: self.decode(value) for key, value in request.get('kwargs', {}).items()}
+            await self.manager.event_bus.emit(request['event'], *args, **kwargs)
+        elif command == 'set_hon_data':
+            await apply_hon_data(request['data'])
+        elif command == 'set_app_data':
+            await apply_app_data(request['data'])
+        elif command == 'rolling_restart':
+            game_servers = [self.manager.game_servers[port] for port in request['ports'] if port in self.manager.game_servers]
+            self.manager.rolling_restart.start(game_servers, reason=request['reason'])
+        elif command == 'find_replay':
+            replay_exists, path = await self.manager.find_replay_file(request['file_name'])
+            return [replay_exists, str(path) if path else None]
+        elif command == 'metrics':
+            # rendered per scrape, rather than with every snapshot
+            return render_metrics()
+        else:
+            raise ValueError(f"Unknown command '{command}'.")
+
+    def decode(self, value):
+        """Game servers are sent by port (see ControlEventBus.encode)."""
+        if isinstance(value, dict) and 'game_server' in value:
+            game_server = self.manager.game_servers.get(value['game_server'])
+            if game_server is None:
+                raise ValueError(f"Server on port {value['game_server']} is not managed by manager.")
+            return game_server
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+    async def supervise(self, control_port):
+        """Start the API process, and restart it if it exits, until the manager stops."""
+        delay = RESTART_DELAY
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "cogs.connectors.api_worker", "--state", str(self.state_path), "--control-port", str(control_port), "--parent-pid", str(os.getpid())],
+                cwd=HOME_PATH,
+                env={**os.environ, 'HONFIGURATOR_API_TOKEN': self.token}
+            )
+            LOGGER.info(f"API server running in its own process (pid {self.process.pid}). Its log is logs/api.log")
+            # polled, as the windows selector event loop can't watch child processes
+            while self.process.poll() is None and not stop_event.is_set():
+                try:
+                    await asyncio.wait_for(stop_event.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+            if stop_event.is_set():
+                return
+            if time.monotonic() - started > STABLE_AFTER:
+                delay = RESTART_DELAY
+            LOGGER.error(f"API server process exited with code {self.process.returncode}. Restarting it in {delay} seconds.")
+            try:
+                await asyncio.wait_for(stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    def stop_process(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        LOGGER.info("Shutting down API Server")
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
@@ -11,7 +11,7 @@ import math
 from fastapi import FastAPI, Request, Response, Body, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 import httpx
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Any, Dict
 import uvicorn
 import asyncio
@@ -19,6 +19,11 @@ from cogs.misc.logger import get_logger, get_misc, get_home, get_setup, get_file
 from cogs.handlers.events import stop_event
 from cogs.db.roles_db_connector import RolesDatabase
 from cogs.game.match_parser import MatchParser
+from cogs.game.memory_admission import get_memory_admission
+from cogs.game.lag_monitor import get_lag_monitor
+from cogs.game.fleet_state import FleetStateReader, describe
+from cogs.misc.metrics import render_metrics
+from cogs.connectors.api_state import ControlError
 from typing import Any, Dict, List, Tuple
 import logging
 from os.path import exists
@@ -206,6 +211,22 @@ def get_skipped_frame_data(port: str):
 async def get_hon_version():
     return {"data":MISC.hon_version}
 
+@app.get("/metrics", summary="Manager metrics in the Prometheus text format, for scraping. Needs the monitor permission, unless man_metrics_public is set")
+async def metrics(request: Request):
+    if not global_config['hon_data'].get('man_metrics_public'):
+        # per instance counters, so kept to the monitor permission like the other monitoring endpoints
+        token = await oauth2_scheme(request)
+        await check_permission_factory(required_permission="monitor")(request, await verify_token(request, token))
+    # async, so it renders on the event loop that writes the metrics, rather than in a worker thread.
+    # In the API process, the manager renders them (ControlClient.metrics)
+    content = manager_metrics()
+    if asyncio.iscoroutine(content):
+        try:
+            content = await content
+        except ControlError as e:
+            return JSONResponse(status_code=503, content=str(e))
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 """Protected Endpoints"""
 """Client registration to add server"""
 class RegistrationResponse(BaseModel):
@@ -277,25 +298,38 @@ async def get_replay(match_id: str, token_and_user_info: dict = Depends(check_pe
 @app.post("/api/set_hon_data", description="Sets the 'hon_data' key within the global manager data dictionary")
 async def set_hon_data(hon_data: dict = Body(...), token_and_user_info: dict = Depends(check_permission_factory(required_permission="configure"))):
     try:
-        validation = await SETUP.validate_hon_data(hon_data=hon_data)
-        if validation:
-            global_config['hon_data'] = hon_data
-            await manager_event_bus.emit('update_server_start_semaphore')
-            await manager_event_bus.emit('config_change_hook_actions')
-            await manager_event_bus.emit('check_for_restart_required')
-    except ValueError as e:
+        if manager_control:
+            await manager_control.request({'command': 'set_hon_data', 'data': hon_data})
+        else:
+            await apply_hon_data(hon_data)
+    except (ValueError, ControlError) as e:
         return JSONResponse(status_code=501, content=str(e))
 
 @app.post("/api/set_app_data", description="Sets the 'application_data' key within the global manager data dictionary")
 async def set_app_data(app_data: dict = Body(...), token_and_user_info: dict = Depends(check_permission_factory(required_permission="configure"))):
     try:
-        validation = await SETUP.validate_hon_data(application_data=app_data)
-        if validation:
-            global_config['application_data'] = app_data
-            await manager_event_bus.emit('check_for_restart_required', config_reload=True)
-    except ValueError as e:
+        if manager_control:
+            await manager_control.request({'command': 'set_app_data', 'data': app_data})
+        else:
+            await apply_app_data(app_data)
+    except (ValueError, ControlError) as e:
         return JSONResponse(status_code=501, content=str(e))
 
+async def apply_hon_data(hon_data):
+    """Validate and apply new hon_data. Runs in the manager, also when the API is in its own process."""
+    validation = await SETUP.validate_hon_data(hon_data=hon_data)
+    if validation:
+        global_config['hon_data'] = hon_data
+        await manager_event_bus.emit('update_server_start_semaphore')
+        await manager_event_bus.emit('config_change_hook_actions')
+        await manager_event_bus.emit('check_for_restart_required')
+
+async def apply_app_data(app_data):
+    validation = await SETUP.validate_hon_data(application_data=app_data)
+    if validation:
+        global_config['application_data'] = app_data
+        await manager_event_bus.emit('check_for_restart_required', config_reload=True)
+
 class TotalServersResponse(BaseModel):
     total_servers: int
 
@@ -306,34 +340,34 @@ def get_total_servers(token_and_user_info: dict = Depends(check_permission_facto
 class TaskStatusResponse(BaseModel):
     tasks_status: dict
 
+def summarise_tasks(tasks_dict):
+    task_summary = {}
+    for task_name, task in tasks_dict.items():
+        if task is None:
+            continue
+        if task.done():
+            try:
+                if task.exception() is not None:
+                    task_summary[task_name] = {'status': 'Done', 'exception': str(task.exception()), 'end_time': task.end_time}
+                else:
+                    task_summary[task_name] = {'status': 'Done', 'end_time': task.end_time}
+            except asyncio.CancelledError:
+                task_summary[task_name] = {'status': 'Cancelled'}
+        else:
+            task_summary[task_name] = {'status': 'Running'}
+    return task_summary
+
 @app.get("/api/get_tasks_status", response_model=TaskStatusResponse)
 def get_tasks_status(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
-    def task_status(tasks_dict):
-        task_summary = {}
-        for task_name, task in tasks_dict.items():
-            if task is None:
-                continue
-            if task.done():
-                try:
-                    if task.exception() is not None:
-                        task_summary[task_name] = {'status': 'Done', 'exception': str(task.exception()), 'end_time': task.end_time}
-                    else:
-                        task_summary[task_name] = {'status': 'Done', 'end_time': task.end_time}
-                except asyncio.CancelledError:
-                    task_summary[task_name] = {'status': 'Cancelled'}
-            else:
-                task_summary[task_name] = {'status': 'Running'}
-        return task_summary
-    
     temp = {}
     temp_gameserver_tasks = {}
 
     for game_server in game_servers.values():
-        temp_gameserver_tasks[game_server.config.get_local_by_key('svr_name')] = task_status(game_server.tasks)
+        temp_gameserver_tasks[game_server.config.get_local_by_key('svr_name')] = summarise_tasks(game_server.tasks)
 
-    temp['manager'] = task_status(manager_tasks)
+    temp['manager'] = summarise_tasks(manager_tasks)
     temp['game_servers'] = temp_gameserver_tasks
-    temp['health_checks'] = task_status(health_check_tasks)
+    temp['health_checks'] = summarise_tasks(health_check_tasks)
 
     return {"tasks_status": temp}
 
@@ -600,6 +634,82 @@ def get_instances(token_and_user_info: dict = Depends(check_permission_factory(r
         temp[game_server.config.get_local_by_key('svr_name')] = game_server.get_pretty_status_for_webui()
     return temp
 
+@app.get("/api/get_startup_timings", summary="Get server startup phase timings and the start concurrency state")
+def get_startup_timings(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    """
+    Timings are in seconds since the start was queued, for each phase:
+        admitted - enough free RAM to start (see /api/get_memory_admission)
+        slot_acquired - allowed to start by the start controller
+        spawn - process launched (or fork requested from the cowmaster)
+        tcp_register - game server connected to the manager
+        first_status - first status update (0x42) received
+    """
+    temp = {}
+    for game_server in game_servers.values():
+        temp[game_server.config.get_local_by_key('svr_name')] = game_server.start_timings
+    return {
+        "controller": server_start_controller.get_status() if server_start_controller else None,
+        "instances": temp
+    }
+
+@app.get("/api/get_rolling_restart_status", summary="Get the progress of the current (or last) rolling restart")
+def get_rolling_restart_status(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    return manager_rolling_restart.get_status()
+
+@app.get("/api/rolling_restart/progress", summary="Stream rolling restart progress as server-sent events, until it completes")
+async def stream_rolling_restart_progress(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    async def event_stream():
+        async for event in manager_rolling_restart.stream_progress():
+            yield f"data: {json.dumps(event)}\n\n"
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/api/rolling_restart", summary="Restart all game servers, a few at a time, keeping man_rolling_restart_floor servers ready")
+async def start_rolling_restart(token_and_user_info: dict = Depends(check_permission_factory(required_permission="control"))):
+    manager_rolling_restart.start(list(game_servers.values()), reason=f"requested by {token_and_user_info['user_info'].get('username', 'the API')}")
+    return manager_rolling_restart.get_status()
+
+@app.get("/api/get_autoscaler_status", summary="Get the autoscaler's demand history and recent decisions")
+def get_autoscaler_status(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    if not manager_autoscaler:
+        return JSONResponse(status_code=404, content={"error":"Autoscaler is not available."})
+    return manager_autoscaler.get_status()
+
+@app.get("/api/get_memory_admission", summary="Get the learnt instance memory footprints, memory pressure and the last start admission decision")
+def get_memory_admission_status(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    return manager_memory_admission.get_status()
+
+@app.get("/api/get_lag_report", summary="Get event loop lag, recent lag spikes with stack samples, and per instance skipped frame rates")
+def get_lag_report(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    return manager_lag_monitor.get_status(list(game_servers.values()))
+
+@app.get("/api/get_fleet_state", summary="Get every instance's status, game phase, clients, match, uptime, CPU and skipped frames, from the fleet state table")
+def get_fleet_state(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    try:
+        reader = FleetStateReader()
+    except (OSError, ValueError):
+        return JSONResponse(status_code=404, content={"error":"The fleet state table is not available."})
+    try:
+        return [describe(record) for record in reader.read_all()]
+    finally:
+        reader.close()
+
+@app.get("/api/get_cowmaster_stats", summary="Get CowMaster fork latency and memory sharing statistics")
+def get_cowmaster_stats(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    if not global_config['hon_data'].get('man_use_cowmaster') or not manager_cowmaster:
+        return JSONResponse(status_code=404, content={"error":"CowMaster is not in use."})
+    return manager_cowmaster.get_fork_stats(list(game_servers.values()))
+
+@app.get("/api/get_proxy_stats", summary="Get per instance proxy traffic statistics")
+def get_proxy_stats(token_and_user_info: dict = Depends(check_permission_factory(required_permission="monitor"))):
+    """
+    Packet, byte and turnaround statistics for the built-in UDP proxy, per game server instance.
+    Only populated on linux, where the manager relays proxy traffic itself.
+    """
+    temp = {}
+    for game_server in game_servers.values():
+        temp[game_server.config.get_local_by_key('svr_name')] = game_server.get_proxy_stats()
+    return temp
+
 """
 Roles & Perms
 """
@@ -947,8 +1057,11 @@ async def asgi_server(app, host, port):
                 LOGGER.error(f"Server is not pingable over port {global_config['hon_data']['svr_api_port']}/tcp. Ensure that your firewall / router is configured to accept this traffic.")
         except Exception:
             LOGGER.error(f"Error when attempting to ping server from remote management\n{traceback.format_exc()}")
-            
-        await stop_event.wait()
+
+        # uvicorn exits on its own when the API process is signalled to stop
+        stop_task = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({server_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
         
     finally:
         server.should_exit = True  # this flag tells Uvicorn to wrap up and exit
@@ -967,15 +1080,33 @@ async def fetch_server_ping_response():
             response_text = await response.text()
             return response.status, response_text
 
-async def start_api_server(config, game_servers_dict, game_manager_tasks, health_tasks, event_bus, find_replay_callback, host="0.0.0.0", port=5000):
-    global global_config, game_servers, manager_event_bus, manager_tasks, health_check_tasks, manager_find_replay_callback
+def set_api_context(config, game_servers_dict, game_manager_tasks, health_tasks, event_bus, find_replay_callback, start_controller=None, cowmaster=None, autoscaler=None, rolling_restart=None, memory_admission=None, lag_monitor=None, metrics=render_metrics, control=None):
+    """
+    The manager objects the endpoints read from and act on. In the manager's process these are the real objects.
+    In the API process (man_api_process) they are stand-ins backed by the manager's state snapshot, and control is the
+    channel requests that change the manager's configuration are sent over (see api_state.py).
+    """
+    global global_config, game_servers, manager_event_bus, manager_tasks, health_check_tasks, manager_find_replay_callback, server_start_controller, manager_cowmaster, manager_autoscaler, manager_rolling_restart, manager_memory_admission, manager_lag_monitor, manager_metrics, manager_control
     global_config = config
     game_servers = game_servers_dict
     manager_event_bus = event_bus
     manager_tasks = game_manager_tasks
     health_check_tasks = health_tasks
     manager_find_replay_callback = find_replay_callback
-
+    server_start_controller = start_controller
+    manager_cowmaster = cowmaster
+    manager_autoscaler = autoscaler
+    manager_rolling_restart = rolling_restart
+    manager_memory_admission = memory_admission or get_memory_admission()
+    manager_lag_monitor = lag_monitor or get_lag_monitor()
+    manager_metrics = metrics
+    manager_control = control
+
+async def start_api_server(config, game_servers_dict, game_manager_tasks, health_tasks, event_bus, find_replay_callback, start_controller=None, cowmaster=None, autoscaler=None, rolling_restart=None, host="0.0.0.0", port=5000):
+    set_api_context(config, game_servers_dict, game_manager_tasks, health_tasks, event_bus, find_replay_callback, start_controller=start_controller, cowmaster=cowmaster, autoscaler=autoscaler, rolling_restart=rolling_restart)
+    await serve_api(host, port)
+
+async def serve_api(host="0.0.0.0", port=5000):
     # Create a new logger for uvicorn
     uvicorn_logger = logging.getLogger("uvicorn")
 
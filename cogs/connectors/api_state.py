@@ -0,0 +1,347 @@
+"""
+Shared state and control channel between the manager, and the API server when it runs in its own process (man_api_process).
+
+The manager publishes a snapshot of everything the API reads (the configuration, each game server's state, task and
+component status) into a memory mapped file. The API process reads the latest snapshot per request, so a
+burst of API calls never touches the manager's event loop. Control requests (stop / start servers, configuration
+changes, ...) go the other way, as JSON lines over a localhost TCP connection authenticated with a per launch token.
+
+The snapshot is a dict of parts, each pickled on its own so that the manager only pickles again the parts that changed.
+The game servers are a part each. It is written under a sequence lock:
+    header: sequence (u64), payload length (u64), payload crc32 (u32)
+The sequence is odd while the manager is writing. A reader that catches a write in progress, or finds the sequence
+changed while it copied the payload, serves the snapshot it already has, and reads the new one on its next request.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from datetime import datetime
+from cogs.handlers.data_handler import ConfigManagement
+from cogs.game.cow_master import measure_memory_sharing
+from cogs.misc.logger import get_logger, get_misc
+
+LOGGER = get_logger()
+MISC = get_misc()
+
+HEADER = struct.Struct("<QQI")
+SNAPSHOT_CAPACITY = 16 * 1024 * 1024    # bytes. The file is sparse where the OS supports it
+
+
+class ControlError(Exception):
+    """The manager could not carry out a request from the API process."""
+
+
+class StateSnapshotWriter:
+    def __init__(self, path, capacity=SNAPSHOT_CAPACITY):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.sequence = 0
+        self.too_large_logged = False
+        os.makedirs(self.path.parent, exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.truncate(capacity)
+        self.file = open(self.path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), capacity)
+
+    def publish(self, state):
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if HEADER.size + len(payload) > self.capacity:
+            if not self.too_large_logged:
+                LOGGER.error(f"API state snapshot is {len(payload)} bytes, larger than the {self.capacity} bytes shared with the API process. The API is serving stale data.")
+                self.too_large_logged = True
+            return False
+        self.sequence += 1
+        HEADER.pack_into(self.mmap, 0, self.sequence, 0, 0)
+        self.mmap[HEADER.size:HEADER.size + len(payload)] = payload
+        self.sequence += 1
+        HEADER.pack_into(self.mmap, 0, self.sequence, len(payload), zlib.crc32(payload))
+        return True
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class StateSnapshotReader:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sequence = None
+        self.state = None
+        self.views = {}
+
+    def read(self):
+        """
+        Never waits for the manager, as it's called on the API process's event loop.
+
+        Returns:
+            dict: the latest snapshot, or the one before it while the manager is writing. None if none has been published yet.
+            Only unpickled when it has changed.
+        """
+        sequence, length, crc = HEADER.unpack_from(self.mmap, 0)
+        if sequence == self.sequence or sequence == 0 or sequence % 2:
+            return self.state
+        payload = self.mmap[HEADER.size:HEADER.size + length]
+        if HEADER.unpack_from(self.mmap, 0)[0] != sequence or zlib.crc32(payload) != crc:
+            return self.state
+        self.state = self.decode(pickle.loads(payload))
+        self.sequence = sequence
+        self.views = {}
+        self.apply_misc(self.state.get('misc', {}))
+        return self.state
+
+    @staticmethod
+    def decode(parts):
+        state = {key: pickle.loads(value) for key, value in parts.items() if key != 'game_servers'}
+        state['game_servers'] = {port: pickle.loads(value) for port, value in parts.get('game_servers', {}).items()}
+        return state
+
+    @staticmethod
+    def apply_misc(values):
+        """Values the manager looked up at launch, so the API process doesn't repeat the lookups."""
+        for key, value in values.items():
+            if value is not None:
+                setattr(MISC, key, value)
+
+    def get(self, key, default=None):
+        state = self.read()
+        if state is None:
+            return default
+        return state.get(key, default)
+
+    def get_view(self, key, build):
+        """Objects built from a part of the snapshot, rebuilt only when a new snapshot is read."""
+        self.read()
+        if key not in self.views:
+            self.views[key] = build(self.get(key))
+        return self.views[key]
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+"""Stand-ins for the manager's objects, used by the API endpoints in the API process."""
+
+class SnapshotMapping(Mapping):
+    """A read only dict, backed by the latest snapshot."""
+    def __init__(self, reader, key, build=None):
+        self.reader = reader
+        self.key = key
+        self.build = build or (lambda value: value or {})
+
+    def data(self):
+        return self.reader.get_view(self.key, self.build)
+
+    def __getitem__(self, key):
+        return self.data()[key]
+
+    def __iter__(self):
+        return iter(self.data())
+
+    def __len__(self):
+        return len(self.data())
+
+    def copy(self):
+        return dict(self.data())
+
+
+class GameServerConfigSnapshot(ConfigManagement):
+    def __init__(self, id, gbl, local):
+        self.id = id
+        self.gbl = gbl
+        self.local = local
+
+    def get_local_configuration(self):
+        return self.local
+
+
+class GameServerSnapshot:
+    def __init__(self, state, global_config):
+        self.id = state['id']
+        self.port = state['port']
+        self._pid = state['pid']
+        self.game_state = state['game_state']
+        self.performance = state['performance']
+        self.config = GameServerConfigSnapshot(self.id, global_config, state['local_config'])
+        self.pretty_status = state['pretty_status']
+        self.public_game_port = state['public_game_port']
+        self.public_voice_port = state['public_voice_port']
+        self.start_timings = state['start_timings']
+        self.proxy_stats = state['proxy_stats']
+        self.tasks = {name: TaskSnapshot(summary) for name, summary in state['tasks'].items()}
+
+    def get_dict_value(self, attribute, default=None):
+        if attribute in self.game_state:
+            return self.game_state[attribute]
+        return self.performance.get(attribute, default)
+
+    def get_pretty_status_for_webui(self):
+        return self.pretty_status
+
+    def get_public_game_port(self):
+        return self.public_game_port
+
+    def get_public_voice_port(self):
+        return self.public_voice_port
+
+    def get_proxy_stats(self):
+        return self.proxy_stats
+
+
+class TaskSnapshot:
+    """Answers the asyncio.Task methods the task status endpoint uses, from a summary of the manager's task."""
+    def __init__(self, summary):
+        self.summary = summary
+        self.end_time = summary.get('end_time')
+
+    def done(self):
+        return self.summary['status'] != 'Running'
+
+    def cancelled(self):
+        return self.summary['status'] == 'Cancelled'
+
+    def exception(self):
+        if self.cancelled():
+            raise asyncio.CancelledError()
+        return self.summary.get('exception')
+
+
+class StatusSnapshot:
+    """For components the API only asks for get_status(). The manager publishes their status under `key`."""
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key = key
+
+    def get_status(self, *args):
+        return self.reader.get(self.key)
+
+
+class CowMasterSnapshot:
+    def __init__(self, reader):
+        self.reader = reader
+
+    def get_fork_stats(self, game_servers=None):
+        """The fork statistics are the manager's. The memory sharing figures read /proc, so are measured here, rather than on the manager's event loop."""
+        stats = dict(self.reader.get('cowmaster_stats') or {})
+        if game_servers is not None:
+            stats['memory'] = measure_memory_sharing(game_servers)
+        return stats
+
+
+class RollingRestartSnapshot:
+    def __init__(self, reader, control):
+        self.reader = reader
+        self.control = control
+        self.tasks = set()  # start requests still being sent. Finished ones remove themselves
+
+    def get_status(self):
+        return self.reader.get('rolling_restart') or {'running': False}
+
+    def start(self, game_servers, reason):
+        # the status returned straight after by the endpoint is from the last snapshot, the restart shows in the next one
+        task = asyncio.create_task(self.control.request({'command': 'rolling_restart', 'ports': [game_server.port for game_server in game_servers], 'reason': reason}))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def stream_progress(self):
+        last_event = None
+        last_sent = time.monotonic()
+        while True:
+            status = self.get_status()
+            events = status.get('events', [])
+            # the snapshot only carries the latest events, so carry on from the last one sent, if it is still there
+            if last_event in events:
+                events = events[len(events) - events[::-1].index(last_event):]
+            for event in events:
+                yield event
+                last_event = event
+                last_sent = time.monotonic()
+            if not status.get('running'):
+                return
+            if time.monotonic() - last_sent > 15:
+                yield {'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'message': 'keepalive'}
+                last_sent = time.monotonic()
+            await asyncio.sleep(1)
+
+
+class ControlEventBus:
+    """EventBus.emit, forwarded to the manager. Game servers are sent by port."""
+    def __init__(self, control):
+        self.control = control
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, GameServerSnapshot):
+            return {'game_server': value.port}
+        if isinstance(value, (list, tuple)):
+            return [ControlEventBus.encode(item) for item in value]
+        return value
+
+    async def emit(self, event_type, *args, **kwargs):
+        return await self.control.request({
+            'command': 'emit',
+            'event': event_type,
+            'args': [self.encode(arg) for arg in args],
+            'kwargs': {key: self.encode(value) for key, value in kwargs.items()}
+        })
+
+
+class ControlClient:
+    """The API process's end of the control channel. One connection, one request at a time."""
+    def __init__(self, port, token, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, message, timeout=30):
+        """
+        Returns:
+            the result of the request.
+
+        Raises:
+            ControlError: the manager could not be reached, or could not carry out the request.
+        """
+        async with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.writer is None or self.writer.is_closing():
+                        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                    self.writer.write(json.dumps({'token': self.token, **message}, default=str).encode() + b"\n")
+                    await self.writer.drain()
+                    line = await asyncio.wait_for(self.reader.readline(), timeout)
+                    if not line:
+                        raise ConnectionResetError("connection closed by the manager")
+                    response = json.loads(line)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                    if self.writer is not None:
+                        self.writer.close()
+                    self.writer = None
+                    # a dropped idle connection is reconnected once. Anything else may have been carried out, so isn't resent
+                    if attempt or not isinstance(e, ConnectionError):
+                        raise ControlError(f"the manager did not answer: {e!r}")
+        if not response.get('ok'):
+            raise ControlError(response.get('error', 'the manager rejected the request'))
+        return response.get('result')
+
+    async def metrics(self):
+        """render_metrics(), run by the manager."""
+        return await self.request({'command': 'metrics'})
+
+    async def find_replay(self, replay_file_name):
+        """GameServerManager.find_replay_file, run by the manager."""
+        replay_exists, path = await self.request({'command': 'find_replay', 'file_name': replay_file_name})
+        return replay_exists, path
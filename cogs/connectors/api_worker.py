@@ -0,0 +1,112 @@
+"""
+The API server process, started by the manager when man_api_process is enabled (see api_process.py).
+
+Serves the same API as the manager does in process, from the manager's state snapshot. Requests that change anything
+are sent back to the manager over the control channel. Exits when the manager does.
+
+    python -m cogs.connectors.api_worker --state <snapshot file> --control-port <port> --parent-pid <manager pid>
+The control channel token is passed in the HONFIGURATOR_API_TOKEN environment variable.
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+from pathlib import Path
+
+HOME_PATH = Path(__file__).resolve().parents[2]
+CONFIG_FILE = HOME_PATH / 'config' / 'config.json'
+SNAPSHOT_WAIT = 30      # seconds to wait for the manager's first snapshot
+
+#   As in main.py, logging and the shared objects are set up before the modules that read them at import are imported.
+from cogs.misc.logger import get_logger, set_logger, set_home, set_misc, set_setup
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="HoNfigurator API server process")
+    parser.add_argument("--state", required=True, help="The manager's state snapshot file")
+    parser.add_argument("--control-port", type=int, required=True, help="The manager's control channel port, on 127.0.0.1")
+    parser.add_argument("--parent-pid", type=int, required=True, help="The manager's pid. The API process exits when it does")
+    return parser.parse_args()
+
+
+async def watch_parent(parent_pid):
+    """Stop if the manager is gone, in case it could not stop the API process itself."""
+    import asyncio
+    import psutil
+    from cogs.handlers.events import stop_event
+    while not stop_event.is_set():
+        if not psutil.pid_exists(parent_pid):
+            get_logger().warn(f"The manager (pid {parent_pid}) is no longer running. Shutting down the API server.")
+            stop_event.set()
+            return
+        await asyncio.sleep(2)
+
+
+async def serve(reader, control_port, parent_pid):
+    import asyncio
+    from cogs.connectors import api_state
+    from cogs.connectors.api_server import set_api_context, serve_api
+
+    control = api_state.ControlClient(control_port, os.environ['HONFIGURATOR_API_TOKEN'])
+    # copies, as endpoints may modify what they're given, and the snapshot is shared by every request
+    global_config = api_state.SnapshotMapping(reader, 'global_config', lambda value: copy.deepcopy(value))
+    game_servers = api_state.SnapshotMapping(reader, 'game_servers', lambda value: {port: api_state.GameServerSnapshot(state, global_config) for port, state in (value or {}).items()})
+    task_summaries = lambda value: {name: api_state.TaskSnapshot(summary) for name, summary in (value or {}).items()}
+
+    set_api_context(
+        global_config,
+        game_servers,
+        api_state.SnapshotMapping(reader, 'manager_tasks', task_summaries),
+        api_state.SnapshotMapping(reader, 'health_check_tasks', task_summaries),
+        api_state.ControlEventBus(control),
+        control.find_replay,
+        start_controller=api_state.StatusSnapshot(reader, 'start_controller'),
+        cowmaster=api_state.CowMasterSnapshot(reader),
+        autoscaler=api_state.StatusSnapshot(reader, 'autoscaler') if reader.get('autoscaler') is not None else None,
+        rolling_restart=api_state.RollingRestartSnapshot(reader, control),
+        memory_admission=api_state.StatusSnapshot(reader, 'memory_admission'),
+        lag_monitor=api_state.StatusSnapshot(reader, 'lag_report'),
+        metrics=control.metrics,
+        control=control
+    )
+    parent_watch = asyncio.create_task(watch_parent(parent_pid))
+    try:
+        await serve_api(port=global_config['hon_data']['svr_api_port'])
+    finally:
+        parent_watch.cancel()
+
+
+def main():
+    args = parse_arguments()
+    set_home(HOME_PATH)
+    set_logger(log_file_name='api.log')
+    logger = get_logger()
+
+    from cogs.misc.utilities import Misc
+    set_misc(Misc())
+
+    from cogs.connectors.api_state import StateSnapshotReader
+    reader = StateSnapshotReader(args.state)
+    deadline = time.monotonic() + SNAPSHOT_WAIT
+    # the manager's launch lookups (public IP, version, ...) come with the snapshot, so they aren't repeated here
+    while reader.read() is None:
+        if time.monotonic() > deadline:
+            logger.critical("The manager has not published its state. The API server can't start.")
+            sys.exit(1)
+        time.sleep(0.1)
+
+    from cogs.misc.setup import SetupEnvironment
+    set_setup(SetupEnvironment(CONFIG_FILE))
+
+    from cogs.misc.event_loop import create_event_loop
+    loop, description, warning = create_event_loop(reader.get('global_config')['hon_data'].get('man_event_loop', 'auto'))
+    if warning:
+        logger.warn(warning)
+    logger.info(f"API server process started. Event loop: {description}")
+    loop.run_until_complete(serve(reader, args.control_port, args.parent_pid))
+
+
+if __name__ == "__main__":
+    main()
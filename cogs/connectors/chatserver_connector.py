@@ -6,8 +6,10 @@ from enum import Enum
 from cogs.misc.logger import get_logger
 from cogs.handlers.events import stop_event
 from cogs.TCP.packet_parser import ManagerChatParser
+from cogs.TCP.packet_capture import get_packet_capture, SOURCE_CHAT
 
 LOGGER = get_logger()
+PACKET_CAPTURE = get_packet_capture()
 
 class ChatServerHandler:
     def __init__(self, chat_address, chat_port, session_id, server_id, username, version, region, server_name, ip_addr, udp_ping_responder_port, event_bus):
@@ -162,6 +164,8 @@ class ChatServerHandler:
                 await self.writer.wait_closed()
 
     async def handle_received_packet(self, msg_len, msg_type, data):
+        if PACKET_CAPTURE.active:
+            PACKET_CAPTURE.record(SOURCE_CHAT, 0, data)
         parsed = await self.manager_chat_parser.handle_packet(msg_type,msg_len,data,"receiving")
 
         if msg_type == 0x1700:
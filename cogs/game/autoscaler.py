@@ -0,0 +1,211 @@
+import asyncio
+import json
+import math
+import os
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from cogs.misc.logger import get_logger, get_home
+from cogs.handlers.events import stop_event, GameStatus
+from cogs.game.memory_admission import get_memory_admission
+
+LOGGER = get_logger()
+HOME_PATH = get_home()
+
+TICK_INTERVAL = 15              # seconds between autoscaler decisions
+LOOKAHEAD = timedelta(minutes=30)   # how far ahead the time-of-day history is consulted, so servers are awake before the peak
+HISTORY_SMOOTHING = 0.3         # weight of the latest hour when updating the time-of-day history
+SLEEP_GRACE = 120               # seconds a server must have been ready before it is put to sleep. Avoids flapping
+
+
+class Autoscaler:
+    """
+    Keeps enough game servers ready for incoming matches, and no more.
+
+    Every TICK_INTERVAL the occupied / ready / sleeping servers are counted. The target number of ready servers is
+        man_autoscale_free_buffer + the extra occupied servers expected within LOOKAHEAD, from the time-of-day history.
+    Below the target, sleeping servers are woken first, then unstarted servers (e.g. left unforked by the cowmaster warm pool) are started.
+    Above the target, surplus ready servers are put to sleep, which frees their CPU.
+
+    Servers are never stopped or added. svr_total remains the upper bound, changed only by the user (balance_game_server_count).
+
+    The history is the smoothed peak number of occupied servers for each hour of each weekday, saved to disk so it survives restarts.
+    The time spent with no ready server (where an incoming match would have had to wait or go elsewhere) is tracked, to show the effect of the decisions.
+    """
+    def __init__(self, global_config, game_servers, event_bus):
+        self.global_config = global_config
+        self.game_servers = game_servers
+        self.event_bus = event_bus
+        self.history_file = os.path.join(f"{HOME_PATH}", "game_states", "autoscaler_history.json")
+        self.history = self.load_history()
+        self.current_hour = self.get_bucket(datetime.now())
+        self.hour_stats = self.new_hour_stats()
+        self.ready_since = {}   # instance id -> monotonic time it was last seen becoming ready
+        self.decisions = deque(maxlen=100)
+        self.last_tick = None
+
+    @staticmethod
+    def get_bucket(when):
+        return f"{when.weekday()}-{when.hour}"
+
+    @staticmethod
+    def new_hour_stats():
+        return {'peak_occupied': 0, 'seconds_without_ready': 0, 'woken': 0, 'slept': 0, 'started': 0}
+
+    def load_history(self):
+        try:
+            with open(self.history_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_history(self):
+        try:
+            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+            with open(self.history_file, 'w') as f:
+                json.dump(self.history, f)
+        except OSError:
+            LOGGER.warn(f"Autoscaler - unable to save demand history. {traceback.format_exc()}")
+
+    def is_enabled(self):
+        return self.global_config['hon_data'].get('man_autoscale', False)
+
+    def get_buffer(self):
+        return max(1, int(self.global_config['hon_data'].get('man_autoscale_free_buffer', 2)))
+
+    def predict_peak(self, now, occupied):
+        """The number of occupied servers to prepare for, from now until now + LOOKAHEAD."""
+        expected = [occupied]
+        for when in (now, now + LOOKAHEAD):
+            if self.get_bucket(when) in self.history:
+                expected.append(self.history[self.get_bucket(when)])
+        return math.ceil(max(expected))
+
+    def roll_hour(self, now):
+        bucket = self.get_bucket(now)
+        if bucket == self.current_hour:
+            return
+        stats = self.hour_stats
+        previous = self.history.get(self.current_hour)
+        if previous is None:
+            self.history[self.current_hour] = stats['peak_occupied']
+        else:
+            self.history[self.current_hour] = round(previous + (stats['peak_occupied'] - previous) * HISTORY_SMOOTHING, 2)
+        LOGGER.info(f"Autoscaler - hourly summary: peak {stats['peak_occupied']} occupied, {stats['seconds_without_ready']}s with no ready server, "
+                    f"woke {stats['woken']}, slept {stats['slept']}, started {stats['started']}.")
+        self.save_history()
+        self.current_hour = bucket
+        self.hour_stats = self.new_hour_stats()
+
+    def classify(self):
+        occupied, ready, sleeping, unstarted = [], [], [], []
+        for game_server in self.game_servers.values():
+            status = game_server.get_dict_value('status')
+            if status == GameStatus.OCCUPIED.value:
+                occupied.append(game_server)
+            elif status == GameStatus.READY.value and not game_server.scheduled_shutdown:
+                ready.append(game_server)
+            elif status == GameStatus.SLEEPING.value and not game_server.scheduled_shutdown:
+                sleeping.append(game_server)
+            elif status == GameStatus.UNKNOWN.value and game_server.client_connection is None and not game_server.delete_me and game_server.enabled:
+                # servers an admin stopped or disabled stay stopped: starting them would enable them again
+                unstarted.append(game_server)
+        return occupied, ready, sleeping, unstarted
+
+    async def tick(self):
+        now = datetime.now()
+        monotonic_now = time.monotonic()
+        self.roll_hour(now)
+
+        occupied, ready, sleeping, unstarted = self.classify()
+        starting = [game_server for game_server in self.game_servers.values() if game_server.get_dict_value('status') in [GameStatus.STARTING.value, GameStatus.QUEUED.value]]
+
+        for game_server in ready:
+            self.ready_since.setdefault(game_server.id, monotonic_now)
+        for instance_id in [instance_id for instance_id in self.ready_since if instance_id not in [game_server.id for game_server in ready]]:
+            del self.ready_since[instance_id]
+
+        self.hour_stats['peak_occupied'] = max(self.hour_stats['peak_occupied'], len(occupied))
+        if not ready and self.last_tick is not None:
+            self.hour_stats['seconds_without_ready'] += round(monotonic_now - self.last_tick)
+        self.last_tick = monotonic_now
+
+        predicted_peak = self.predict_peak(now, len(occupied))
+        target_ready = self.get_buffer() + max(0, predicted_peak - len(occupied))
+        # servers that are starting will be ready shortly, count them already
+        shortfall = target_ready - len(ready) - len(starting)
+
+        actions = []
+        if shortfall > 0:
+            for game_server in sorted(sleeping, key=lambda game_server: game_server.id)[:shortfall]:
+                await self.event_bus.emit('cmd_wake_server', game_server)
+                actions.append(f"woke #{game_server.id}")
+                self.hour_stats['woken'] += 1
+                shortfall -= 1
+            if shortfall > 0 and unstarted:
+                if get_memory_admission().is_under_pressure():
+                    actions.append("start deferred, memory pressure")
+                else:
+                    to_start = sorted(unstarted, key=lambda game_server: game_server.id)[:shortfall]
+                    await self.event_bus.emit('start_game_servers', to_start, service_recovery=True, config_reload=False)
+                    actions.extend(f"started #{game_server.id}" for game_server in to_start)
+                    self.hour_stats['started'] += len(to_start)
+        elif len(ready) > target_ready:
+            # put the longest ready servers to sleep first, keeping the most recently woken ones available
+            candidates = [game_server for game_server in ready if monotonic_now - self.ready_since.get(game_server.id, monotonic_now) >= SLEEP_GRACE]
+            candidates.sort(key=lambda game_server: self.ready_since[game_server.id])
+            for game_server in candidates[:len(ready) - target_ready]:
+                await self.event_bus.emit('cmd_sleep_server', game_server)
+                self.ready_since.pop(game_server.id, None)
+                actions.append(f"slept #{game_server.id}")
+                self.hour_stats['slept'] += 1
+
+        if actions:
+            decision = {
+                'time': now.strftime("%Y-%m-%d %H:%M:%S"),
+                'occupied': len(occupied),
+                'ready': len(ready),
+                'sleeping': len(sleeping),
+                'starting': len(starting),
+                'predicted_peak': predicted_peak,
+                'target_ready': target_ready,
+                'actions': actions,
+                'seconds_without_ready_this_hour': self.hour_stats['seconds_without_ready']
+            }
+            self.decisions.append(decision)
+            LOGGER.info(f"Autoscaler - {len(occupied)} occupied, {len(ready)} ready, {len(sleeping)} sleeping, {len(starting)} starting. "
+                        f"Predicted peak {predicted_peak}, target {target_ready} ready. {', '.join(actions)}. "
+                        f"{self.hour_stats['seconds_without_ready']}s without a ready server this hour.")
+
+    async def run(self):
+        while not stop_event.is_set():
+            for _ in range(TICK_INTERVAL):
+                if stop_event.is_set():
+                    break
+                await asyncio.sleep(1)
+            if not self.is_enabled():
+                self.last_tick = None
+                continue
+            try:
+                await self.tick()
+            except Exception:
+                LOGGER.error(f"Autoscaler - {traceback.format_exc()}")
+        if self.history:
+            self.save_history()
+
+    def get_status(self):
+        occupied, ready, sleeping, unstarted = self.classify()
+        now = datetime.now()
+        return {
+            'enabled': self.is_enabled(),
+            'free_buffer': self.get_buffer(),
+            'occupied': len(occupied),
+            'ready': len(ready),
+            'sleeping': len(sleeping),
+            'unstarted': len(unstarted),
+            'predicted_peak': self.predict_peak(now, len(occupied)),
+            'this_hour': self.hour_stats,
+            'history': self.history,
+            'recent_decisions': list(self.decisions)[-20:]
+        }
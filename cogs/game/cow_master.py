@@ -2,15 +2,35 @@ import subprocess
 import psutil
 import asyncio
 import os
+import time
+from collections import deque
 
 from cogs.handlers.data_handler import get_cowmaster_configuration, ConfigManagement
 from cogs.misc.logger import get_logger, get_misc
 from cogs.handlers.events import stop_event
 from cogs.TCP.packet_parser import GameManagerParser
+from cogs.game.process_spawner import get_spawner
 
 LOGGER = get_logger()
 MISC = get_misc()
 
+FORK_TIMEOUT = 10   # seconds to wait for the 0x49 fork response from the cowmaster
+
+def measure_memory_sharing(game_servers):
+    """Memory each forked game server shares with the cowmaster (RSS - PSS). Reads /proc, so don't call this from the event loop."""
+    instances = {}
+    total_saved = 0
+    for game_server in game_servers:
+        if not game_server._pid:
+            continue
+        rollup = MISC.get_memory_rollup(game_server._pid)
+        if not rollup or 'Rss' not in rollup or 'Pss' not in rollup:
+            continue
+        saved = rollup['Rss'] - rollup['Pss']
+        total_saved += saved
+        instances[game_server.id] = {'rss': rollup['Rss'], 'pss': rollup['Pss'], 'shared_saving': saved}
+    return {'instances': instances, 'total_shared_saving': total_saved}
+
 class CowMaster:
     def __init__(self, port, global_config):
         self.port = port
@@ -31,17 +51,91 @@ class CowMaster:
         self._proc_hook = None
         self.status_received = asyncio.Event()
 
+        # fork requests waiting on a 0x49 response. {port: (future, time sent)}
+        self.pending_forks = {}
+        self.fork_latencies = deque(maxlen=200)
+        self.fork_counts = {'requested': 0, 'succeeded': 0, 'failed': 0, 'timed_out': 0}
+
         self.game_state = CowState(self.id, self.config.local)
         self.reset_cowmaster_state()
         self.game_state.add_listener(self.on_game_state_change)
 
         asyncio.create_task(self.monitor_process())
     
-    async def fork_new_server(self, game_server):
+    async def fork_new_server(self, game_server, timeout=FORK_TIMEOUT):
+        """
+        Request a fork for the given game server, and wait for the cowmaster to respond (0x49).
+
+        Returns:
+            bool: True if the cowmaster reported a successful fork, False if it failed or didn't respond in time.
+        """
         if not self.client_connection:
             LOGGER.warn("CowMaster - Not yet established connection to manager.")
+            return False
+
+        port = game_server.port
+        if port in self.pending_forks:
+            # a fork is already in flight for this port, wait on that one instead of requesting another.
+            future = self.pending_forks[port][0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.pending_forks[port] = (future, time.perf_counter())
+            self.fork_counts['requested'] += 1
+            await self.client_connection.send_packet(game_server.get_fork_bytes(), send_len=True)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self.pending_forks.get(port, (None,))[0] is future:
+                del self.pending_forks[port]
+                self.fork_counts['timed_out'] += 1
+                LOGGER.warn(f"CowMaster - No fork response for GameServer #{game_server.id} (port {port}) within {timeout} seconds.")
+            return False
+
+    async def fork_servers(self, game_servers, timeout=FORK_TIMEOUT):
+        """
+        Send fork requests for many game servers at once, rather than one after another.
+
+        Returns:
+            dict: {game_server: bool success}
+        """
+        results = await asyncio.gather(*[self.fork_new_server(game_server, timeout) for game_server in game_servers])
+        return dict(zip(game_servers, results))
+
+    def fork_acknowledged(self, port, success):
+        """ Called by the packet parser when a 0x49 fork response arrives. """
+        pending = self.pending_forks.pop(port, None)
+        if pending is None:
+            LOGGER.debug(f"CowMaster - Fork response for port {port}, which wasn't requested (or already timed out).")
             return
-        await self.client_connection.send_packet(game_server.get_fork_bytes(), send_len=True)
+        future, sent_at = pending
+        if success:
+            self.fork_counts['succeeded'] += 1
+            self.fork_latencies.append(time.perf_counter() - sent_at)
+        else:
+            self.fork_counts['failed'] += 1
+            LOGGER.warn(f"CowMaster - Fork failed for port {port}.")
+        if not future.done():
+            future.set_result(success)
+
+    def get_fork_stats(self, game_servers=None):
+        """
+        Fork latency and memory sharing statistics.
+
+        Args:
+            game_servers (list, optional): forked game servers to measure memory sharing for. Reads /proc, so don't call this from the event loop.
+        """
+        latencies = sorted(self.fork_latencies)
+        stats = {
+            **self.fork_counts,
+            'in_flight': len(self.pending_forks),
+            'latency_avg_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            'latency_p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2) if latencies else None,
+            'latency_max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+        if game_servers is not None:
+            stats['memory'] = measure_memory_sharing(game_servers)
+        return stats
 
     def set_configuration(self):
         self.config = ConfigManagement(self.id,self.global_config)
@@ -53,10 +147,10 @@ class CowMaster:
             This results in instant server startup times and some significantly less RAM usage overall 
         """
         cmdline_args = MISC.build_commandline_args(self.cowmaster_cmdline, self.global_config, cowmaster = True)
-        exe = subprocess.Popen(cmdline_args,close_fds=True,start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        exe, proc_hook, _ = await get_spawner().spawn(cmdline_args, close_fds=True, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
         self._pid = exe.pid
-        self._proc_hook = psutil.Process(pid=self._pid)
+        self._proc_hook = proc_hook
         self.enabled = True
 
     def stop_cow_master(self, disable=True):
@@ -78,6 +172,11 @@ class CowMaster:
         self.client_connection = None
         self._pid = None
         self._proc_hook = None
+        # nothing will answer the outstanding fork requests now
+        for future, _ in self.pending_forks.values():
+            if not future.done():
+                future.set_result(False)
+        self.pending_forks.clear()
 
     async def on_game_state_change(self, key, value):
         # do things
@@ -0,0 +1,191 @@
+"""
+Fleet state table.
+
+A fixed layout, memory mapped table of every game server's state, written by the manager as GameState changes. Any
+process on the host (the API process, the CLI, monitoring tools) can read it without asking the manager, without locks
+and without JSON. Records are read in place with struct.unpack_from.
+
+File layout (little endian), config/.fleet_state:
+    header, HEADER_SIZE bytes:  magic b"HONFLEET", version (u16), record size (u16), capacity (u32)
+    capacity records, RECORD_SIZE bytes each, the record for instance N at HEADER_SIZE + N * RECORD_SIZE:
+        sequence (u32)              odd while the record is being written
+        instance_id (u16)
+        port (u16)                  the instance's local game port. 0 when the slot is not in use
+        status (i8)                 GameStatus
+        game_phase (i8)             GamePhase
+        num_clients (u8)
+        match_started (u8)
+        match_id (u64)
+        uptime (u32)                milliseconds
+        cpu_util (f32)              percent of a core
+        now_skipped_frames (u32)    skipped frame milliseconds, this match
+        total_skipped_frames (u32)  skipped frame milliseconds, since the manager started
+        monitored_skipped_frames (u32)  skipped frame milliseconds, in the current monitoring interval
+        updated (f64)               unix time the record was written
+
+Each record has its own sequence lock: a reader takes the sequence, unpacks the record, and takes the sequence again.
+If the sequence was odd, or changed, a write overlapped the read, and it reads again.
+"""
+
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+from pathlib import Path
+
+MAGIC = b"HONFLEET"
+VERSION = 1
+HEADER = struct.Struct("<8sHHI")
+HEADER_SIZE = 64
+RECORD = struct.Struct("<IHHbbBBQIfIIId")
+RECORD_SIZE = 64
+SEQUENCE = struct.Struct("<I")
+PORT = struct.Struct("<H")
+PORT_OFFSET = 6
+CAPACITY = 1024             # instance ids 1 to CAPACITY - 1. The file is under 64KB
+READ_RETRIES = 100
+
+FleetRecord = namedtuple("FleetRecord", [
+    "instance_id", "port", "status", "game_phase", "num_clients", "match_started", "match_id", "uptime", "cpu_util",
+    "now_skipped_frames", "total_skipped_frames", "monitored_skipped_frames", "updated"
+])
+
+
+def get_fleet_state_path():
+    from cogs.misc.logger import get_home
+    return get_home() / "config" / ".fleet_state"
+
+
+def as_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class FleetStateTable:
+    """The manager's side. Only the manager writes to the table."""
+    def __init__(self, path, capacity=CAPACITY):
+        self.path = Path(path)
+        self.capacity = capacity
+        os.makedirs(self.path.parent, exist_ok=True)
+        # a new file on every launch, so records of instances that no longer exist don't linger. It replaces the old one,
+        # rather than truncating it, as a reader still mapping the old one would fault. Readers reopen the table after a restart
+        new_path = self.path.with_name(f"{self.path.name}.new")
+        with open(new_path, 'wb') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+        os.replace(new_path, self.path)
+        self.file = open(self.path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), HEADER_SIZE + capacity * RECORD_SIZE)
+        HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, RECORD_SIZE, capacity)
+        self.sequences = [0] * capacity
+
+    def in_range(self, instance_id):
+        return 0 < instance_id < self.capacity
+
+    def write(self, game_state):
+        """
+        Args:
+            game_state (GameState): the instance's game state. Instances outside the table (the cowmaster, id 0) are skipped.
+        """
+        instance_id = game_state.id
+        if not self.in_range(instance_id):
+            return
+        state = game_state._state
+        performance = game_state._performance
+        self.write_record(
+            instance_id,
+            as_int(game_state.local_config['params'].get('svr_port')),
+            max(-128, min(127, as_int(state.get('status'), -1))),
+            max(-128, min(127, as_int(state.get('game_phase'), -1))),
+            max(0, min(255, as_int(state.get('num_clients')))),
+            1 if state.get('match_started') else 0,
+            max(0, as_int(state.get('current_match_id'))),
+            max(0, min(0xFFFFFFFF, as_int(state.get('uptime')))),
+            float(state.get('cpu_core_util') or 0),
+            max(0, min(0xFFFFFFFF, as_int(performance.get('now_ingame_skipped_frames')))),
+            max(0, min(0xFFFFFFFF, as_int(performance.get('total_ingame_skipped_frames')))),
+            max(0, min(0xFFFFFFFF, as_int(performance.get('monitored_skipped_frames'))))
+        )
+
+    def write_record(self, instance_id, *fields):
+        offset = HEADER_SIZE + instance_id * RECORD_SIZE
+        sequence = self.sequences[instance_id] + 1
+        RECORD.pack_into(self.mmap, offset, sequence, instance_id, *fields, time.time())
+        self.sequences[instance_id] = sequence + 1
+        SEQUENCE.pack_into(self.mmap, offset, sequence + 1)
+
+    def clear(self, instance_id):
+        """Mark the instance's slot as not in use."""
+        if self.in_range(instance_id):
+            self.write_record(instance_id, 0, -1, -1, 0, 0, 0, 0, 0.0, 0, 0, 0)
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class FleetStateReader:
+    """Reads the table from any process. Needs nothing from the manager."""
+    def __init__(self, path=None):
+        self.path = Path(path) if path else get_fleet_state_path()
+        self.file = open(self.path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, capacity = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} fleet state table")
+        self.capacity = capacity
+
+    def read(self, instance_id):
+        """
+        Returns:
+            FleetRecord: the instance's state, or None if the slot is not in use.
+        """
+        offset = HEADER_SIZE + instance_id * RECORD_SIZE
+        for _ in range(READ_RETRIES):
+            before = SEQUENCE.unpack_from(self.mmap, offset)[0]
+            if before % 2:
+                continue
+            record = RECORD.unpack_from(self.mmap, offset)
+            if SEQUENCE.unpack_from(self.mmap, offset)[0] == before:
+                return FleetRecord(*record[1:]) if record[2] else None
+        return None
+
+    def read_all(self):
+        """
+        Returns:
+            list: FleetRecord for every instance in the table, by instance id.
+        """
+        records = []
+        for instance_id in range(1, self.capacity):
+            # empty slots (port 0) are skipped after reading just the port
+            if not PORT.unpack_from(self.mmap, HEADER_SIZE + instance_id * RECORD_SIZE + PORT_OFFSET)[0]:
+                continue
+            record = self.read(instance_id)
+            if record:
+                records.append(record)
+        return records
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+def describe(record):
+    """A record as a dict, with the status and game phase named."""
+    from cogs.handlers.events import GameStatus, GamePhase
+    described = record._asdict()
+    described['status_name'] = next((status.name for status in GameStatus if status.value == record.status), 'UNKNOWN')
+    described['game_phase_name'] = next((phase.name for phase in GamePhase if phase.value == record.game_phase), 'UNKNOWN')
+    return described
+
+
+FLEET_STATE_TABLE = None
+
+def get_fleet_state_table():
+    global FLEET_STATE_TABLE
+    if FLEET_STATE_TABLE is None:
+        FLEET_STATE_TABLE = FleetStateTable(get_fleet_state_path())
+    return FLEET_STATE_TABLE
@@ -12,9 +12,15 @@ from datetime import datetime, timedelta
 from os.path import exists
 from cogs.misc.logger import get_logger, get_home, get_misc, get_mqtt
 from cogs.handlers.events import stop_event, GameStatus, GameServerCommands, GamePhase
-from cogs.misc.exceptions import HoNCompatibilityError, HoNInvalidServerBinaries, HoNServerError
+from cogs.misc.exceptions import HoNCompatibilityError, HoNInvalidServerBinaries
 from cogs.misc.logparser import find_game_info_post_launch, find_match_id_post_launch
 from cogs.TCP.packet_parser import GameManagerParser
+from cogs.TCP.udp_proxy import get_udp_proxy
+from cogs.game.process_spawner import get_spawner
+from cogs.misc.cgroups import get_cgroup_manager
+from cogs.game.lag_monitor import get_lag_monitor
+from cogs.game.fleet_state import get_fleet_state_table
+from cogs.misc.metrics import INSTANCE_START_SECONDS, SKIPPED_FRAMES_MILLISECONDS, LONG_FRAMES
 from cogs.db.roles_db_connector import RolesDatabase
 import aiofiles
 import glob
@@ -24,6 +30,7 @@ import random
 LOGGER = get_logger()
 HOME_PATH = get_home()
 MISC = get_misc()
+CGROUP_STAT_MAX_AGE = 1     # seconds a cgroup cpu reading is reused for, as skipped frames arrive many a second during lag
 
 class GameServer:
     def __init__(self, id, port, global_config, remove_self_callback, manager_event_bus):
@@ -55,13 +62,19 @@ class GameServer:
         self.client_connection = None
         self.idle_disconnect_timer = 0
         self.game_in_progress = False
+        self.cgroup_cpu_at_match_start = None
+        self.cgroup_cpu_stat = None
+        self.cgroup_cpu_stat_time = 0
         # self.max_uptime = random.uniform(1 * 60, 5 * 60) * 1000  # For testing: between 1-5 minutes (in milliseconds)
         self.max_uptime = random.uniform(24 * 60 * 60, 48 * 60 * 60) * 1000  # Between 24-48 hours (in milliseconds)
         """
         Game State specific variables
         """
         self.status_received = asyncio.Event()
+        self.first_status_received = asyncio.Event()
         self.server_closed = asyncio.Event()
+        self.start_timings = {} # seconds since the start was queued, for each startup phase
+        self.start_timer = None
         self.game_state = GameState(self.id, self.config.local)
         self.reset_game_state()
         self.game_state.add_listener(self.on_game_state_change)
@@ -139,8 +152,20 @@ class GameServer:
     def reset_game_state(self):
         LOGGER.debug(f"GameServer #{self.id} - Reset state")
         self.status_received.clear()
+        self.first_status_received.clear()
         self.game_state.clear()
 
+    def begin_start_timings(self):
+        self.start_timer = time.perf_counter()
+        self.start_timings = {'queued_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+    def mark_start_phase(self, phase):
+        """Record how long after being queued, the server reached the given startup phase. Only the first occurrence is kept."""
+        if self.start_timer is None or phase in self.start_timings:
+            return
+        self.start_timings[phase] = round(time.perf_counter() - self.start_timer, 3)
+        INSTANCE_START_SECONDS.labels(phase).observe(self.start_timings[phase])
+
     def params_are_different(self):
         if not self._proc_hook: return
 
@@ -250,12 +275,15 @@ class GameServer:
                 if get_mqtt():
                     get_mqtt().publish_json("game_server/match", {"event_type":"match_started", **self.game_state._state})
                 self.game_in_progress = True
+                self.cgroup_cpu_at_match_start = self.get_cgroup_cpu_stat(max_age=0)
                 await self.set_server_priority_increase()
                 await self.start_match_timer()
                 await self.schedule_task(self.start_monitor_skipped_frames,'monitor_skipped_frames',coro_bracket=True)
             # Add more phases as needed
         elif key == "game_phase":
             LOGGER.debug(f"GameServer #{self.id} - Game phase {value}")
+            if self.use_cgroups():
+                get_cgroup_manager().set_game_phase(self.id, value)
             if get_mqtt():
                 get_mqtt().publish_json("game_server/match", {"event_type":"phase_change", **self.game_state._state})
             if value == GamePhase.IDLE.value and self.scheduled_shutdown:
@@ -276,8 +304,8 @@ class GameServer:
                 if performance:
                     await self.manager_event_bus.emit('cmd_message_server', self, f"Total server lag: {skipped_frames /1000} seconds. Lag rating: {performance}")
 
-                if skipped_frames > 5000 and value == GamePhase.GAME_ENDED.value:
-                    # send request to management.honfig requesting administrator be notified
+                if skipped_frames > 5000 and value == GamePhase.GAME_ENDED.value and get_lag_monitor().claim_match_alert(self.id, self.get_dict_value('current_match_id')):
+                    # send request to management.honfig requesting administrator be notified, unless the lag monitor already did for this match
                     await self.manager_event_bus.emit(
                         'notify_discord_admin',
                         type='lag',
@@ -292,6 +320,10 @@ class GameServer:
             # add more phases as needed
 
         elif key == "status":
+            if value in [GameStatus.SLEEPING.value, GameStatus.READY.value, GameStatus.OCCUPIED.value]:
+                # first 0x42 status packet since the server was started
+                self.mark_start_phase('first_status')
+                self.first_status_received.set()
             if value == GameStatus.OCCUPIED.value and self.game_state._state['current_match_id'] == 0:
                 match_id = await find_match_id_post_launch(self.id, self.global_config['hon_data']['hon_logs_directory'])
                 if match_id:
@@ -364,7 +396,9 @@ class GameServer:
 
     async def set_client_connection(self, client_connection):
         self.client_connection = client_connection
-        await self.get_running_server()
+        if not self._proc_hook or not self._proc_hook.is_running():
+            # we didn't launch this process ourselves (manager restarted, or forked by the cowmaster). Find it.
+            await self.get_running_server()
 
         # when servers connect they may be in a "Sleeping" state. Wake them up
         await self.client_connection.send_packet(GameServerCommands.WAKE_BYTES.value, send_len=True)
@@ -423,6 +457,7 @@ class GameServer:
 
     def reset_skipped_frames(self):
         self.game_state._performance['now_ingame_skipped_frames'] = 0
+        self.game_state.publish()
 
     async def start_monitor_skipped_frames(self, threshold=6000, interval_seconds=120):
         """
@@ -441,6 +476,9 @@ class GameServer:
                     duration = f"{self.game_state._performance['monitored_skipped_frames']} miliseconds"
 
                 LOGGER.warn(f"GameServer #{self.id} - Server lagged {duration} in the last {interval_seconds} seconds which is above threshold ({threshold}ms).")
+                cgroup_cpu = self.get_cgroup_cpu_usage()
+                if cgroup_cpu:
+                    LOGGER.warn(f"GameServer #{self.id} - cgroup cpu this match: {cgroup_cpu}")
                 try:
                     await self.manager_event_bus.emit('cmd_message_server', self, f"Server lag detected on {self.global_config['hon_data']['svr_name']}-{self.id}. This is being monitored and will be reported to the administrator if it continues.")
                 except Exception:
@@ -458,12 +496,57 @@ class GameServer:
             self.game_state._performance['now_ingame_skipped_frames'] += frames
             self.game_state._performance['monitored_skipped_frames'] += frames
             self.game_state._performance['skipped_frames_detailed'][time] = frames
+            SKIPPED_FRAMES_MILLISECONDS.labels(str(self.id)).inc(frames)
+            LONG_FRAMES.labels(str(self.id)).inc()
+            get_lag_monitor().record_skipped_frames(self.id, frames)
+            self.game_state.publish()
 
             # Remove entries older than one day
             one_day_ago = time - timedelta(days=1).total_seconds()
             self.game_state._performance['skipped_frames_detailed'] = {key: value for key, value in self.game_state._performance['skipped_frames_detailed'].items() if key >= one_day_ago}
             if get_mqtt():
-                get_mqtt().publish_json("game_server/lag",{"event_type": "skipped_frame", "skipped_frames": frames, **self.game_state._state})
+                get_mqtt().publish_json("game_server/lag",{"event_type": "skipped_frame", "skipped_frames": frames, "cgroup_cpu": self.get_cgroup_cpu_usage(), **self.game_state._state})
+
+    def use_cgroups(self):
+        return MISC.get_os_platform() == "linux" and self.global_config['hon_data'].get('man_use_cgroups')
+
+    def attach_cgroup(self):
+        if not self.use_cgroups() or not self._pid:
+            return
+        if get_cgroup_manager().attach(self.id, self._pid, self.global_config['hon_data'].get('man_cgroup_memory_high_mb')):
+            get_cgroup_manager().set_game_phase(self.id, self.get_dict_value('game_phase'))
+
+    def get_cgroup_cpu_stat(self, max_age=CGROUP_STAT_MAX_AGE):
+        """
+            Reading it is three sysfs reads on the event loop, so a reading up to max_age seconds old is reused.
+        """
+        if not self.use_cgroups():
+            return None
+        now = time.monotonic()
+        if self.cgroup_cpu_stat is None or now - self.cgroup_cpu_stat_time >= max_age:
+            self.cgroup_cpu_stat = get_cgroup_manager().get_cpu_stat(self.id)
+            self.cgroup_cpu_stat_time = now
+        return self.cgroup_cpu_stat
+
+    def get_cgroup_cpu_usage(self):
+        """
+            cpu.stat's throttling counters only move under a cpu.max limit, which isn't set (only cpu.weight is), so cpu
+            contention shows in cpu.pressure: the share of time the instance's tasks were waiting for a cpu.
+
+            Returns:
+                dict: cpu time used since the match started, and cpu pressure, or None when cgroups aren't in use.
+        """
+        current = self.get_cgroup_cpu_stat()
+        if not current:
+            return None
+        start = self.cgroup_cpu_at_match_start or {}
+        pressure = current.get('pressure', {})
+        return {
+            'cpu_weight': current.get('cpu_weight'),
+            'cpu_ms': (current.get('usage_usec', 0) - start.get('usage_usec', 0)) / 1000,
+            'cpu_pressure_avg10': pressure.get('avg10'),
+            'cpu_pressure_avg60': pressure.get('avg60')
+        }
 
 
     def get_pretty_status(self):
@@ -503,6 +586,12 @@ class GameServer:
                 'current game':f"{self.get_dict_value('now_ingame_skipped_frames')/1000} seconds"
             },
         }
+        cgroup_cpu = self.get_cgroup_cpu_usage()
+        if cgroup_cpu:
+            temp['Performance (lag)']['cpu time (current game)'] = f"{cgroup_cpu['cpu_ms']/1000} seconds"
+            if cgroup_cpu['cpu_pressure_avg10'] is not None:
+                temp['Performance (lag)']['cpu pressure (last 10s)'] = f"{cgroup_cpu['cpu_pressure_avg10']}%"
+            temp['Performance (lag)']['cpu weight'] = cgroup_cpu['cpu_weight']
         if self.get_dict_value('status') == GameStatus.SLEEPING.value: # 0
             temp['Status'] = 'Sleeping'
         elif self.get_dict_value('status') == GameStatus.READY.value: # 1
@@ -619,44 +708,34 @@ class GameServer:
         return b'\x28' + self.id.to_bytes(1, "little") + self.port.to_bytes(2, "little") + b'\x00'
 
     def set_server_affinity(self):
-        if not self.global_config['hon_data']['svr_override_affinity']:
-            return
-        affinity = []
-        for _ in MISC.get_server_affinity(self.id, self.global_config['hon_data']['svr_total_per_core']):
-            affinity.append(int(_))
-        self._proc_hook.cpu_affinity(affinity)  # Set CPU affinity
-
-
-    def get_fork_bytes(self):
         """
-            Return the bytearray required to fork this game server from the cowmaster
+            On windows, the affinity is only managed here when svr_override_affinity is set.
+            On linux, the topology aware placement is always applied. Servers forked from the cowmaster
+            inherit the cowmaster's affinity rather than their own host_affinity, so it must be set from here.
         """
-        return b'\x28' + self.id.to_bytes(1, "little") + self.port.to_bytes(2, "little") + b'\x00'
-
-    def set_server_affinity(self):
-        if not self.global_config['hon_data']['svr_override_affinity']:
+        if MISC.get_os_platform() == "win32" and not self.global_config['hon_data']['svr_override_affinity']:
+            return
+        if MISC.get_os_platform() == "linux" and not MISC.get_placement_planner():
             return
         affinity = []
         for _ in MISC.get_server_affinity(self.id, self.global_config['hon_data']['svr_total_per_core']):
             affinity.append(int(_))
-        self._proc_hook.cpu_affinity(affinity)  # Set CPU affinity
+        try:
+            self._proc_hook.cpu_affinity(affinity)  # Set CPU affinity
+        except (psutil.Error, ValueError, OSError) as e:
+            LOGGER.warn(f"GameServer #{self.id} - unable to set CPU affinity to {affinity}. {e}")
 
 
-    async def start_server(self, timeout=180):
+    async def start_server(self, timeout=180, udp_port_map=None):
         self.reset_game_state()
         self.server_closed.clear()
 
-        if await self.get_running_server():
+        if await self.get_running_server(udp_port_map=udp_port_map):
             self.unschedule_shutdown()
             self.enable_server()
             self.started = True
             return True
 
-        free_mem = psutil.virtual_memory().available
-        #   HoN server instances use up to 1GM RAM per instance. Check if this is free before starting.
-        if free_mem < 1000000000:
-            LOGGER.error((f"GameServer #{self.id} - cannot start as there is not enough free RAM"))
-            raise HoNServerError(f"GameServer #{self.id} - cannot start as there is not enough free RAM")
         LOGGER.info(f"GameServer #{self.id} - Starting...")
 
         coro = self.start_proxy
@@ -664,6 +743,7 @@ class GameServer:
 
         if self.global_config['hon_data'].get('man_use_cowmaster'):
             await self.manager_event_bus.emit('fork_server_from_cowmaster', self)
+            self.mark_start_phase('spawn')
 
         else:
             # params = ';'.join(' '.join((f"Set {key}",str(val))) for (key,val) in self.config.get_local_configuration()['params'].items())
@@ -674,18 +754,19 @@ class GameServer:
                 os.environ["APPDATA"] = str(self.global_config['hon_data']['hon_artefacts_directory'])
                 os.environ["USERPROFILE"] = str(self.global_config['hon_data']['hon_home_directory'])
                 DETACHED_PROCESS = 0x00000008
-                exe = subprocess.Popen(cmdline_args,close_fds=True, creationflags=DETACHED_PROCESS)
+                exe, proc_hook, proc_owner = await get_spawner().spawn(cmdline_args, close_fds=True, creationflags=DETACHED_PROCESS)
 
             else: # linux
-                exe = subprocess.Popen(cmdline_args,close_fds=True,start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                exe, proc_hook, proc_owner = await get_spawner().spawn(cmdline_args, close_fds=True, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
             self._pid = exe.pid
             self._proc = exe
-            self._proc_hook = psutil.Process(pid=exe.pid)
-            self._proc_owner =self._proc_hook.username()
+            self._proc_hook = proc_hook
+            self._proc_owner = proc_owner
 
-            if MISC.get_os_platform() == "win32":
-                self.set_server_affinity()
+            self.set_server_affinity()
+            self.attach_cgroup()
+            self.mark_start_phase('spawn')
 
         self.scheduled_shutdown = False
         self.game_state.update({'status':GameStatus.STARTING.value})
@@ -710,6 +791,7 @@ class GameServer:
                 return False
 
             if self.status_received.is_set():
+                self.mark_start_phase('tcp_register')
                 elapsed_time = time.perf_counter() - start_time
                 LOGGER.interest(f"GameServer #{self.id} with public ports {self.get_public_game_port()}/{self.get_public_voice_port()} started successfully in {elapsed_time:.2f} seconds.")
                 if get_mqtt():
@@ -830,48 +912,52 @@ class GameServer:
             self.cancel_tasks()
             await self.manager_event_bus.emit('remove_game_server',self)
 
-    async def get_running_server(self,timeout=15):
+    async def get_running_server(self, udp_port_map=None):
         """
-            Check if existing hon server is running.
+            Check if existing hon server is running, and attach to it if so.
+
+            Args:
+                udp_port_map (dict, optional): {port: pid} for every bound udp port, from MISC.get_port_pid_map().
+                    Pass this in when checking many servers at once, so the socket table is only read once.
+                    If not provided, the socket table is read in a worker thread.
         """
-        #running_procs = MISC.get_proc(self.config.local['config']['file_name'], slave_id = self.id)
-        running_procs = [MISC.get_process_by_port(self.port)]
-        if running_procs[0] == None:
-            running_procs = []
-        last_good_proc = None
-        i=0
-        while len(running_procs) > 0:
-            i+=1
-            last_good_proc = None
-            for proc in running_procs[:]:
-                status = self.get_dict_value('status')
-                if status:
-                    last_good_proc = proc
-                else:
-                    if not MISC.check_port(self.config.get_local_configuration()['params']['svr_proxyLocalVoicePort']) and not self.global_config['hon_data'].get('man_use_cowmaster'):
-                        proc.terminate()
-                        LOGGER.debug(f"Terminated GameServer #{self.id} as it has not started up correctly.")
-                        running_procs.remove(proc)
-                    else:
-                        last_good_proc = proc
-            if i >= timeout: break
-            if last_good_proc is not None:
-                break
+        if udp_port_map is None:
+            loop = asyncio.get_running_loop()
+            udp_port_map = await loop.run_in_executor(None, MISC.get_port_pid_map)
 
-        if last_good_proc:
-            #   update the process information with the healthy instance PID. Healthy playercount is either -3 (off) or >= 0 (alive)
-            self._pid = proc.pid
-            self._proc = proc
-            self._proc_hook = psutil.Process(pid=proc.pid)
-            self._proc_owner = proc.username()
-            LOGGER.debug(f"Found process ({self._pid}) for GameServer #{self.id}.")
-            try:
-                coro = self.start_proxy
-                self.schedule_task(coro,'proxy_task', coro_bracket=True)
-                return True
-            except Exception:
-                LOGGER.exception(f"GameServer #{self.id} {traceback.format_exc()}")
-        else:
+        pid = udp_port_map.get(self.port)
+        if pid is None or pid == os.getpid():
+            return False
+
+        try:
+            proc_hook, proc_owner = await get_spawner().inspect(pid)
+        except psutil.Error:
+            return False
+
+        if not self.get_dict_value('status'):
+            if self.config.get_local_configuration()['params']['svr_proxyLocalVoicePort'] not in udp_port_map and not self.global_config['hon_data'].get('man_use_cowmaster'):
+                try:
+                    proc_hook.terminate()
+                except psutil.NoSuchProcess:
+                    pass
+                LOGGER.debug(f"Terminated GameServer #{self.id} as it has not started up correctly.")
+                return False
+
+        #   update the process information with the healthy instance PID. Healthy playercount is either -3 (off) or >= 0 (alive)
+        self._pid = pid
+        self._proc = proc_hook
+        self._proc_hook = proc_hook
+        self._proc_owner = proc_owner
+        LOGGER.debug(f"Found process ({self._pid}) for GameServer #{self.id}.")
+        if MISC.get_os_platform() == "linux":
+            self.set_server_affinity()
+            self.attach_cgroup()
+        try:
+            coro = self.start_proxy
+            self.schedule_task(coro,'proxy_task', coro_bracket=True)
+            return True
+        except Exception:
+            LOGGER.exception(f"GameServer #{self.id} {traceback.format_exc()}")
             return False
 
     async def set_server_priority_reduce(self):
@@ -940,7 +1026,9 @@ region=naeu
             if MISC.get_os_platform() == "win32":
                 pass
             elif MISC.get_os_platform() == "linux":
-                raise HoNCompatibilityError("Using the proxy is currently not supported on Linux.")
+                # proxy.exe doesn't exist for linux, so the manager relays the traffic itself.
+                await self.start_builtin_proxy()
+                return
             else:
                 raise HoNCompatibilityError(f"Unknown OS: {MISC.get_os_platform()}. We cannot run the proxy.")
         except HoNCompatibilityError:
@@ -1019,7 +1107,29 @@ region=naeu
                     get_mqtt().publish_json("game_server/status",{"event_type":"proxy_crashed", **self.game_state._state})
                 self._proxy_process = None
 
+    async def start_builtin_proxy(self):
+        params = self.config.local['params']
+        mappings = [
+            ("game", params['svr_proxyPort'], params['svr_port']),
+            ("voice", params['svr_proxyRemoteVoicePort'], params['svr_proxyLocalVoicePort'])
+        ]
+        while not stop_event.is_set() and self.enabled and params['man_enableProxy']:
+            try:
+                if await get_udp_proxy().register(self.id, mappings):
+                    LOGGER.debug(f"GameServer #{self.id} Built-in proxy relaying {params['svr_proxyPort']}->{params['svr_port']} (game) and {params['svr_proxyRemoteVoicePort']}->{params['svr_proxyLocalVoicePort']} (voice)")
+                return
+            except OSError:
+                LOGGER.error(f"GameServer #{self.id} - Failed to bind the built-in proxy ports: {traceback.format_exc()}")
+                await asyncio.sleep(10)
+
+    def get_proxy_stats(self):
+        if MISC.get_os_platform() == "linux":
+            return get_udp_proxy().get_stats(self.id)
+        return {}
+
     def stop_proxy(self):
+        if MISC.get_os_platform() == "linux":
+            get_udp_proxy().unregister(self.id)
         if self._proxy_process:
             try:
                 self._proxy_process.terminate()
@@ -1115,6 +1225,7 @@ class GameState:
         self._listeners = []
         self.id = id
         self.local_config = local_config
+        self.version = 0    # counts publishes, so readers can tell the state changed without comparing it
 
     def __getitem__(self, key, dict_to_check="state"):
         target_dict = self._state if dict_to_check == "state" else self._performance
@@ -1158,6 +1269,9 @@ class GameState:
 
         if current_level is None:
             current_level = self._state if dict_to_check == "state" else self._performance
+            self.update(data, current_level, dict_to_check)
+            self.publish()
+            return
 
         target_dict = self._state if dict_to_check == "state" else self._performance
 
@@ -1176,6 +1290,11 @@ class GameState:
     def add_listener(self, callback):
         self._listeners.append(callback)
 
+    def publish(self):
+        """Write the state to the fleet state table, for readers outside the manager, and mark it changed for the API snapshot."""
+        self.version += 1
+        get_fleet_state_table().write(self)
+
     def _emit_event(self, key, value, old_value):
         for listener in self._listeners:
             asyncio.create_task(listener(key, value, old_value))
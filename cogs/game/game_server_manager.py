@@ -5,28 +5,36 @@ import asyncio
 import hashlib
 import os.path
 import subprocess
-import urllib
 from datetime import datetime, timedelta
 import inspect
-import tempfile
 import shutil
 import aiohttp
 from cogs.misc.exceptions import HoNAuthenticationError, HoNServerError
 from cogs.connectors.masterserver_connector import MasterServerHandler
 from cogs.connectors.chatserver_connector import ChatServerHandler
 from cogs.TCP.game_packet_lsnr import handle_clients
+from cogs.TCP.shard_pool import ShardPool, SHARDING_SUPPORTED
 from cogs.TCP.auto_ping_lsnr import AutoPingListener
 from cogs.connectors.api_server import start_api_server
+from cogs.connectors.api_process import ApiProcess
 from cogs.db.roles_db_connector import RolesDatabase
 from cogs.game.game_server import GameServer
 from cogs.game.cow_master import CowMaster
+from cogs.game.start_controller import AdaptiveStartController, FIRST_STATUS_TIMEOUT
+from cogs.misc.cgroups import get_cgroup_manager
+from cogs.misc.metrics import SKIPPED_FRAMES_MILLISECONDS, LONG_FRAMES
+from cogs.game.lag_monitor import get_lag_monitor
+from cogs.game.fleet_state import get_fleet_state_table
+from cogs.game.memory_admission import get_memory_admission
+from cogs.game.autoscaler import Autoscaler
+from cogs.game.rolling_restart import RollingRestart
+from cogs.game.patch_pipeline import BlueGreenInstalls, install_launcher, run_patcher, get_server_executable
 from cogs.handlers.commands import Commands
 from cogs.handlers.events import stop_event, ReplayStatus, GameStatus, GamePhase, GameServerCommands, EventBus as ManagerEventBus
 from cogs.misc.logger import get_logger, get_misc, get_home, get_mqtt, get_filebeat_status, get_filebeat_auth_url, get_roles_database, set_roles_database
 from pathlib import Path
 from cogs.game.healthcheck_manager import HealthCheckManager
 from enum import Enum
-from os.path import exists
 from utilities.filebeat import main as filebeat, filebeat_status, get_filebeat_auth_url
 import random
 
@@ -99,6 +107,8 @@ class GameServerManager:
         }
         self.schedule_task(self.cleanup_tasks_every_30_minutes(), 'task_cleanup')
         self.schedule_task(self.heartbeat(), 'heartbeat')
+        self.schedule_task(self.maintain_cowmaster_warm_pool(), 'cowmaster_warm_pool')
+        self.schedule_task(get_lag_monitor().run(), 'event_loop_lag')
         # initialise the config validator in case we need it
         self.setup = setup
 
@@ -116,12 +126,21 @@ class GameServerManager:
         self.preserved_path = os.environ["PATH"]
 
         # Initialize dictionaries to store game servers and client connections
-        self.server_start_semaphore = asyncio.Semaphore(self.global_config['hon_data']['svr_max_start_at_once'])  # 2 max servers starting at once
+        self.server_start_controller = AdaptiveStartController(self.global_config) # limits the number of servers starting at once
         self.game_servers = {}
         self.client_connections = {}
+        # with man_shards set, the connection shards reading the game server connections (see shard_pool.py)
+        self.shard_pool = None
 
         self.cowmaster = CowMaster(self.global_config['hon_data']['svr_starting_gamePort'] - 2, self.global_config)
 
+        self.schedule_task(get_memory_admission().run(self.game_servers), 'memory_admission')
+        self.autoscaler = Autoscaler(self.global_config, self.game_servers, self.event_bus)
+        self.schedule_task(self.autoscaler.run(), 'autoscaler')
+        self.rolling_restart = RollingRestart(self.global_config, self.game_servers, self.cmd_shutdown_server)
+        self.blue_green_installs = BlueGreenInstalls(self.global_config)
+        self.blue_green_installs.schedule_garbage_collection()
+
         # Initialize a Commands object for sending commands to game servers
         self.commands = Commands(self.game_servers, self.client_connections, self.global_config, self.event_bus, self.cowmaster)
         # Initialise the autoping listener object
@@ -400,24 +419,85 @@ class GameServerManager:
 
     async def fork_server_from_cowmaster(self, game_server):
         try:
-            await self.cowmaster.fork_new_server(game_server)
+            if not await self.cowmaster.fork_new_server(game_server):
+                # stop start_server waiting out the full startup timeout for a server that will never connect
+                game_server.server_closed.set()
         except Exception:
             LOGGER.error(traceback.format_exc())
 
     async def start_gameserver_from_cowmaster(self, num = "all"):
         try:
-            starting_port = self.global_config.get("hon_data").get("svr_starting_gamePort")
-            if num == "all":
-                number_of_instances = self.global_config.get("hon_data").get("svr_total")
-            else:
-                number_of_instances = num
+            not_connected = [game_server for game_server in self.game_servers.values() if game_server.port not in self.client_connections]
+            if num != "all":
+                not_connected = not_connected[:int(num)]
 
-            for i in range(number_of_instances):
-                print(i)
-                await self.cmd_cowmaster_fork(i+1, starting_port)
-                starting_port += 1
+            results = await self.cowmaster.fork_servers(not_connected)
+            forked = [game_server.id for game_server, success in results.items() if success]
+            LOGGER.info(f"CowMaster - forked {len(forked)}/{len(results)} servers. {self.cowmaster.get_fork_stats()}")
         except Exception as e:
             LOGGER.exception(e)
+
+    def get_cowmaster_warm_pool_size(self):
+        if not self.global_config['hon_data'].get('man_use_cowmaster'):
+            return 0
+        return self.global_config['hon_data'].get('man_cowmaster_warm_pool', 0)
+
+    def get_cowmaster_pool_members(self):
+        """
+        Returns:
+            tuple: (idle, unstarted) lists of game servers.
+                idle - forked servers waiting for a match, or on their way to being so.
+                unstarted - servers that haven't been forked, and are free to be.
+            Servers an admin disabled are in neither: forking them would enable them again.
+        """
+        idle_statuses = [GameStatus.READY.value, GameStatus.SLEEPING.value, GameStatus.STARTING.value, GameStatus.QUEUED.value]
+        idle = []
+        unstarted = []
+        for game_server in self.game_servers.values():
+            if not game_server.enabled:
+                continue
+            status = game_server.get_dict_value('status')
+            if status in idle_statuses and not game_server.scheduled_shutdown:
+                idle.append(game_server)
+            elif status == GameStatus.UNKNOWN.value and game_server.port not in self.client_connections and not game_server.delete_me:
+                unstarted.append(game_server)
+        return idle, unstarted
+
+    async def maintain_cowmaster_warm_pool(self):
+        """
+        When man_cowmaster_warm_pool is set, only that many idle forked servers are kept, rather than forking every configured server.
+        When servers are taken by matches, more are forked from the cowmaster to refill the pool. Surplus idle servers are shut down, returning their RAM.
+        """
+        while not stop_event.is_set():
+            for _ in range(5):
+                if stop_event.is_set():
+                    return
+                await asyncio.sleep(1)
+
+            pool_size = self.get_cowmaster_warm_pool_size()
+            if not pool_size or not self.cowmaster.client_connection or self.patching:
+                continue
+            if self.autoscaler.is_enabled():
+                # the autoscaler decides when to fork more servers, and puts surplus ones to sleep rather than shutting them down
+                continue
+            if get_memory_admission().is_under_pressure():
+                continue
+            try:
+                idle, unstarted = self.get_cowmaster_pool_members()
+                if len(idle) < pool_size and unstarted:
+                    to_fork = unstarted[:pool_size - len(idle)]
+                    LOGGER.info(f"CowMaster warm pool - {len(idle)}/{pool_size} idle servers. Forking {len(to_fork)} more.")
+                    await self.start_game_servers(to_fork, service_recovery=True, config_reload=False)
+                elif len(idle) > pool_size:
+                    ready = [game_server for game_server in idle if game_server.get_dict_value('status') in [GameStatus.READY.value, GameStatus.SLEEPING.value] and game_server.port in self.client_connections]
+                    surplus = sorted(ready, key=lambda game_server: game_server.id, reverse=True)[:len(idle) - pool_size]
+                    if surplus:
+                        LOGGER.info(f"CowMaster warm pool - {len(idle)}/{pool_size} idle servers. Shutting down {len(surplus)} surplus servers.")
+                    for game_server in surplus:
+                        # not disabled, so the pool can fork them again when it needs to
+                        await self.cmd_shutdown_server(game_server, disable=False)
+            except Exception:
+                LOGGER.error(traceback.format_exc())
     
     async def heartbeat(self):
         while not stop_event.is_set():
@@ -503,7 +583,11 @@ class GameServerManager:
     async def start_api_server(self):
         if get_mqtt():
             get_mqtt().publish_json("manager/admin", {"event_type":"api_started"})
-        await start_api_server(self.global_config, self.game_servers, self.tasks, self.health_check_manager.tasks, self.event_bus, self.find_replay_file, port=self.global_config['hon_data']['svr_api_port'])
+        if self.global_config['hon_data'].get('man_api_process'):
+            # the API runs in its own process, serving a snapshot of the manager's state, so API traffic doesn't load the game server loop
+            await ApiProcess(self).run()
+            return
+        await start_api_server(self.global_config, self.game_servers, self.tasks, self.health_check_manager.tasks, self.event_bus, self.find_replay_file, start_controller=self.server_start_controller, cowmaster=self.cowmaster, autoscaler=self.autoscaler, rolling_restart=self.rolling_restart, port=self.global_config['hon_data']['svr_api_port'])
 
     async def start_game_server_listener(self, host, game_server_to_mgr_port):
         """
@@ -517,6 +601,15 @@ class GameServerManager:
             None
         """
 
+        shards = self.global_config['hon_data'].get('man_shards', 0)
+        if shards and SHARDING_SUPPORTED:
+            # game server connections are read by worker processes, so packet handling isn't bound to this loop's core
+            self.shard_pool = ShardPool(self, shards)
+            self.schedule_task(self.shard_pool.run(), 'shard_pool')
+            LOGGER.info(f"Game server connections are read by {shards} connection shards.")
+        elif shards:
+            LOGGER.warn("man_shards is set, but connection shards are only supported on linux. Game server connections are read by the manager.")
+
         # Start the listener for incoming client connections
         self.game_server_lsnr = await asyncio.start_server(
             lambda *args, **kwargs: handle_clients(*args, **kwargs, game_server_manager=self),
@@ -829,15 +922,17 @@ class GameServerManager:
         coro = self.start_game_servers(start_servers)
         self.schedule_task(coro, 'gameserver_startup', override = True)
 
-    async def check_for_restart_required(self, game_server='all'):
+    async def check_for_restart_required(self, game_server='all', config_reload=False):
         if game_server == 'all':
-            for game_server in self.game_servers.values():
-                if game_server.params_are_different():
-                    await self.cmd_shutdown_server(game_server,disable=False)
-                    if self.cowmaster.client_connection:
-                        self.cowmaster.stop_cow_master(disable=False)
-                    await asyncio.sleep(0.1)
-                    game_server.enable_server()
+            # restart changed servers a few at a time, keeping man_rolling_restart_floor servers ready throughout
+            changed = [game_server for game_server in self.game_servers.values() if game_server.params_are_different()]
+            if not changed:
+                return
+            if self.cowmaster.client_connection:
+                self.cowmaster.stop_cow_master(disable=False)
+            for game_server in changed:
+                game_server.enable_server()
+            self.rolling_restart.start(changed, reason="configuration changed")
         else:
             if game_server.params_are_different():
                 await self.cmd_shutdown_server(game_server,disable=False)
@@ -897,6 +992,11 @@ class GameServerManager:
         for key, value in self.game_servers.items():
             if value == game_server and not game_server.started:
                 game_server.cancel_tasks()
+                get_cgroup_manager().release(game_server.id)
+                SKIPPED_FRAMES_MILLISECONDS.remove(str(game_server.id))
+                LONG_FRAMES.remove(str(game_server.id))
+                get_lag_monitor().forget_instance(game_server.id)
+                get_fleet_state_table().clear(game_server.id)
                 del self.game_servers[key]
                 return True
         return False
@@ -1071,8 +1171,26 @@ class GameServerManager:
         return False
 
     def update_server_start_semaphore(self):
-        max_start_at_once = self.global_config['hon_data']['svr_max_start_at_once']
-        self.server_start_semaphore = asyncio.Semaphore(max_start_at_once)
+        self.server_start_controller.update_limits()
+
+    async def discover_running_servers(self, game_servers):
+        """
+        Find game servers that are already running (e.g. after a manager restart) and attach to them.
+
+        The socket table is read once for all servers, rather than once per server, and all servers are attached concurrently.
+
+        Returns:
+            dict: the {port: pid} map that was used, so that it can be reused by start_server.
+        """
+        loop = asyncio.get_running_loop()
+        udp_port_map = await loop.run_in_executor(None, MISC.get_port_pid_map)
+        results = await asyncio.gather(*[game_server.get_running_server(udp_port_map=udp_port_map) for game_server in game_servers], return_exceptions=True)
+        for game_server, already_running in zip(game_servers, results):
+            if isinstance(already_running, Exception):
+                LOGGER.error(f"GameServer #{game_server.id} - Failed to check for an existing process: {already_running}")
+            elif already_running:
+                LOGGER.info(f"GameServer #{game_server.id} with public ports {game_server.get_public_game_port()}/{game_server.get_public_voice_port()} already running.")
+        return udp_port_map
 
     async def start_game_servers_task(self, game_servers):
         coro = self.start_game_servers(game_servers)
@@ -1087,7 +1205,8 @@ class GameServerManager:
             This function starts all the game servers that were created by the GameServerManager. It
             does this by calling the start_server method of each game server object.
 
-            Game servers are started using a "semaphore", to stagger their start to groups and not all at once.
+            Game servers are started through the AdaptiveStartController, to stagger their start to groups and not all at once.
+            The size of the group grows while servers start quickly, and shrinks when starts are slow, fail, or the host is under pressure.
             The timeout value may be reached, for slow servers, it may need to be adjusted in the config file if required.
 
             This function does not return anything, but can log errors or other information.
@@ -1104,15 +1223,28 @@ class GameServerManager:
                 if not await self.initialise_patching_procedure(source="startup"):
                     return False
 
-            async def start_game_server_with_semaphore(game_server, timeout):
+            async def start_game_server_with_semaphore(game_server, timeout, udp_port_map=None):
                 game_server.game_state.update({'status':GameStatus.QUEUED.value})
-                async with self.server_start_semaphore:
+                game_server.begin_start_timings()
+                if not game_server._proc_hook:
+                    # wait for RAM before taking a start slot, so a start queued for memory doesn't hold back other starts,
+                    # count against svr_startup_timeout, or be taken by the start controller for a slow start
+                    try:
+                        await get_memory_admission().admit(game_server)
+                    except HoNServerError:
+                        await self.cmd_shutdown_server(game_server)
+                        return
+                    game_server.mark_start_phase('admitted')
+                async with self.server_start_controller:
                     # Use the schedule_task method to start the server
                     if game_server not in self.game_servers.values():
+                        get_memory_admission().release(game_server)
                         return
+                    game_server.mark_start_phase('slot_acquired')
+                    started = False
 
                     # Ensure the task is actually a Task or Future
-                    task = asyncio.ensure_future(game_server.schedule_task(game_server.start_server(timeout=timeout), 'start_server'))
+                    task = asyncio.ensure_future(game_server.schedule_task(game_server.start_server(timeout=timeout, udp_port_map=udp_port_map), 'start_server'))
                     try:
                         # Ensure asyncio.wait_for(task, timeout) and stop_event.wait() are Tasks
                         wait_for_task = asyncio.create_task(asyncio.wait_for(task, timeout))
@@ -1130,24 +1262,43 @@ class GameServerManager:
                             LOGGER.info(f"Shutting down uninitialised GameServer #{game_server.id} due to stop event.")
                             await self.cmd_shutdown_server(game_server)
                         else:
-                            # The game server start task completed successfully
-                            # LOGGER.info(f"GameServer #{game_server.id} started successfully.")
-                            pass
+                            started = wait_for_task.result()
+                            if started:
+                                # hold the slot until the first status update, that's when the server has finished loading
+                                try:
+                                    await asyncio.wait_for(game_server.first_status_received.wait(), FIRST_STATUS_TIMEOUT)
+                                except asyncio.TimeoutError:
+                                    LOGGER.debug(f"GameServer #{game_server.id} registered, but sent no status update within {FIRST_STATUS_TIMEOUT} seconds.")
                     except asyncio.TimeoutError:
                         LOGGER.error(f"GameServer #{game_server.id} failed to start within the timeout period.")
                         await self.cmd_shutdown_server(game_server)
                     except HoNServerError:
                         # LOGGER.error(f"GameServer #{game_server.id} encountered a server error.")
                         await self.cmd_shutdown_server(game_server)
+                    except Exception:
+                        LOGGER.error(f"GameServer #{game_server.id} failed to start. {traceback.format_exc()}")
+                    finally:
+                        if not started:
+                            get_memory_admission().release(game_server)
+                        game_server.mark_start_phase('total')
+                        self.server_start_controller.record(game_server, started)
 
             start_tasks = []
-            if game_servers == "all":
+            start_all = game_servers == "all"
+            if start_all:
                 game_servers = list(self.game_servers.values())
 
-            for game_server in game_servers:
-                already_running = await game_server.get_running_server()
-                if already_running:
-                    LOGGER.info(f"GameServer #{game_server.id} with public ports {game_server.get_public_game_port()}/{game_server.get_public_voice_port()} already running.")
+            udp_port_map = await self.discover_running_servers(game_servers)
+
+            pool_size = self.get_cowmaster_warm_pool_size()
+            if start_all and pool_size and not self.autoscaler.is_enabled():
+                # only fork enough servers to fill the warm pool. maintain_cowmaster_warm_pool forks the rest as they're needed.
+                # Servers asked for by name (the autoscaler, the API, crash recovery) are all started.
+                idle, unstarted = self.get_cowmaster_pool_members()
+                attached = [game_server for game_server in game_servers if game_server._proc_hook]
+                not_attached = [game_server for game_server in game_servers if not game_server._proc_hook]
+                already_idle = set(idle) | set(attached)
+                game_servers = attached + not_attached[:max(0, pool_size - len(already_idle))]
 
             if self.global_config['hon_data'].get('man_use_cowmaster') and not self.cowmaster.client_connection:
                 await self.cowmaster.start_cow_master()
@@ -1184,7 +1335,7 @@ class GameServerManager:
                         return
 
             for game_server in game_servers:
-                start_tasks.append(start_game_server_with_semaphore(game_server, timeout))
+                start_tasks.append(start_game_server_with_semaphore(game_server, timeout, udp_port_map))
 
             await asyncio.gather(*start_tasks)
 
@@ -1199,8 +1350,9 @@ class GameServerManager:
 
     async def patch_extract_crc_from_file(self, url):
         try:
-            with urllib.request.urlopen(url) as response:
-                content = response.read().decode('utf-8')
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+                async with session.get(url) as response:
+                    content = (await response.read()).decode('utf-8')
             # sample: 4.10.8.0;4.10.8.honpatch;B30B80D1;hon_update_x64.zip;4DFDFDD5
             components = content.strip().split(';')
             version = components[0]
@@ -1214,91 +1366,57 @@ class GameServerManager:
             LOGGER.error(f"URL: {url} - Error occurred while extracting CRC from file: {e}")
             return None
 
+    def get_patch_launcher_details(self):
+        if MISC.get_os_platform() == "win32":
+            return 'hon_update_x64.exe', 'hon_update_x64.zip', self.HON_WAS_VERSION_URL, self.HON_WAS_LAUNCHER_DOWNLOAD_URL
+        return 'launcher', 'launcher.zip', self.HON_LAS_VERSION_URL, self.HON_LAS_LAUNCHER_DOWNLOAD_URL
+
     async def initialise_patching_procedure(self, timeout=3600, source='startup'):
         if self.patching:
             LOGGER.warn("Patching is already in progress.")
             return
 
-        for game_server in self.game_servers.values():
-            LOGGER.debug(f"GameServer #{game_server.id} - Initialising server shutdown for patching")
+        if source == "healthcheck" and self.global_config['hon_data'].get('man_blue_green_patching'):
+            return await self.blue_green_patch(timeout=timeout)
+
+        # keep some servers available for new matches until the last match ends, rather than shutting every idle server down now
+        to_stop, in_match, all_clear = self.rolling_restart.get_patch_drain_plan()
+        for game_server in in_match:
             if game_server.started and game_server.enabled:
+                LOGGER.debug(f"GameServer #{game_server.id} - Initialising server shutdown for patching")
                 await self.cmd_message_server(game_server, "!! ANNOUNCEMENT !! This server will shutdown after the current match for patching.")
-            await self.cmd_shutdown_server(game_server)
+                await self.cmd_shutdown_server(game_server)
+        for game_server in to_stop:
+            if game_server.enabled or game_server.started:
+                LOGGER.debug(f"GameServer #{game_server.id} - Initialising server shutdown for patching")
+                await self.cmd_shutdown_server(game_server)
+        if not all_clear:
+            LOGGER.info(f"Patching - waiting for {len(in_match)} matches to end. {len(self.game_servers) - len(to_stop) - len(in_match)} servers are kept available until then.")
+            return
 
         if MISC.get_proc(self.global_config['hon_data']['hon_executable_name']):
             LOGGER.debug("Some HoN servers are still running. Waiting until they've shut down.")
             return
-        
-        if MISC.get_os_platform() == "win32":
-            launcher_binary = 'hon_update_x64.exe'
-            launcher_zip = 'hon_update_x64.zip'
-            hon_version_url = self.HON_WAS_VERSION_URL
-            launcher_download_url = self.HON_WAS_LAUNCHER_DOWNLOAD_URL
-        else:
-            launcher_binary = 'launcher'
-            launcher_zip = 'launcher.zip'
-            hon_version_url = self.HON_LAS_VERSION_URL
-            launcher_download_url = self.HON_LAS_LAUNCHER_DOWNLOAD_URL
+
+        launcher_binary, launcher_zip, hon_version_url, launcher_download_url = self.get_patch_launcher_details()
 
         launcher_crc = await self.patch_extract_crc_from_file(hon_version_url)
         if not launcher_crc:
             LOGGER.error("Patching failed.")
             return False
-        if (not exists(self.global_config['hon_data']['hon_install_directory'] / launcher_binary)) or (launcher_crc and launcher_crc.lower() != MISC.calculate_crc32(self.global_config['hon_data']['hon_install_directory'] / launcher_binary).lower()):
-            LOGGER.debug(f"Beginning to download new launcher from {launcher_download_url}")
-            try:
-                temp_folder = tempfile.TemporaryDirectory()
-                temp_path = temp_folder.name
-                temp_zip_path = Path(temp_path) / launcher_zip
-
-                download_launcher = urllib.request.urlretrieve(launcher_download_url, temp_zip_path)
-                if not download_launcher:
-                    LOGGER.warn(f"Newer {launcher_zip} is available, however the download failed.\n\t1. Please download the file manually: {launcher_download_url}\n\t2. Unzip the file into {self.global_config['hon_data']['hon_install_directory']}")
-                    return
-
-                temp_extracted_path = temp_folder.name
-                extracted_file_name = MISC.unzip_file(source_zip=temp_zip_path, dest_unzip=temp_extracted_path)
-
-                temp_extracted_launcher_path = Path(temp_path) / extracted_file_name[0]
-
-                launcher_binary_path = self.global_config['hon_data']['hon_install_directory'] / launcher_binary
-
-                LOGGER.debug(f"Downloaded launcher files: {os.listdir(temp_extracted_path)}")
-
-                # Check if the file is in use before moving it
-                try:
-                    shutil.move(temp_extracted_launcher_path, launcher_binary_path)
-                    LOGGER.debug(f"Moved extracted launcher to HoN working directory: {launcher_binary_path}")
-                except PermissionError:
-                    LOGGER.warn(f"Hon Update - the file {self.global_config['hon_data']['hon_install_directory'] / launcher_zip} is currently in use. Closing the file..")
-                    process = MISC.get_proc(proc_name=launcher_zip)
-                    if process: process.terminate()
-                    try:
-                        shutil.move(temp_extracted_launcher_path, launcher_binary_path)
-                    except Exception:
-                        LOGGER.error(f"HoN Update - Failed to copy downloaded {launcher_binary} into {self.global_config['hon_data']['hon_install_directory']}\n\t1. Please download the file manually: {launcher_download_url}\n\t2. Unzip the file into {self.global_config['hon_data']['hon_install_directory']}")
-                        return
-
-            except Exception as e:
-                LOGGER.error(f"Error occurred during file download or extraction: {e}")
+        if not await install_launcher(self.global_config['hon_data']['hon_install_directory'], launcher_binary, launcher_zip, launcher_crc, launcher_download_url):
+            return
 
-        patcher_executable = self.global_config['hon_data']['hon_install_directory'] / launcher_binary
+        self.patching = True
         try:
-            if MISC.get_os_platform() == "win32":
-                subprocess.run([patcher_executable, "-norun"], timeout=timeout)
-            else:
-                os.chmod(patcher_executable, 0o700)
-                subprocess.run([patcher_executable], timeout=timeout)
+            await run_patcher(self.global_config['hon_data']['hon_install_directory'], launcher_binary, timeout)
 
-            if MISC.get_os_platform() == "linux":
-                executable = "hon-x86_64-server_KONGOR"
-                if not os.path.exists(self.global_config['hon_data']['hon_install_directory'] / executable):
-                    executable = "hon-x86_64-server"
-                self.global_config['hon_data']['hon_executable_path'] = self.global_config['hon_data']['hon_install_directory'] / executable
-                self.global_config['hon_data']['hon_executable_name'] = executable
+            executable_path, executable = get_server_executable(self.global_config['hon_data']['hon_install_directory'], self.global_config['hon_data']['hon_executable_name'])
+            self.global_config['hon_data']['hon_executable_path'] = executable_path
+            self.global_config['hon_data']['hon_executable_name'] = executable
 
             svr_version = MISC.get_svr_version(self.global_config['hon_data']['hon_executable_path'])
-            if MISC.get_svr_version(self.global_config['hon_data']['hon_executable_path']) != self.latest_available_game_version:
+            if svr_version != self.latest_available_game_version:
                 LOGGER.error(f"Server patching failed. Current version: {svr_version}")
                 return False
 
@@ -1319,6 +1437,40 @@ class GameServerManager:
             # patching is done. Whether it failed or otherwise.
             self.patching = False
 
+    async def blue_green_patch(self, timeout=3600):
+        """
+        Patch a copy of the install directory while the servers keep running, then roll the servers over to it.
+        Servers restart onto the new tree through the rolling restart, so in-match servers finish on the old tree.
+        """
+        launcher_binary, launcher_zip, hon_version_url, launcher_download_url = self.get_patch_launcher_details()
+        launcher_crc = await self.patch_extract_crc_from_file(hon_version_url)
+        if not launcher_crc:
+            LOGGER.error("Patching failed.")
+            return False
+
+        self.patching = True
+        try:
+            tree = await self.blue_green_installs.prepare(self.latest_available_game_version, launcher_binary, launcher_zip, launcher_crc, launcher_download_url, timeout=timeout)
+            if not tree:
+                LOGGER.error("Patching failed. Servers remain on the current version.")
+                return False
+            self.blue_green_installs.activate(tree)
+            await self.setup.validate_hon_data(self.global_config['hon_data'])
+            LOGGER.info("Patching successful!")
+        except subprocess.TimeoutExpired:
+            LOGGER.warn(f"Patching failed as it exceeded {timeout} seconds to patch resources.")
+            return False
+        except Exception:
+            LOGGER.error(f"An unexpected error occured while patching: {traceback.format_exc()}")
+            return False
+        finally:
+            self.patching = False
+
+        # the cowmaster and every server now have different launch params, so they're rolled onto the new tree
+        await self.check_for_restart_required()
+        self.blue_green_installs.schedule_garbage_collection()
+        return True
+
     async def disable_game_server(self, game_server):
         game_server.disable_server()
 
@@ -1,7 +1,8 @@
 
 from cogs.handlers.events import stop_event, get_logger
-from cogs.misc.logger import get_logger, get_misc, get_roles_database
+from cogs.misc.logger import get_logger, get_misc, get_roles_database, get_mqtt
 from cogs.handlers.events import GameStatus
+from cogs.game.lag_monitor import get_lag_monitor
 from utilities.filebeat import main as filebeat_setup
 import asyncio
 import traceback
@@ -40,7 +41,8 @@ class HealthCheckManager:
             'filebeat_verification': None,
             'spawned_filebeat_setup': None,
             'general_healthcheck': None,
-            'disk_utilisation_healthcheck': None
+            'disk_utilisation_healthcheck': None,
+            'lag_healthcheck': None
         }
 
         get_roles_database().add_default_alerts_data()
@@ -187,20 +189,34 @@ class HealthCheckManager:
 
     async def lag_healthcheck(self):
         """
-        Continuously checks for lag in each game server. This method can be expanded to implement specific lag detection logic.
+        Reports lag in the manager's event loop and in each game server, and alerts the administrator when it is severe.
 
-        Runs in a loop that can be interrupted by the 'stop_event'. It waits for a predefined interval before 
-        performing the next check.
+        The measurements are taken continuously by the lag monitor (see cogs/game/lag_monitor.py). Every interval, the
+        event loop lag percentiles, recent spikes and the per instance skipped frame rates are published over MQTT, and
+        alerts are sent through notify_discord_admin.
         """
+        lag_monitor = get_lag_monitor()
         while not stop_event.is_set():
             for _ in range(self.global_config['application_data']['timers']['manager']['lag_healthcheck']):
                 if stop_event.is_set():
                     return
                 await asyncio.sleep(1)
-            for game_server in self.game_servers.values():
-                # Perform the lag health check for each game server
-                # Example: self.perform_health_check(game_server, HealthChecks.lag_healthcheck)
-                pass
+            game_servers = list(self.game_servers.values())
+            if get_mqtt():
+                get_mqtt().publish_json("manager/lag", {"event_type": "lag_healthcheck", **lag_monitor.get_status(game_servers, include_stacks=False)})
+
+            for alert in lag_monitor.get_alerts(game_servers):
+                if alert['type'] == 'manager_lag':
+                    # reported on this host only. The management API's lag alerts are for game server instances
+                    LOGGER.warn(f"The manager's event loop was held up for {alert['time_lagged']} seconds, in {alert['blocked_in'] or 'an unknown coroutine'}.")
+                    if get_mqtt():
+                        get_mqtt().publish_json("manager/admin", {"event_type": "manager_lag_alert", **alert})
+                    continue
+                LOGGER.warn(f"GameServer #{alert['instance']} - skipped {alert['time_lagged']} seconds of frames in the last few minutes. Notifying the administrator.")
+                try:
+                    await self.notify_discord_admin(**alert)
+                except Exception:
+                    LOGGER.error(f"Failed to notify the administrator of lag. {traceback.format_exc()}")
 
     async def patch_version_healthcheck(self):
         """
@@ -324,6 +340,7 @@ class HealthCheckManager:
         self.tasks['general_healthcheck'] = self.schedule_task(self.general_healthcheck(), 'general_healthcheck')
         self.tasks['disk_utilisation_healthcheck'] = self.schedule_task(self.disk_utilisation_healthcheck(), 'disk_utilisation_healthcheck')
         self.tasks['autoping_listener_healthcheck'] = self.schedule_task(self.autoping_listener_healthcheck(), 'autoping_listener_healthcheck')
+        self.tasks['lag_healthcheck'] = self.schedule_task(self.lag_healthcheck(), 'lag_healthcheck')
 
         while not stop_event.is_set():
             for task_name, task in self.tasks.items():
@@ -350,6 +367,8 @@ class HealthCheckManager:
                         self.tasks[task_name] = self.schedule_task(self.disk_utilisation_healthcheck(), task_name)
                     elif task_name == 'autoping_listener_healthcheck':
                         self.tasks[task_name] = self.schedule_task(self.autoping_listener_healthcheck(), task_name)
+                    elif task_name == 'lag_healthcheck':
+                        self.tasks[task_name] = self.schedule_task(self.lag_healthcheck(), task_name)
 
             # Sleep for a bit before checking tasks again
             for _ in range(10):
@@ -0,0 +1,245 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from cogs.misc.logger import get_logger
+from cogs.handlers.events import stop_event
+from cogs.misc.metrics import EVENT_LOOP_LAG_SECONDS
+
+LOGGER = get_logger()
+
+PROBE_INTERVAL = 0.1                    # seconds between event loop probes
+PROBE_HISTORY_SECONDS = 300             # probe results kept for the lag percentiles
+SPIKE_THRESHOLD = 0.25                  # seconds the event loop may be held up before it counts as a spike, and its stack is sampled
+MAX_STACK_SAMPLES_PER_SPIKE = 5         # stack samples taken while a single spike lasts
+SPIKE_HISTORY = 20                      # spikes kept, with their stack samples
+SKIPPED_FRAME_WINDOWS = (60, 300, 900)  # seconds. Sliding windows the skipped frame rates are reported over
+INSTANCE_ALERT_WINDOW = 300             # the window instance lag alerts are raised from
+INSTANCE_ALERT_MILLISECONDS = 15000     # skipped frame time in INSTANCE_ALERT_WINDOW that alerts the administrator (5% of the window)
+MANAGER_ALERT_SECONDS = 2               # an event loop spike this long alerts the administrator
+MANAGER_ALERT_COOLDOWN = 3600           # seconds between manager lag alerts
+
+
+class LagMonitor:
+    """
+    Watches for lag in the manager itself and in the game servers.
+
+    The manager:
+        A probe task sleeps for PROBE_INTERVAL and measures how late it wakes up (perf_counter), which is how long anything
+        ready to run on the event loop waits. A watchdog thread checks the probe's heartbeat. When the heartbeat is older
+        than SPIKE_THRESHOLD the event loop is stuck in something, so the watchdog samples the event loop thread's stack
+        (sys._current_frames) while it is still stuck, showing which coroutine is blocking it.
+
+    The game servers:
+        Skipped frames (0x43 long frame packets) are kept per instance, and reported as rates over sliding windows.
+    """
+    def __init__(self):
+        self.probes = deque(maxlen=int(PROBE_HISTORY_SECONDS / PROBE_INTERVAL))    # (monotonic time, lag seconds)
+        self.spikes = deque(maxlen=SPIKE_HISTORY)
+        self.spike_count = 0
+        self.alerted_spike_count = 0        # spikes already considered for manager lag alerts
+        self.skipped_frames = {}            # instance id -> deque of (monotonic time, skipped milliseconds)
+        self.heartbeat = None               # perf_counter of the last probe wake up
+        self.loop = None
+        self.loop_thread_id = None
+        self.stack_samples = []             # taken by the watchdog during the current spike
+        self.lock = threading.Lock()
+        self.watchdog = None
+        self.alerted_matches = {}           # instance id -> match id the instance was last alerted for
+        self.last_manager_alert = None
+
+    async def run(self):
+        """The event loop probe. Also starts the watchdog thread."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.perf_counter()
+        if self.watchdog is None or not self.watchdog.is_alive():
+            self.watchdog = threading.Thread(target=self.watch, name="lag-watchdog", daemon=True)
+            self.watchdog.start()
+        try:
+            while not stop_event.is_set():
+                before = time.perf_counter()
+                await asyncio.sleep(PROBE_INTERVAL)
+                now = time.perf_counter()
+                lag = max(0.0, now - before - PROBE_INTERVAL)
+                with self.lock:
+                    self.heartbeat = now
+                    samples, self.stack_samples = self.stack_samples, []
+                self.probes.append((time.monotonic(), lag))
+                EVENT_LOOP_LAG_SECONDS.observe(lag)
+                if lag >= SPIKE_THRESHOLD:
+                    self.record_spike(lag, samples)
+        finally:
+            self.heartbeat = None
+
+    def watch(self):
+        """The watchdog thread. Samples the event loop thread's stack while the event loop is held up."""
+        while not stop_event.is_set():
+            time.sleep(PROBE_INTERVAL)
+            with self.lock:
+                if self.heartbeat is None:
+                    return
+                stalled_for = time.perf_counter() - self.heartbeat - PROBE_INTERVAL
+                if stalled_for < SPIKE_THRESHOLD or len(self.stack_samples) >= MAX_STACK_SAMPLES_PER_SPIKE:
+                    continue
+            sample = self.sample_loop_stack(stalled_for)
+            if sample:
+                with self.lock:
+                    self.stack_samples.append(sample)
+
+    def sample_loop_stack(self, stalled_for):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return None
+        try:
+            task = asyncio.current_task(self.loop)
+        except Exception:
+            task = None
+        return {
+            'stalled_for': round(stalled_for, 3),
+            'task': task.get_name() if task else None,
+            'coroutine': task.get_coro().__qualname__ if task else None,
+            'stack': ''.join(traceback.format_stack(frame))
+        }
+
+    def record_spike(self, lag, samples):
+        # identical samples (the same blocking call, sampled more than once) are only kept once
+        stacks = {}
+        for sample in samples:
+            key = (sample['task'], sample['stack'])
+            if key in stacks:
+                stacks[key]['samples'] += 1
+            else:
+                stacks[key] = {**sample, 'samples': 1}
+        spike = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'lag': round(lag, 3),
+            'stacks': list(stacks.values())
+        }
+        self.spikes.append(spike)
+        self.spike_count += 1
+        blocked_in = next((f" in task '{stack['task']}' ({stack['coroutine']})" for stack in spike['stacks'] if stack['task']), "")
+        LOGGER.warn(f"Event loop was held up for {lag:.3f} seconds{blocked_in}.")
+        if spike['stacks']:
+            LOGGER.debug(f"Event loop stack while held up:\n{spike['stacks'][0]['stack']}")
+
+    def record_skipped_frames(self, instance, milliseconds):
+        history = self.skipped_frames.get(instance)
+        if history is None:
+            history = self.skipped_frames[instance] = deque()
+        now = time.monotonic()
+        history.append((now, milliseconds))
+        self.prune(history, now)
+
+    @staticmethod
+    def prune(history, now):
+        while history and now - history[0][0] > SKIPPED_FRAME_WINDOWS[-1]:
+            history.popleft()
+
+    def forget_instance(self, instance):
+        self.skipped_frames.pop(instance, None)
+        self.alerted_matches.pop(instance, None)
+
+    def claim_match_alert(self, instance, match_id):
+        """
+        Lag alerts for an instance are sent at most once per match, whether mid match (get_alerts) or as it ends (GameServer).
+
+        Returns:
+            bool: True if no lag alert was sent for this match yet. The match is then marked as alerted.
+        """
+        if self.alerted_matches.get(instance) == match_id:
+            return False
+        self.alerted_matches[instance] = match_id
+        return True
+
+    def get_skipped_frame_rates(self, instance):
+        """
+        Returns:
+            dict: per window, the skipped frame time (ms), the number of long frames, and the share of the window spent skipping frames (%).
+        """
+        history = self.skipped_frames.get(instance, ())
+        now = time.monotonic()
+        if history:
+            self.prune(history, now)
+        rates = {}
+        for window in SKIPPED_FRAME_WINDOWS:
+            in_window = [milliseconds for recorded, milliseconds in history if now - recorded <= window]
+            rates[f"{window}s"] = {
+                'skipped_milliseconds': sum(in_window),
+                'long_frames': len(in_window),
+                'percent_skipped': round(sum(in_window) / (window * 10), 2)
+            }
+        return rates
+
+    def get_loop_lag(self):
+        lags = sorted(lag for _, lag in self.probes)
+        if not lags:
+            return {'probes': 0}
+        return {
+            'probes': len(lags),
+            'p50': round(lags[len(lags) // 2], 4),
+            'p99': round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 4),
+            'max': round(lags[-1], 4),
+            'spikes': sum(1 for lag in lags if lag >= SPIKE_THRESHOLD)
+        }
+
+    def get_status(self, game_servers, include_stacks=True):
+        """
+        Args:
+            game_servers (iterable): GameServer objects to report the skipped frame rates of.
+            include_stacks (bool): include the stack samples of recent spikes. They are large, so are left out of MQTT reports.
+        """
+        spikes = list(self.spikes)
+        if not include_stacks:
+            spikes = [{**spike, 'stacks': [{key: value for key, value in stack.items() if key != 'stack'} for stack in spike['stacks']]} for spike in spikes]
+        return {
+            'event_loop': {
+                'probe_interval': PROBE_INTERVAL,
+                'spike_threshold': SPIKE_THRESHOLD,
+                f"last_{PROBE_HISTORY_SECONDS}s": self.get_loop_lag(),
+                'recent_spikes': spikes
+            },
+            'game_servers': {
+                game_server.id: {
+                    'match_id': game_server.get_dict_value('current_match_id'),
+                    'skipped_frames': self.get_skipped_frame_rates(game_server.id)
+                } for game_server in game_servers
+            }
+        }
+
+    def get_alerts(self, game_servers):
+        """
+        Returns:
+            list: notify_discord_admin keyword arguments, for each alert that should be raised now.
+                Each instance is alerted at most once per match, and the manager at most once per MANAGER_ALERT_COOLDOWN.
+                Manager lag alerts ('manager_lag') are for the host only: the management API only knows of instance alerts.
+        """
+        alerts = []
+        for game_server in game_servers:
+            skipped = self.get_skipped_frame_rates(game_server.id)[f"{INSTANCE_ALERT_WINDOW}s"]['skipped_milliseconds']
+            match_id = game_server.get_dict_value('current_match_id')
+            if skipped >= INSTANCE_ALERT_MILLISECONDS and self.claim_match_alert(game_server.id, match_id):
+                alerts.append({'type': 'lag', 'time_lagged': skipped / 1000, 'instance': game_server.id, 'match_id': match_id})
+
+        new_spikes = list(self.spikes)[len(self.spikes) - min(len(self.spikes), self.spike_count - self.alerted_spike_count):]
+        self.alerted_spike_count = self.spike_count
+        worst = max(new_spikes, key=lambda spike: spike['lag'], default=None)
+        if worst and worst['lag'] >= MANAGER_ALERT_SECONDS:
+            now = time.monotonic()
+            if self.last_manager_alert is None or now - self.last_manager_alert > MANAGER_ALERT_COOLDOWN:
+                self.last_manager_alert = now
+                blocked_in = next((stack['coroutine'] for stack in worst['stacks'] if stack['coroutine']), None)
+                alerts.append({'type': 'manager_lag', 'time_lagged': worst['lag'], 'blocked_in': blocked_in})
+        return alerts
+
+
+LAG_MONITOR = None
+
+def get_lag_monitor():
+    global LAG_MONITOR
+    if LAG_MONITOR is None:
+        LAG_MONITOR = LagMonitor()
+    return LAG_MONITOR
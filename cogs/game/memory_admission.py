@@ -0,0 +1,268 @@
+import asyncio
+import time
+import psutil
+from collections import deque
+from cogs.misc.logger import get_logger, get_misc
+from cogs.misc.exceptions import HoNServerError
+from cogs.handlers.events import stop_event, GamePhase
+
+LOGGER = get_logger()
+MISC = get_misc()
+
+SAMPLE_INTERVAL = 10                    # seconds between footprint samples of the running instances
+DEFAULT_INSTANCE_FOOTPRINT = 1000000000 # used until real footprints have been observed. HoN instances use up to 1GB
+MIN_FREE_RAM_BYTES = 256000000          # always left free for the OS and the manager
+PREDICTION_MARGIN = 1.1                 # learnt footprints are padded by 10%
+ADMISSION_RETRY_INTERVAL = 5            # seconds between admission checks while a start is queued
+ADMISSION_TIMEOUT = 120                 # seconds a start may be queued before it fails
+RESERVATION_TIMEOUT = 300               # seconds an admitted start's reservation is held if the instance is never sampled
+PSI_SOME_AVG10_LIMIT = 10.0             # % of the last 10s that at least one task stalled waiting on memory
+PSI_FULL_AVG10_LIMIT = 1.0              # % of the last 10s that all tasks stalled waiting on memory
+IN_MATCH_PHASES = [GamePhase.BANNING_PHASE.value, GamePhase.PICKING_PHASE.value, GamePhase.LOADING_INTO_MATCH.value,
+                   GamePhase.PREPERATION_PHASE.value, GamePhase.MATCH_STARTED.value, GamePhase.GAME_ENDING.value, GamePhase.GAME_ENDED.value]
+
+
+class MemoryAdmission:
+    """
+    Decides whether there is enough RAM to start another game server.
+
+    This replaces the fixed "1GB available" check in GameServer.start_server.
+    The footprint of every running instance is sampled (PSS from smaps_rollup on linux, so pages shared with the cowmaster
+    are only counted in part. USS elsewhere), and the typical footprint is learnt per map / mode.
+    A start is admitted when the available RAM covers:
+        - the predicted footprint of the new instance
+        - the growth still to come from running instances that haven't reached their predicted peak (e.g. idle servers that will load a map)
+        - MIN_FREE_RAM_BYTES
+    Otherwise the start is queued until RAM frees up.
+
+    An admitted start reserves its predicted footprint until the new instance is first sampled, so that starts admitted
+    between two samples are checked against each other, rather than all against the same available RAM.
+
+    On linux, memory pressure (PSI, /proc/pressure/memory) is also watched. While the kernel is stalling on memory, all starts
+    are held back, so that scaling up doesn't invite the OOM killer into a live match.
+    """
+    def __init__(self):
+        self.footprints = {}        # (map, mode, forked) -> deque of sampled footprints in bytes
+        self.current = {}           # instance id -> {'footprint': bytes, 'forked': bool, 'key': (map, mode, forked)}
+        self.reservations = {}      # instance id -> {'footprint': bytes, 'time': monotonic time it was admitted}
+        self.pressure = None
+        self.queued = 0
+        self.last_decision = None
+
+    @staticmethod
+    def read_memory_pressure():
+        """
+        Returns:
+            dict: {'some': {'avg10': .., 'avg60': .., 'avg300': .., 'total': ..}, 'full': {...}}, or None if PSI is unavailable.
+        """
+        try:
+            pressure = {}
+            with open("/proc/pressure/memory") as f:
+                for line in f:
+                    kind, *values = line.split()
+                    pressure[kind] = {key: float(value) for key, value in (item.split('=') for item in values)}
+            return pressure
+        except (OSError, ValueError):
+            return None
+
+    def is_under_pressure(self):
+        if not self.pressure:
+            return False
+        return self.pressure.get('some', {}).get('avg10', 0) >= PSI_SOME_AVG10_LIMIT or self.pressure.get('full', {}).get('avg10', 0) >= PSI_FULL_AVG10_LIMIT
+
+    @staticmethod
+    def get_footprint(pid):
+        """PSS on linux, USS elsewhere. Both exclude the pages that would be freed by some other process exiting."""
+        rollup = MISC.get_memory_rollup(pid)
+        if rollup and 'Pss' in rollup:
+            return rollup['Pss']
+        try:
+            return psutil.Process(pid).memory_full_info().uss
+        except (psutil.Error, AttributeError):
+            return None
+
+    @staticmethod
+    def get_footprint_key(game_server, forked):
+        if game_server.get_dict_value('game_phase') in IN_MATCH_PHASES:
+            match_info = game_server.get_dict_value('match_info') or {}
+            return (match_info.get('map') or 'unknown', match_info.get('mode') or 'unknown', forked)
+        return ('idle', None, forked)
+
+    def sample(self, game_servers):
+        """
+        Sample the footprint of every running instance. Blocking, run it in an executor.
+
+        The event loop and the API read the footprints while this runs, so the samples are added to a copy, which
+        replaces them in one assignment. The dict and deques readers hold are never changed.
+        """
+        self.pressure = self.read_memory_pressure()
+        footprints = {key: deque(samples, maxlen=samples.maxlen) for key, samples in self.footprints.items()}
+        current = {}
+        for game_server in game_servers:
+            if not game_server._pid:
+                continue
+            footprint = self.get_footprint(game_server._pid)
+            if footprint is None:
+                continue
+            forked = bool(game_server.global_config['hon_data'].get('man_use_cowmaster'))
+            key = self.get_footprint_key(game_server, forked)
+            footprints.setdefault(key, deque(maxlen=50)).append(footprint)
+            current[game_server.id] = {'footprint': footprint, 'forked': forked, 'key': key}
+        self.footprints = footprints
+        self.current = current
+
+    def release_sampled(self, sampled_at):
+        """Drop the reservations of instances admitted before the sample started, that the sample found running."""
+        now = time.monotonic()
+        for instance_id, reservation in list(self.reservations.items()):
+            if (instance_id in self.current and reservation['time'] < sampled_at) or now - reservation['time'] > RESERVATION_TIMEOUT:
+                del self.reservations[instance_id]
+
+    def release(self, game_server):
+        """Drop the server's reservation, e.g. when its start failed, so it doesn't hold back other starts."""
+        self.reservations.pop(game_server.id, None)
+
+    async def run(self, game_servers):
+        """
+        Args:
+            game_servers (dict): the manager's game server dictionary. Read on every pass, so added / removed servers are picked up.
+        """
+        loop = asyncio.get_running_loop()
+        was_under_pressure = False
+        while not stop_event.is_set():
+            try:
+                sampled_at = time.monotonic()
+                await loop.run_in_executor(None, self.sample, list(game_servers.values()))
+                self.release_sampled(sampled_at)
+                under_pressure = self.is_under_pressure()
+                if under_pressure and not was_under_pressure:
+                    LOGGER.warn(f"Memory pressure detected ({self.pressure}). Server starts are paused until it clears.")
+                elif was_under_pressure and not under_pressure:
+                    LOGGER.info("Memory pressure has cleared. Server starts resumed.")
+                was_under_pressure = under_pressure
+            except Exception:
+                LOGGER.exception("Failed to sample game server memory usage")
+            for _ in range(SAMPLE_INTERVAL):
+                if stop_event.is_set():
+                    return
+                await asyncio.sleep(1)
+
+    @staticmethod
+    def percentile(samples, fraction):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def predict_footprint(self, forked, key=None):
+        """
+        The footprint an instance is expected to reach. Without a key, it's the largest learnt footprint, since a new server may be given any map.
+        """
+        footprints = self.footprints
+        if key is not None and footprints.get(key):
+            return int(self.percentile(footprints[key], 0.9) * PREDICTION_MARGIN)
+        learnt = [self.percentile(samples, 0.9) for (map_name, mode, is_forked), samples in footprints.items() if is_forked == forked and samples]
+        if not learnt:
+            return DEFAULT_INSTANCE_FOOTPRINT
+        return int(max(learnt) * PREDICTION_MARGIN)
+
+    def check(self, forked):
+        """
+        Returns:
+            dict: the admission decision, including the numbers it was based on.
+        """
+        available = psutil.virtual_memory().available
+        new_instance = self.predict_footprint(forked)
+        pending_growth = 0
+        for instance_id, instance in self.current.items():
+            if instance_id in self.reservations:
+                # sampled before it was restarted. Its reservation is counted instead
+                continue
+            # idle servers may yet load any map. Servers in a match are predicted from that map / mode
+            key = instance['key'] if instance['key'][0] != 'idle' else None
+            peak = self.predict_footprint(instance['forked'], key=key)
+            pending_growth += max(0, peak - instance['footprint'])
+        # starts admitted since the last sample, that it doesn't know about yet
+        reserved = sum(reservation['footprint'] for reservation in self.reservations.values())
+        required = new_instance + pending_growth + reserved + MIN_FREE_RAM_BYTES
+
+        reasons = []
+        if self.is_under_pressure():
+            reasons.append(f"memory pressure (some avg10 {self.pressure['some']['avg10']}%, full avg10 {self.pressure.get('full', {}).get('avg10', 0)}%)")
+        if available < required:
+            reasons.append(f"{available / 1e9:.2f}GB available, {required / 1e9:.2f}GB required ({new_instance / 1e9:.2f}GB new instance, {pending_growth / 1e9:.2f}GB growth of running instances, {reserved / 1e9:.2f}GB reserved by starting instances)")
+
+        self.last_decision = {
+            'admitted': not reasons,
+            'reasons': reasons,
+            'available': available,
+            'required': required,
+            'predicted_instance_footprint': new_instance,
+            'pending_growth': pending_growth,
+            'reserved': reserved,
+            'time': time.time()
+        }
+        return self.last_decision
+
+    async def admit(self, game_server, timeout=ADMISSION_TIMEOUT):
+        """
+        Wait until there is enough RAM to start the given server, and reserve its predicted footprint.
+        Call release() if the start then fails.
+
+        Raises:
+            HoNServerError: if RAM did not free up within the timeout.
+        """
+        forked = bool(game_server.global_config['hon_data'].get('man_use_cowmaster'))
+        # a restarting instance's old footprint will be freed, and its new one is reserved instead
+        self.release(game_server)
+        decision = self.check(forked)
+        if decision['admitted']:
+            self.reserve(game_server, decision)
+            return True
+
+        LOGGER.info(f"GameServer #{game_server.id} - start queued, waiting for memory. {', '.join(decision['reasons'])}")
+        self.queued += 1
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if stop_event.is_set():
+                    break
+                await asyncio.sleep(ADMISSION_RETRY_INTERVAL)
+                decision = self.check(forked)
+                if decision['admitted']:
+                    self.reserve(game_server, decision)
+                    LOGGER.info(f"GameServer #{game_server.id} - memory available, starting.")
+                    return True
+        finally:
+            self.queued -= 1
+
+        LOGGER.error(f"GameServer #{game_server.id} - cannot start as there is not enough free RAM. {', '.join(decision['reasons'])}")
+        raise HoNServerError(f"GameServer #{game_server.id} - cannot start as there is not enough free RAM")
+
+    def reserve(self, game_server, decision):
+        # no await between the check and this, so concurrent admissions see each other's reservations
+        self.reservations[game_server.id] = {'footprint': decision['predicted_instance_footprint'], 'time': time.monotonic()}
+
+    def get_status(self):
+        return {
+            'under_pressure': self.is_under_pressure(),
+            'pressure': self.pressure,
+            'queued_starts': self.queued,
+            'reservations': {instance_id: reservation['footprint'] for instance_id, reservation in self.reservations.items()},
+            'last_decision': self.last_decision,
+            'learnt_footprints': {
+                f"{map_name}/{mode}{' (forked)' if forked else ''}": {
+                    'samples': len(samples),
+                    'p90': self.percentile(samples, 0.9),
+                    'max': max(samples)
+                } for (map_name, mode, forked), samples in self.footprints.items() if samples
+            },
+            'instances': {instance_id: {'footprint': instance['footprint'], 'map': instance['key'][0], 'mode': instance['key'][1]} for instance_id, instance in self.current.items()}
+        }
+
+
+MEMORY_ADMISSION = None
+
+def get_memory_admission():
+    global MEMORY_ADMISSION
+    if MEMORY_ADMISSION is None:
+        MEMORY_ADMISSION = MemoryAdmission()
+    return MEMORY_ADMISSION
@@ -0,0 +1,273 @@
+"""
+Patching helpers, and blue/green HoN install directories.
+
+With man_blue_green_patching enabled, a new patch is applied to a copy of the active install directory:
+    /opt/hon/app            the configured install directory
+    /opt/hon/app-4.10.9.0   a patched copy, created next to it
+The copy is made, and patched, while the servers keep running from the active tree. Once patched, the new tree becomes the
+active hon_install_directory, so new instances launch from it, while running instances finish their matches on the old one.
+Trees created here are recorded in config/.blue_green_trees, and removed once no process runs from them any more. Only
+recorded trees are ever removed: never the configured install directory, nor any other directory next to it.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import traceback
+import zlib
+import aiofiles
+import aiohttp
+import psutil
+from pathlib import Path
+from cogs.misc.logger import get_logger, get_misc, get_home
+from cogs.handlers.events import stop_event
+from cogs.misc.checksums import get_checksum_service
+
+LOGGER = get_logger()
+MISC = get_misc()
+HOME_PATH = get_home()
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 1800             # seconds
+GARBAGE_COLLECTION_INTERVAL = 60    # seconds between checks for unused install trees
+TREE_SUFFIX = re.compile(r"-\d+(\.\d+)+$")     # stripped from the active tree's name, to name the next one
+
+
+async def download_file(url, destination, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Stream a file to disk without blocking the event loop.
+
+    Returns:
+        str: the CRC32 of the downloaded file, as hex.
+    """
+    crc = 0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async with aiofiles.open(destination, 'wb') as f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    crc = zlib.crc32(chunk, crc)
+                    await f.write(chunk)
+    return f"{crc:08x}"
+
+
+async def install_launcher(install_directory, launcher_binary, launcher_zip, launcher_crc, launcher_download_url):
+    """
+    Make sure the patch launcher in install_directory matches the CRC published upstream, downloading it if not.
+
+    Returns:
+        bool: whether a verified launcher is in place.
+    """
+    loop = asyncio.get_running_loop()
+    launcher_binary_path = Path(install_directory) / launcher_binary
+    if launcher_binary_path.exists() and (await get_checksum_service().checksum(launcher_binary_path)).lower() == launcher_crc.lower():
+        return True
+
+    LOGGER.debug(f"Beginning to download new launcher from {launcher_download_url}")
+    with tempfile.TemporaryDirectory() as temp_path:
+        temp_zip_path = Path(temp_path) / launcher_zip
+        try:
+            zip_crc = await download_file(launcher_download_url, temp_zip_path)
+            extracted_file_name = await loop.run_in_executor(None, functools.partial(MISC.unzip_file, source_zip=temp_zip_path, dest_unzip=temp_path))
+        except Exception:
+            LOGGER.warn(f"Newer {launcher_zip} is available, however the download failed.\n\t1. Please download the file manually: {launcher_download_url}\n\t2. Unzip the file into {install_directory}\n{traceback.format_exc()}")
+            return False
+
+        temp_extracted_launcher_path = Path(temp_path) / extracted_file_name[0]
+        binary_crc = await get_checksum_service().checksum(temp_extracted_launcher_path)
+        if launcher_crc.lower() not in [binary_crc.lower(), zip_crc.lower()]:
+            LOGGER.error(f"Downloaded {launcher_zip} failed verification. Expected CRC {launcher_crc}, got {binary_crc}. Not using it.")
+            return False
+
+        try:
+            shutil.move(temp_extracted_launcher_path, launcher_binary_path)
+            LOGGER.debug(f"Moved extracted launcher to HoN working directory: {launcher_binary_path}")
+        except PermissionError:
+            LOGGER.warn(f"Hon Update - the file {launcher_binary_path} is currently in use. Closing the file..")
+            process = MISC.get_proc(proc_name=launcher_binary)
+            if process: process.terminate()
+            try:
+                shutil.move(temp_extracted_launcher_path, launcher_binary_path)
+            except Exception:
+                LOGGER.error(f"HoN Update - Failed to copy downloaded {launcher_binary} into {install_directory}\n\t1. Please download the file manually: {launcher_download_url}\n\t2. Unzip the file into {install_directory}")
+                return False
+    return True
+
+
+async def run_patcher(install_directory, launcher_binary, timeout):
+    """
+    Run the patch launcher against install_directory, in a worker thread.
+
+    Raises:
+        subprocess.TimeoutExpired: if patching took longer than the timeout.
+    """
+    patcher_executable = Path(install_directory) / launcher_binary
+    if MISC.get_os_platform() == "win32":
+        cmdline = [patcher_executable, "-norun"]
+    else:
+        os.chmod(patcher_executable, 0o700)
+        cmdline = [patcher_executable]
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, functools.partial(subprocess.run, cmdline, cwd=install_directory, timeout=timeout))
+
+
+def get_server_executable(install_directory, hon_executable_name):
+    """The server binary within an install directory. On linux the KONGOR build is preferred where present."""
+    install_directory = Path(install_directory)
+    if MISC.get_os_platform() == "linux":
+        executable = "hon-x86_64-server_KONGOR"
+        if not os.path.exists(install_directory / executable):
+            executable = "hon-x86_64-server"
+        return install_directory / executable, executable
+    return install_directory / hon_executable_name, hon_executable_name
+
+
+class BlueGreenInstalls:
+    def __init__(self, global_config):
+        self.global_config = global_config
+        self.collector_task = None
+        self.configured_directory = self.get_active_directory().resolve()
+        self.state_path = HOME_PATH / "config" / ".blue_green_trees"
+
+    def get_active_directory(self):
+        return Path(self.global_config['hon_data']['hon_install_directory'])
+
+    def get_base_directory(self):
+        active = self.get_active_directory()
+        return active.parent / TREE_SUFFIX.sub('', active.name)
+
+    def get_tree_path(self, version):
+        base = self.get_base_directory()
+        return base.parent / f"{base.name}-{version}"
+
+    def load_trees(self):
+        """The install trees blue/green patching created, as recorded in the state file."""
+        try:
+            with open(self.state_path, 'r') as f:
+                return [Path(tree) for tree in json.load(f)]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, TypeError):
+            LOGGER.error(f"Patching - could not read {self.state_path}. No old install trees will be removed. {traceback.format_exc()}")
+            return []
+
+    def save_trees(self, trees):
+        os.makedirs(self.state_path.parent, exist_ok=True)
+        temp_path = self.state_path.parent / f"{self.state_path.name}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump([str(tree) for tree in trees], f)
+        os.replace(temp_path, self.state_path)
+
+    def record_tree(self, tree):
+        trees = self.load_trees()
+        if Path(tree) not in trees:
+            self.save_trees(trees + [Path(tree)])
+
+    def forget_tree(self, tree):
+        self.save_trees([recorded for recorded in self.load_trees() if recorded.resolve() != Path(tree).resolve()])
+
+    def get_trees(self):
+        """The recorded install trees that still exist, other than the configured install directory."""
+        return [tree for tree in self.load_trees() if tree.is_dir() and tree.resolve() != self.configured_directory]
+
+    @staticmethod
+    def copy_tree(source, destination):
+        partial = destination.parent / f"{destination.name}.partial"
+        if partial.exists():
+            shutil.rmtree(partial)
+        shutil.copytree(source, partial, symlinks=True)
+        os.replace(partial, destination)
+
+    async def prepare(self, version, launcher_binary, launcher_zip, launcher_crc, launcher_download_url, timeout=3600):
+        """
+        Create a patched install tree for the given version, next to the active one. Servers keep running throughout.
+
+        Returns:
+            Path: the patched tree, or None if patching failed.
+        """
+        loop = asyncio.get_running_loop()
+        active = self.get_active_directory()
+        tree = self.get_tree_path(version)
+        hon_executable_name = self.global_config['hon_data']['hon_executable_name']
+
+        if tree == active:
+            return tree
+        if tree.exists():
+            executable, _ = get_server_executable(tree, hon_executable_name)
+            if executable.exists() and MISC.get_svr_version(executable) == version:
+                LOGGER.info(f"Patching - reusing the already patched install at {tree}")
+                return tree
+        else:
+            LOGGER.info(f"Patching - copying {active} to {tree}. Servers keep running in the meantime.")
+            # recorded first, so a tree left behind by a failed copy or patch is cleaned up too
+            self.record_tree(tree)
+            await loop.run_in_executor(None, self.copy_tree, active, tree)
+
+        if not await install_launcher(tree, launcher_binary, launcher_zip, launcher_crc, launcher_download_url):
+            return None
+
+        LOGGER.info(f"Patching - patching {tree} to {version}")
+        await run_patcher(tree, launcher_binary, timeout)
+
+        executable, _ = get_server_executable(tree, hon_executable_name)
+        svr_version = MISC.get_svr_version(executable) if executable.exists() else None
+        if svr_version != version:
+            LOGGER.error(f"Patching - {tree} did not patch to {version}. Current version: {svr_version}")
+            return None
+        return tree
+
+    def activate(self, tree):
+        """New instances launch from the given tree from now on."""
+        hon_data = self.global_config['hon_data']
+        executable_path, executable_name = get_server_executable(tree, hon_data['hon_executable_name'])
+        previous = self.get_active_directory()
+        hon_data['hon_install_directory'] = Path(tree)
+        hon_data['hon_executable_path'] = executable_path
+        hon_data['hon_executable_name'] = executable_name
+        hon_data['svr_version'] = MISC.get_svr_version(executable_path)
+        LOGGER.info(f"Patching - new servers will launch from {tree} ({hon_data['svr_version']}). Running servers finish their matches on {previous}.")
+
+    def find_unused_trees(self):
+        """Recorded trees, other than the active one, that no process is running from. Blocking."""
+        active = self.get_active_directory().resolve()
+        candidates = [tree.resolve() for tree in self.get_trees() if tree.resolve() not in (active, self.configured_directory)]
+        if not candidates:
+            return []
+        in_use = set()
+        for proc in psutil.process_iter(['exe']):
+            exe = proc.info.get('exe')
+            if not exe:
+                continue
+            for tree in candidates:
+                if Path(exe).is_relative_to(tree):
+                    in_use.add(tree)
+        return [tree for tree in candidates if tree not in in_use]
+
+    async def collect_garbage(self):
+        """Remove old install trees as the last server using each one exits."""
+        loop = asyncio.get_running_loop()
+        while not stop_event.is_set():
+            try:
+                old_trees = [tree for tree in self.get_trees() if tree.resolve() != self.get_active_directory().resolve()]
+                if not old_trees:
+                    return
+                for tree in await loop.run_in_executor(None, self.find_unused_trees):
+                    LOGGER.info(f"Patching - removing unused install tree {tree}")
+                    await loop.run_in_executor(None, functools.partial(shutil.rmtree, tree, ignore_errors=True))
+                    if not tree.exists():
+                        self.forget_tree(tree)
+            except Exception:
+                LOGGER.error(f"Patching - failed to clean up old install trees. {traceback.format_exc()}")
+            for _ in range(GARBAGE_COLLECTION_INTERVAL):
+                if stop_event.is_set():
+                    return
+                await asyncio.sleep(1)
+
+    def schedule_garbage_collection(self):
+        if self.collector_task is None or self.collector_task.done():
+            self.collector_task = asyncio.create_task(self.collect_garbage())
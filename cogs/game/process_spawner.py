@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import subprocess
+import psutil
+from concurrent.futures import ThreadPoolExecutor
+from cogs.misc.logger import get_logger
+
+LOGGER = get_logger()
+
+SPAWN_WORKERS = 4           # number of launches that may be in progress (fork/exec) at the same time
+INSPECT_BATCH_DELAY = 0.05  # seconds to wait for other launches to join a batch of psutil lookups
+
+class ProcessSpawner:
+    """
+    Launches game server and cowmaster executables without blocking the event loop.
+
+    subprocess.Popen (fork/exec, or CreateProcess on windows) runs in a small thread pool, so packet handling
+    for running servers continues during mass starts.
+    The post-spawn psutil work (psutil.Process + username) is queued, and resolved in batches in the same pool,
+    so 20 servers starting together cost one trip to the thread pool rather than 20.
+
+    asyncio.create_subprocess_exec is deliberately not used. Game servers must outlive the manager, and asyncio's
+    subprocess transport kills the child when the transport is closed or garbage collected. It is also unavailable
+    on the SelectorEventLoop used on windows.
+    """
+    def __init__(self, max_workers=SPAWN_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spawner")
+        self.pending_inspections = []
+        self.inspection_task = None
+
+    async def spawn(self, cmdline_args, **popen_kwargs):
+        """
+        Launch a process.
+
+        Args:
+            cmdline_args (list): the command line to run
+            **popen_kwargs: passed through to subprocess.Popen
+
+        Returns:
+            tuple: (subprocess.Popen, psutil.Process, str owner username)
+        """
+        loop = asyncio.get_running_loop()
+        proc = await loop.run_in_executor(self.executor, functools.partial(subprocess.Popen, cmdline_args, **popen_kwargs))
+        proc_hook, owner = await self.inspect(proc.pid)
+        return proc, proc_hook, owner
+
+    async def inspect(self, pid):
+        """
+        Get the psutil.Process and owner of a pid. Lookups requested at around the same time are resolved together.
+
+        Returns:
+            tuple: (psutil.Process, str owner username)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending_inspections.append((pid, future))
+        if self.inspection_task is None or self.inspection_task.done():
+            self.inspection_task = asyncio.create_task(self.run_inspections())
+        return await future
+
+    async def run_inspections(self):
+        loop = asyncio.get_running_loop()
+        while self.pending_inspections:
+            await asyncio.sleep(INSPECT_BATCH_DELAY)
+            batch, self.pending_inspections = self.pending_inspections, []
+            try:
+                results = await loop.run_in_executor(self.executor, self.inspect_batch, [pid for pid, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (pid, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    @staticmethod
+    def inspect_batch(pids):
+        results = []
+        for pid in pids:
+            try:
+                proc_hook = psutil.Process(pid=pid)
+                with proc_hook.oneshot():
+                    owner = proc_hook.username()
+                results.append((proc_hook, owner))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+PROCESS_SPAWNER = None
+
+def get_spawner():
+    global PROCESS_SPAWNER
+    if PROCESS_SPAWNER is None:
+        PROCESS_SPAWNER = ProcessSpawner()
+    return PROCESS_SPAWNER
@@ -0,0 +1,208 @@
+import asyncio
+import time
+import traceback
+from datetime import datetime
+from cogs.misc.logger import get_logger
+from cogs.handlers.events import stop_event, GameStatus
+
+LOGGER = get_logger()
+
+POLL_INTERVAL = 2           # seconds between progress checks
+PROGRESS_HISTORY = 200      # progress events kept for late API subscribers
+
+
+class RollingRestart:
+    """
+    Restarts game servers a few at a time, so the region always has at least man_rolling_restart_floor ready servers.
+
+    Used for config changes (instead of shutting down every changed server at once), and to drain servers before patching.
+        - idle servers (sleeping first, as they aren't serving capacity) are restarted in batches of up to svr_max_start_at_once,
+          only as far as the ready servers above the floor allow.
+        - servers in a match are scheduled to restart once the match ends.
+    A restarted server counts as done once it reports ready again.
+
+    Progress is kept as a list of events, which the API streams to clients.
+    """
+    def __init__(self, global_config, game_servers, shutdown_server):
+        """
+        Args:
+            shutdown_server (coroutine function): GameServerManager.cmd_shutdown_server
+        """
+        self.global_config = global_config
+        self.game_servers = game_servers
+        self.shutdown_server = shutdown_server
+        self.task = None
+        self.events = []
+        self.state = {}
+        self.progress_changed = asyncio.Event()
+
+    def is_running(self):
+        return self.task is not None and not self.task.done()
+
+    def get_floor(self):
+        floor = int(self.global_config['hon_data'].get('man_rolling_restart_floor', 2))
+        # with fewer servers than the floor, restarting 1 at a time is the best we can do
+        return max(0, min(floor, len(self.game_servers) - 1))
+
+    def get_batch_size(self):
+        return max(1, int(self.global_config['hon_data']['svr_max_start_at_once']))
+
+    def publish(self, message, **details):
+        event = {'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'message': message, **details}
+        self.events.append(event)
+        del self.events[:-PROGRESS_HISTORY]
+        LOGGER.info(f"Rolling restart - {message}")
+        self.progress_changed.set()
+        self.progress_changed = asyncio.Event()
+
+    def start(self, game_servers, reason):
+        """
+        Begin a rolling restart of the given servers. If one is already running, the servers are added to it.
+        """
+        if self.is_running():
+            added = [game_server for game_server in game_servers if game_server.id not in self.state['pending'] and game_server.id not in self.state['done']]
+            for game_server in added:
+                self.state['pending'][game_server.id] = game_server
+            if added:
+                self.publish(f"added {len(added)} servers to the rolling restart ({reason})", servers=[game_server.id for game_server in added])
+            return self.task
+        self.events = []
+        self.state = {
+            'reason': reason,
+            'started': time.time(),
+            'pending': {game_server.id: game_server for game_server in game_servers},
+            'restarting': {},
+            'draining': {},
+            'done': [],
+            'failed': []
+        }
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    @staticmethod
+    def get_status_value(game_server):
+        return game_server.get_dict_value('status')
+
+    def count_ready(self):
+        return len([game_server for game_server in self.game_servers.values() if self.get_status_value(game_server) == GameStatus.READY.value and not game_server.scheduled_shutdown])
+
+    async def restart(self, game_server, state_key):
+        self.state['pending'].pop(game_server.id, None)
+        self.state[state_key][game_server.id] = (game_server, time.monotonic())
+        await self.shutdown_server(game_server, disable=False)
+
+    def check_restarted(self):
+        timeout = self.global_config['hon_data'].get('svr_startup_timeout', 180) * 2
+        for state_key in ('restarting', 'draining'):
+            for instance_id, (game_server, since) in list(self.state[state_key].items()):
+                status = self.get_status_value(game_server)
+                if state_key == 'draining' and game_server.scheduled_shutdown:
+                    continue    # match still in progress
+                if status in [GameStatus.READY.value, GameStatus.SLEEPING.value, GameStatus.OCCUPIED.value] and not game_server.scheduled_shutdown and (time.monotonic() - since) > POLL_INTERVAL:
+                    del self.state[state_key][instance_id]
+                    self.state['done'].append(instance_id)
+                    self.publish(f"GameServer #{instance_id} restarted", server=instance_id)
+                elif state_key == 'restarting' and time.monotonic() - since > timeout:
+                    del self.state[state_key][instance_id]
+                    self.state['failed'].append(instance_id)
+                    self.publish(f"GameServer #{instance_id} did not come back within {timeout} seconds", server=instance_id)
+
+    async def step(self):
+        self.check_restarted()
+        pending = list(self.state['pending'].values())
+
+        # in-match servers restart when their match ends
+        for game_server in pending:
+            if self.get_status_value(game_server) == GameStatus.OCCUPIED.value:
+                await self.restart(game_server, 'draining')
+                self.publish(f"GameServer #{game_server.id} is in a match, it will restart when the match ends", server=game_server.id)
+
+        # servers not running at all pick up the new configuration when they're next started
+        for game_server in list(self.state['pending'].values()):
+            if not game_server.started and self.get_status_value(game_server) == GameStatus.UNKNOWN.value:
+                self.state['pending'].pop(game_server.id)
+                self.state['done'].append(game_server.id)
+
+        idle = sorted(self.state['pending'].values(), key=lambda game_server: (self.get_status_value(game_server) != GameStatus.SLEEPING.value, game_server.id))
+        if not idle:
+            return
+
+        ready = self.count_ready()
+        floor = self.get_floor()
+        slots = self.get_batch_size() - len(self.state['restarting'])
+        batch = []
+        for game_server in idle:
+            if len(batch) >= slots:
+                break
+            if self.get_status_value(game_server) == GameStatus.READY.value:
+                if ready - 1 < floor:
+                    continue
+                ready -= 1
+            batch.append(game_server)
+
+        for game_server in batch:
+            await self.restart(game_server, 'restarting')
+        if batch:
+            self.publish(f"restarting {len(batch)} idle servers, {ready} ready servers remain (floor {floor})", servers=[game_server.id for game_server in batch])
+
+    async def run(self):
+        total = len(self.state['pending'])
+        self.publish(f"started for {total} servers ({self.state['reason']}). At least {self.get_floor()} ready servers will be kept.", servers=list(self.state['pending']))
+        try:
+            while not stop_event.is_set() and (self.state['pending'] or self.state['restarting'] or self.state['draining']):
+                await self.step()
+                await asyncio.sleep(POLL_INTERVAL)
+        except Exception:
+            LOGGER.error(f"Rolling restart - {traceback.format_exc()}")
+            self.publish("stopped due to an error")
+            return False
+        self.publish(f"complete. {len(self.state['done'])} restarted, {len(self.state['failed'])} failed, in {round(time.time() - self.state['started'])} seconds.", finished=True)
+        return not self.state['failed']
+
+    def get_status(self):
+        if not self.state:
+            return {'running': False}
+        return {
+            'running': self.is_running(),
+            'reason': self.state['reason'],
+            'floor': self.get_floor(),
+            'ready': self.count_ready(),
+            'pending': list(self.state['pending']),
+            'restarting': list(self.state['restarting']),
+            'waiting_for_match_to_end': list(self.state['draining']),
+            'done': self.state['done'],
+            'failed': self.state['failed'],
+            'events': self.events[-20:]
+        }
+
+    async def stream_progress(self):
+        """Yields every progress event (earlier ones first) until the rolling restart finishes."""
+        sent = 0
+        while True:
+            changed = self.progress_changed
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if not self.is_running() or stop_event.is_set():
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                yield {'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'message': 'keepalive'}
+
+    def get_patch_drain_plan(self):
+        """
+        Patching replaces the binaries that every server runs from, so all servers must be stopped before it can start.
+        Rather than shutting every idle server down at once, and leaving the region with no capacity until the last match ends,
+        keep the floor of ready servers running until no matches remain.
+
+        Returns:
+            tuple: (servers to shut down now, servers in a match, whether every server can be stopped now)
+        """
+        in_match = [game_server for game_server in self.game_servers.values() if self.get_status_value(game_server) == GameStatus.OCCUPIED.value]
+        idle = [game_server for game_server in self.game_servers.values() if game_server not in in_match]
+        if not in_match:
+            return idle, in_match, True
+        ready = sorted([game_server for game_server in idle if self.get_status_value(game_server) == GameStatus.READY.value], key=lambda game_server: game_server.id)
+        keep = ready[:self.get_floor()]
+        return [game_server for game_server in idle if game_server not in keep], in_match, False
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import psutil
+from collections import deque
+from datetime import datetime
+from cogs.misc.logger import get_logger
+
+LOGGER = get_logger()
+
+CPU_PRESSURE_PERCENT = 90           # total cpu utilisation at which we consider the host congested
+IOWAIT_PRESSURE_PERCENT = 20        # linux only. Disk bound starts (cold cache) show up here
+MIN_FREE_RAM_BYTES = 2000000000     # each instance wants up to 1GB while loading resources
+SLOW_START_FACTOR = 2               # a start taking 2x longer than the running average is treated as congestion
+DECREASE_COOLDOWN = 10              # seconds. Starts that were in flight during the same congestion only halve the window once
+FIRST_STATUS_TIMEOUT = 15           # seconds to wait for the first 0x42 status after the server registers
+
+class AdaptiveStartController:
+    """
+    Limits how many game servers may start at once.
+
+    This is used in place of a fixed asyncio.Semaphore(svr_max_start_at_once). The limit (window) starts at svr_max_start_at_once
+    and adapts AIMD style (the same way TCP congestion control works):
+        - each healthy start grows the window by 1/window, so roughly +1 per full window of healthy starts.
+        - a failed or slow start, or a host under CPU / IO / RAM pressure, halves the window.
+    When man_adaptive_start is disabled, the window is fixed at svr_max_start_at_once.
+    """
+    def __init__(self, global_config):
+        self.global_config = global_config
+        self.in_flight = 0
+        self.waiters = deque()
+        self.history = deque(maxlen=100)
+        self.average_time_to_first_status = None
+        self.last_decrease = 0
+        self.update_limits()
+        # prime the psutil counters, so the first sample taken during a start isn't meaningless
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_times_percent(interval=None)
+
+    def update_limits(self):
+        hon_data = self.global_config['hon_data']
+        previous_initial_window = getattr(self, 'initial_window', None)
+        self.initial_window = max(1, int(hon_data['svr_max_start_at_once']))
+        self.adaptive = hon_data.get('man_adaptive_start', True)
+        if self.adaptive:
+            self.max_window = max(self.initial_window, psutil.cpu_count(logical=True) or 1)
+        else:
+            self.max_window = self.initial_window
+        if previous_initial_window != self.initial_window or not self.adaptive:
+            self.window = float(self.initial_window)
+        else:
+            # unrelated config change, keep what we've learnt so far
+            self.window = min(self.window, float(self.max_window))
+        self.wake_waiters()
+
+    def get_limit(self):
+        return max(1, int(self.window))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    async def acquire(self):
+        while self.in_flight >= self.get_limit():
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake_waiters()
+
+    def wake_waiters(self):
+        free_slots = self.get_limit() - self.in_flight
+        while free_slots > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    def sample_host_pressure(self):
+        cpu = psutil.cpu_percent(interval=None)
+        iowait = getattr(psutil.cpu_times_percent(interval=None), 'iowait', 0.0)
+        free_ram = psutil.virtual_memory().available
+        reasons = []
+        if cpu >= CPU_PRESSURE_PERCENT:
+            reasons.append(f"cpu {cpu}%")
+        if iowait >= IOWAIT_PRESSURE_PERCENT:
+            reasons.append(f"iowait {iowait}%")
+        if free_ram < MIN_FREE_RAM_BYTES:
+            reasons.append(f"free ram {free_ram / 1e9:.2f}GB")
+        return {'cpu': cpu, 'iowait': iowait, 'free_ram': free_ram, 'reasons': reasons}
+
+    def record(self, game_server, started):
+        """
+        Feed the outcome of a start back into the controller.
+
+        Args:
+            game_server (GameServer): the server that was started. Its start_timings are used.
+            started (bool): whether the server started (registered with the manager)
+        """
+        timings = game_server.start_timings
+        if 'spawn' not in timings:
+            # nothing was launched, e.g. the server was already running and we just re-attached to it.
+            return
+
+        slot_acquired = timings.get('slot_acquired', 0)
+        first_status = timings.get('first_status', timings.get('tcp_register'))
+        time_to_first_status = first_status - slot_acquired if started and first_status is not None else None
+
+        pressure = self.sample_host_pressure()
+        reasons = list(pressure['reasons'])
+        if not started:
+            reasons.append("start failed")
+        elif time_to_first_status is not None and self.average_time_to_first_status and time_to_first_status > self.average_time_to_first_status * SLOW_START_FACTOR:
+            reasons.append(f"slow start ({time_to_first_status:.1f}s vs {self.average_time_to_first_status:.1f}s average)")
+
+        if time_to_first_status is not None:
+            if self.average_time_to_first_status is None:
+                self.average_time_to_first_status = time_to_first_status
+            else:
+                self.average_time_to_first_status += (time_to_first_status - self.average_time_to_first_status) * 0.2
+
+        old_window = self.window
+        if self.adaptive:
+            now = time.monotonic()
+            if reasons:
+                if now - self.last_decrease > DECREASE_COOLDOWN:
+                    self.window = max(1.0, self.window / 2)
+                    self.last_decrease = now
+            else:
+                self.window = min(float(self.max_window), self.window + 1 / self.window)
+
+        if int(old_window) != int(self.window):
+            LOGGER.debug(f"Server start concurrency changed from {int(old_window)} to {int(self.window)}. {', '.join(reasons) if reasons else 'Host healthy.'}")
+
+        timings['result'] = 'started' if started else 'failed'
+        self.history.append({
+            'instance_id': game_server.id,
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'time_to_first_status': round(time_to_first_status, 3) if time_to_first_status is not None else None,
+            'timings': dict(timings),
+            'congestion': reasons,
+            'window': round(self.window, 2),
+            'cpu': pressure['cpu'],
+            'iowait': pressure['iowait'],
+            'free_ram': pressure['free_ram']
+        })
+        self.wake_waiters()
+
+    def get_status(self):
+        return {
+            'adaptive': self.adaptive,
+            'window': round(self.window, 2),
+            'limit': self.get_limit(),
+            'max_window': self.max_window,
+            'in_flight': self.in_flight,
+            'queued': len(self.waiters),
+            'average_time_to_first_status': round(self.average_time_to_first_status, 3) if self.average_time_to_first_status is not None else None,
+            'recent_starts': list(self.history)[-20:]
+        }
@@ -1,9 +1,8 @@
-import nest_asyncio
-nest_asyncio.apply()
 import traceback
 import asyncio
 import inspect
 import re
+import time
 from cogs.misc.logger import get_logger, get_script_dir, flatten_dict, print_formatted_text, get_home, get_misc
 from cogs.misc.setup import SetupEnvironment
 from cogs.handlers.events import stop_event
@@ -12,6 +11,8 @@ from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.shortcuts import PromptSession
 from prompt_toolkit.history import FileHistory
 from columnar import columnar
+from cogs.game.fleet_state import FleetStateReader, describe
+from cogs.TCP.packet_capture import get_packet_capture
 
 script_dir = get_script_dir(__file__)
 LOGGER = get_logger()
@@ -148,6 +149,8 @@ class Commands:
             "startup": Command("startup", description="Start 1 or more game servers", usage="startup <GameServer# / ALL>", function=None, sub_commands=await self.startup_servers_subcommands()),
             "addservers": Command("addservers", description="Add 1 or more game servers", usage="add <Num / ALL>", function=None, sub_commands=await self.add_servers_subcommands()),
             "status": Command("status", description="Show status of connected GameServers", usage="status", function=self.status, sub_commands={}),
+            "details": Command("details", description="Show the detailed status of connected GameServers, including players, ports and CPU cores", usage="details", function=self.details, sub_commands={}),
+            "capture": Command("capture", description="Record the packets received from GameServers, the CowMaster and the chat server to a capture file in logs/, for benchmarks/packet_replay.py", usage="capture <start / stop>", function=self.capture_status, sub_commands={"start": self.capture_start, "stop": self.capture_stop}),
             "reconnect": Command("reconnect", description="Close all GameServer connections, forcing them to reconnect", usage="reconnect", function=self.reconnect, sub_commands={}),
             "disconnect": Command("disconnect", description="Disconnect the specified GameServer. This only closes the network communication between the manager and game server, not shutdown.", usage="disconnect <GameServer# / ALL>", function=None, sub_commands=await self.disconnect_subcommands()),
             "setconfig": Command("setconfig", description="Set a configuration value for the server", usage="set config <config key> <config value>", function=None, sub_commands=await self.config_commands(),args=["force"]),
@@ -231,7 +234,7 @@ class Commands:
             LOGGER.info("Scheduling restart of servers to apply new configuration")
             if last_key == "svr_total":
                 await self.manager_event_bus.emit('balance_game_server_count')
-            elif last_key =="svr_max_start_at_once":
+            elif last_key in ["svr_max_start_at_once", "man_adaptive_start"]:
                 await self.manager_event_bus.emit('update_server_start_semaphore')
             await self.manager_event_bus.emit('check_for_restart_required')
     async def update_and_change_branch(self, branch_name=None, *cmd_args):
@@ -445,12 +448,50 @@ class Commands:
             await game_server.disable_server()
 
     async def status(self):
+        """Read from the fleet state table, as any other process on the host can, rather than from each GameServer."""
         try:
-            if self.global_config['hon_data'].get('man_use_cowmaster') and self.cowmaster:
-                if self.cowmaster.client_connection:
-                    print_formatted_text("Cowmaster is in use. Cowmaster connected.")
-                else:
-                    print_formatted_text("Cowmaster is in use. Cowmaster NOT connected.")
+            self.print_cowmaster_status()
+            try:
+                reader = FleetStateReader()
+                records = reader.read_all()
+                reader.close()
+            except (OSError, ValueError):
+                records = []
+            if not records:
+                print_formatted_text("No GameServers connected.")
+                return
+
+            headers = ["ID", "Port", "Status", "Game Phase", "Connections", "Match ID", "Uptime", "CPU %", "Skipped Frames (match / total ms)", "Updated"]
+            rows = []
+            now = time.time()
+            for record in records:
+                described = describe(record)
+                rows.append([
+                    record.instance_id,
+                    record.port,
+                    described['status_name'],
+                    described['game_phase_name'],
+                    record.num_clients,
+                    record.match_id or '',
+                    f"{record.uptime // 60000}m",
+                    round(record.cpu_util, 1),
+                    f"{record.now_skipped_frames} / {record.total_skipped_frames}",
+                    f"{round(now - record.updated)}s ago"
+                ])
+            print_formatted_text(columnar(rows, headers=headers))
+        except Exception as e:
+            LOGGER.exception(f"An error occurred while handling the {inspect.currentframe().f_code.co_name} function: {traceback.format_exc()}")
+
+    def print_cowmaster_status(self):
+        if self.global_config['hon_data'].get('man_use_cowmaster') and self.cowmaster:
+            if self.cowmaster.client_connection:
+                print_formatted_text("Cowmaster is in use. Cowmaster connected.")
+            else:
+                print_formatted_text("Cowmaster is in use. Cowmaster NOT connected.")
+
+    async def details(self):
+        try:
+            self.print_cowmaster_status()
             if len(self.game_servers) == 0:
                 print_formatted_text("No GameServers connected.")
                 return
@@ -476,6 +517,30 @@ class Commands:
             LOGGER.exception(f"An error occurred while handling the {inspect.currentframe().f_code.co_name} function: {traceback.format_exc()}")
 
 
+    async def capture_start(self):
+        capture = get_packet_capture()
+        if capture.active:
+            print_formatted_text(f"Already capturing packets to {capture.path}")
+            return
+        path = HOME_PATH / "logs" / f"capture-{time.strftime('%Y%m%d-%H%M%S')}.hcap"
+        capture.start(path)
+        print_formatted_text(f"Capturing packets to {path}. Stop with: capture stop")
+
+    async def capture_stop(self):
+        capture = get_packet_capture()
+        if not capture.active:
+            print_formatted_text("No packet capture is running.")
+            return
+        packets = capture.stop()
+        print_formatted_text(f"Captured {packets} packets to {capture.path}. Replay with: python benchmarks/packet_replay.py {capture.path}")
+
+    async def capture_status(self):
+        capture = get_packet_capture()
+        if capture.active:
+            print_formatted_text(f"Capturing packets to {capture.path}: {capture.packets} packets, {capture.size / 1024 / 1024:.1f} MB so far.")
+        else:
+            print_formatted_text("No packet capture is running. Start one with: capture start")
+
     async def reconnect(self):
         try:
 
@@ -1,5 +1,6 @@
 import asyncio
 from cogs.misc.logger import get_logger
+from cogs.misc.metrics import EVENTS, EVENT_BUS_PENDING_TASKS
 from enum import Enum
 
 LOGGER = get_logger()
@@ -9,20 +10,27 @@ stop_event = asyncio.Event()
 class EventBus:
     def __init__(self):
         self._subscribers = {}
-        self.tasks = []
+        self.tasks = set()  # callbacks still running. Finished ones remove themselves
 
     def subscribe(self, event_type, callback):
         if event_type not in self._subscribers:
             self._subscribers[event_type] = []
         self._subscribers[event_type].append(callback)
+    def task_done(self, task):
+        self.tasks.discard(task)
+        EVENT_BUS_PENDING_TASKS.dec()
+
     async def emit(self, event_type, *args, **kwargs):
+        EVENTS.labels(event_type).inc()
         if event_type in self._subscribers:
             for callback in self._subscribers[event_type]:
                 try:
                     if asyncio.iscoroutinefunction(callback):
                         # await callback(*args, **kwargs)
                         task = asyncio.create_task(callback(*args, **kwargs))
-                        self.tasks.append(task)
+                        self.tasks.add(task)
+                        EVENT_BUS_PENDING_TASKS.inc()
+                        task.add_done_callback(self.task_done)
                         # return task
                     else:
                         callback(*args, **kwargs)
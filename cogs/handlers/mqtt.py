@@ -1,11 +1,15 @@
 import paho.mqtt.client as mqtt
 import json
 import datetime
+import time
+import threading
 from cogs.misc.logger import get_logger, get_misc, get_discord_username
+from cogs.misc.metrics import MQTT_PUBLISH_SECONDS, MQTT_ACK_SECONDS, MQTT_IN_FLIGHT
 import os
 from pathlib import Path
 
 LOGGER = get_logger()
+MQTT_ACK_TIMEOUT = 60   # seconds
 
 class MQTTHandler:
 
@@ -18,6 +22,11 @@ class MQTTHandler:
         self.mastersv_state = None
         self.chatsv_state = None
         self.connected = False
+        self.in_flight = {}     # message id -> time published, until the broker acknowledges it
+        self.acked_early = {}   # message id -> time acknowledged, for acks that arrive before publish() has returned the id
+        # the acks arrive on paho's network thread
+        self.in_flight_lock = threading.Lock()
+        MQTT_IN_FLIGHT.function = lambda: len(self.in_flight)
 
         # Create a new MQTT client instance
         self.client = mqtt.Client()
@@ -52,6 +61,13 @@ class MQTTHandler:
         self.connected = False
 
     def _on_publish(self, client, userdata, mid):
+        acked = time.perf_counter()
+        with self.in_flight_lock:
+            published = self.in_flight.pop(mid, None)
+            if published is None:
+                self.acked_early[mid] = acked
+        if published is not None:
+            MQTT_ACK_SECONDS.observe(acked - published)
         LOGGER.debug(f"Message Published with MID: {mid}")
 
     def connect(self):
@@ -101,7 +117,24 @@ class MQTTHandler:
                 LOGGER.error("Failed to connect to MQTT broker")
                 return False
 
+        started = time.perf_counter()
         data.update(self.add_metadata())
         payload = json.dumps(data)
         result = self.client.publish(topic, payload, qos)
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            with self.in_flight_lock:
+                # the network thread may have had the ack before publish() returned
+                acked = self.acked_early.pop(result.mid, None)
+                if acked is None and qos > 0:
+                    self.in_flight[result.mid] = started
+                # messages never acknowledged (e.g. lost with the connection) stop counting as in flight after a while
+                for mid, published in list(self.in_flight.items()):
+                    if started - published > MQTT_ACK_TIMEOUT:
+                        self.in_flight.pop(mid, None)
+                for mid, early in list(self.acked_early.items()):
+                    if started - early > MQTT_ACK_TIMEOUT:
+                        self.acked_early.pop(mid, None)
+            if acked is not None and qos > 0:
+                MQTT_ACK_SECONDS.observe(acked - started)
+        MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - started)
         return result.rc == mqtt.MQTT_ERR_SUCCESS
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Optional cgroup v2 resource control for game server instances (linux only, man_use_cgroups).
+
+nice() only orders processes against each other within a cgroup, so an idle instance spinning on a bug still competes
+with live matches for cpu. With this enabled, the manager's cgroup is split into:
+    <manager cgroup>/manager        the manager itself
+    <manager cgroup>/instance-<id>  one per game server
+Each instance gets a cpu.weight depending on its game phase, and a memory.high limit, so the kernel protects live matches
+from idle instances. cpu usage (cpu.stat) and cpu pressure (cpu.pressure) are read back for the lag telemetry. No cpu.max
+limit is set, so cpu.stat's throttling counters stay at 0.
+
+The manager needs write access to its cgroup, e.g. a systemd service with Delegate=yes, or running as root.
+"""
+
+import os
+import traceback
+from cogs.misc.logger import get_logger
+from cogs.handlers.events import GamePhase
+
+LOGGER = get_logger()
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+MANAGER_CPU_WEIGHT = 500        # the manager relays every packet (proxy) and must not be starved by the instances
+ACTIVE_CPU_WEIGHT = 1000        # banning phase through to the end of the match
+LOBBY_CPU_WEIGHT = 100          # the kernel default
+IDLE_CPU_WEIGHT = 10            # no match on the server
+ACTIVE_GAME_PHASES = [GamePhase.BANNING_PHASE.value, GamePhase.PICKING_PHASE.value, GamePhase.LOADING_INTO_MATCH.value,
+                      GamePhase.PREPERATION_PHASE.value, GamePhase.MATCH_STARTED.value, GamePhase.GAME_ENDING.value, GamePhase.GAME_ENDED.value]
+
+
+class CgroupManager:
+    def __init__(self, root=CGROUP_ROOT):
+        self.root = root
+        self.base = None
+        self.available = None   # None until setup has been attempted
+
+    def setup(self):
+        """
+        Move the manager into its own leaf cgroup and enable the cpu and memory controllers for the instances.
+        Returns whether cgroup resource control is available. Only attempted once.
+        """
+        if self.available is not None:
+            return self.available
+        self.available = False
+        try:
+            if not os.path.exists(os.path.join(self.root, "cgroup.controllers")):
+                LOGGER.warn("cgroups - cgroup v2 is not mounted at /sys/fs/cgroup. Resource control is disabled.")
+                return False
+
+            with open("/proc/self/cgroup") as f:
+                own_path = next(line.strip().split("::", 1)[1] for line in f if line.startswith("0::"))
+            base = os.path.join(self.root, own_path.lstrip('/'))
+            if os.path.basename(base) == "manager":
+                # already moved, e.g. the manager was restarted inside the same service cgroup
+                base = os.path.dirname(base)
+
+            controllers = self.read(os.path.join(base, "cgroup.controllers")).split()
+            missing = [controller for controller in ("cpu", "memory") if controller not in controllers]
+            if missing:
+                LOGGER.warn(f"cgroups - the {', '.join(missing)} controller(s) are not delegated to {base}. Resource control is disabled.")
+                return False
+
+            # cgroup v2 only allows controllers to be enabled for children when the parent has no processes of its own
+            manager_group = os.path.join(base, "manager")
+            os.makedirs(manager_group, exist_ok=True)
+            for pid in self.read(os.path.join(base, "cgroup.procs")).split():
+                try:
+                    self.write(os.path.join(manager_group, "cgroup.procs"), pid)
+                except OSError:
+                    pass    # exited in the meantime
+            self.write(os.path.join(base, "cgroup.subtree_control"), "+cpu +memory")
+            self.write(os.path.join(manager_group, "cpu.weight"), MANAGER_CPU_WEIGHT)
+
+            self.base = base
+            self.available = True
+            LOGGER.info(f"cgroups - resource control enabled under {base}")
+        except (OSError, StopIteration):
+            LOGGER.warn(f"cgroups - unable to set up resource control. {traceback.format_exc()}")
+        return self.available
+
+    @staticmethod
+    def read(path):
+        with open(path) as f:
+            return f.read().strip()
+
+    @staticmethod
+    def write(path, value):
+        with open(path, "w") as f:
+            f.write(str(value))
+
+    def get_instance_path(self, instance_id):
+        return os.path.join(self.base, f"instance-{instance_id}")
+
+    def attach(self, instance_id, pid, memory_high_mb=None):
+        """Move a game server process into its instance cgroup. It starts at the idle weight."""
+        if not self.setup():
+            return False
+        path = self.get_instance_path(instance_id)
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.write(os.path.join(path, "memory.high"), int(memory_high_mb * 1024 * 1024) if memory_high_mb else "max")
+            self.write(os.path.join(path, "cpu.weight"), IDLE_CPU_WEIGHT)
+            self.write(os.path.join(path, "cgroup.procs"), pid)
+            return True
+        except OSError:
+            LOGGER.warn(f"GameServer #{instance_id} - unable to move process {pid} into its cgroup. {traceback.format_exc()}")
+            return False
+
+    def set_game_phase(self, instance_id, game_phase):
+        if game_phase in ACTIVE_GAME_PHASES:
+            weight = ACTIVE_CPU_WEIGHT
+        elif game_phase == GamePhase.IN_LOBBY.value:
+            weight = LOBBY_CPU_WEIGHT
+        else:
+            weight = IDLE_CPU_WEIGHT
+        return self.set_cpu_weight(instance_id, weight)
+
+    def set_cpu_weight(self, instance_id, weight):
+        if not self.available:
+            return False
+        path = self.get_instance_path(instance_id)
+        try:
+            self.write(os.path.join(path, "cpu.weight"), weight)
+            return True
+        except OSError:
+            return False
+
+    def get_cpu_stat(self, instance_id):
+        """
+        Returns:
+            dict: cpu.stat counters for the instance (usage_usec, nr_periods, nr_throttled, throttled_usec, ...)
+                and the cpu.pressure 'some' averages, or None if unavailable.
+        """
+        if not self.available:
+            return None
+        path = self.get_instance_path(instance_id)
+        try:
+            stat = {}
+            for line in self.read(os.path.join(path, "cpu.stat")).splitlines():
+                key, value = line.split()
+                stat[key] = int(value)
+            try:
+                some = self.read(os.path.join(path, "cpu.pressure")).splitlines()[0].split()[1:]
+                stat['pressure'] = {key: float(value) for key, value in (item.split('=') for item in some)}
+            except (OSError, IndexError, ValueError):
+                pass
+            stat['cpu_weight'] = int(self.read(os.path.join(path, "cpu.weight")))
+            return stat
+        except (OSError, ValueError):
+            return None
+
+    def release(self, instance_id):
+        """Remove an instance's cgroup. Only succeeds once its processes have exited."""
+        if not self.available:
+            return
+        try:
+            os.rmdir(self.get_instance_path(instance_id))
+        except OSError:
+            pass
+
+
+CGROUP_MANAGER = None
+
+def get_cgroup_manager():
+    global CGROUP_MANAGER
+    if CGROUP_MANAGER is None:
+        CGROUP_MANAGER = CgroupManager()
+    return CGROUP_MANAGER
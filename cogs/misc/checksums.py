@@ -0,0 +1,110 @@
+"""
+File checksums, computed off the event loop and cached.
+
+Files are read through mmap in large slices, and hashed with zlib.crc32 / hashlib, which release the GIL while they work.
+Results are cached against the file's (size, mtime_ns, inode), and the cache is saved to disk, so verifying an unchanged
+multi-hundred-MB binary again, even after a restart, only costs a stat().
+"""
+
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import threading
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from cogs.misc.logger import get_logger, get_home
+
+LOGGER = get_logger()
+HOME_PATH = get_home()
+
+SLICE_SIZE = 16 * 1024 * 1024   # bytes hashed per call, from the mapped file
+MAX_CACHE_ENTRIES = 2000
+
+
+class ChecksumService:
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or os.path.join(f"{HOME_PATH}", "config", "checksum_cache.json")
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="checksum")
+        self.cache = self.load_cache()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_cache(self):
+        try:
+            temp_file = f"{self.cache_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(temp_file, self.cache_file)
+        except OSError:
+            LOGGER.debug(f"Unable to save the checksum cache. {traceback.format_exc()}")
+
+    @staticmethod
+    def hash_file(file_path, algorithm, size):
+        crc = 0
+        hash_object = None if algorithm == 'crc32' else hashlib.new(algorithm)
+
+        if size:
+            with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, SLICE_SIZE):
+                        if hash_object is None:
+                            crc = zlib.crc32(view[offset:offset + SLICE_SIZE], crc)
+                        else:
+                            hash_object.update(view[offset:offset + SLICE_SIZE])
+                finally:
+                    view.release()
+
+        if hash_object is None:
+            return f"{crc:08x}"
+        return hash_object.hexdigest()
+
+    def compute(self, file_path, algorithm='crc32'):
+        """
+        Blocking. Returns the checksum of a file as a hex string, from the cache where the file hasn't changed.
+
+        Args:
+            algorithm (str): 'crc32', or any hashlib algorithm name, e.g. 'md5', 'sha256'
+        """
+        file_path = os.path.abspath(str(file_path))
+        stat = os.stat(file_path)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        key = f"{algorithm}:{file_path}"
+
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and cached['signature'] == signature:
+            return cached['digest']
+
+        digest = self.hash_file(file_path, algorithm, stat.st_size)
+
+        with self.lock:
+            self.cache[key] = {'signature': signature, 'digest': digest}
+            if len(self.cache) > MAX_CACHE_ENTRIES:
+                for stale_key in list(self.cache)[:len(self.cache) - MAX_CACHE_ENTRIES]:
+                    del self.cache[stale_key]
+            self.save_cache()
+        return digest
+
+    async def checksum(self, file_path, algorithm='crc32'):
+        """Non-blocking version of compute(), run in the service's worker threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.compute, file_path, algorithm)
+
+
+CHECKSUM_SERVICE = None
+
+def get_checksum_service():
+    global CHECKSUM_SERVICE
+    if CHECKSUM_SERVICE is None:
+        CHECKSUM_SERVICE = ChecksumService()
+    return CHECKSUM_SERVICE
@@ -0,0 +1,274 @@
+"""
+CPU topology aware placement of game server instances.
+
+The legacy placement (Misc.get_server_affinity) counts down from the highest logical cpu, and doesn't know which
+logical cpus are SMT siblings of the same physical core, or which cores share a last level cache (LLC) or NUMA node.
+On an SMT host this puts servers #1 and #2 on the two threads of one physical core while other cores sit idle.
+
+The planner here reads the topology from /sys/devices/system/cpu and:
+    - reserves whole physical cores (lowest cpu ids, where the OS and the manager live) instead of logical cpus
+    - hands out one thread of every physical core before using any SMT sibling
+    - walks the cores one LLC / NUMA node at a time, so consecutive instances, and instances sharing a core, share a cache
+
+Run this module directly to simulate placements over synthetic topologies:
+    python -m cogs.misc.cpu_topology
+"""
+
+import os
+import glob
+from cogs.misc.logger import get_logger
+
+LOGGER = get_logger()
+
+SYSFS_CPU_ROOT = "/sys/devices/system/cpu"
+
+
+class LogicalCpu:
+    __slots__ = ('cpu', 'core', 'llc', 'node')
+
+    def __init__(self, cpu, core, llc, node):
+        self.cpu = cpu      # logical cpu number, as used by cpu_affinity
+        self.core = core    # identifies the physical core. SMT siblings share this
+        self.llc = llc      # identifies the last level cache domain
+        self.node = node    # NUMA node
+
+    def __repr__(self):
+        return f"LogicalCpu(cpu={self.cpu}, core={self.core}, llc={self.llc}, node={self.node})"
+
+
+def parse_cpu_list(text):
+    """Parse the kernel's cpu list format, e.g. "0-3,8,10-11" """
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def read_sysfs(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def read_linux_topology(sysfs_root=SYSFS_CPU_ROOT):
+    """
+    Read the topology of the cpus this process may run on.
+
+    Returns:
+        list: LogicalCpu for each usable cpu, or None if the topology could not be read.
+    """
+    online = read_sysfs(f"{sysfs_root}/online")
+    if online is None:
+        return None
+    cpus = parse_cpu_list(online)
+    try:
+        # respect cgroup / taskset restrictions placed on the manager
+        allowed = os.sched_getaffinity(0)
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+    except (AttributeError, OSError):
+        pass
+
+    topology = []
+    for cpu in cpus:
+        base = f"{sysfs_root}/cpu{cpu}"
+        package = int(read_sysfs(f"{base}/topology/physical_package_id", 0))
+        siblings = parse_cpu_list(read_sysfs(f"{base}/topology/thread_siblings_list", str(cpu)))
+
+        llc_level = -1
+        llc_cpus = None
+        for index in glob.glob(f"{base}/cache/index*"):
+            if read_sysfs(f"{index}/type") == "Instruction":
+                continue
+            level = int(read_sysfs(f"{index}/level", 0))
+            shared = read_sysfs(f"{index}/shared_cpu_list")
+            if shared and level > llc_level:
+                llc_level = level
+                llc_cpus = parse_cpu_list(shared)
+
+        nodes = glob.glob(f"{base}/node[0-9]*")
+        node = int(os.path.basename(nodes[0])[4:]) if nodes else package
+
+        topology.append(LogicalCpu(
+            cpu=cpu,
+            core=(package, min(siblings)),
+            llc=(package, min(llc_cpus)) if llc_cpus else (package, 0),
+            node=node))
+    return topology or None
+
+
+def synthetic_topology(sockets=1, cores_per_socket=4, threads_per_core=1, llcs_per_socket=1):
+    """
+    Build a topology without reading the host. Logical cpus are numbered the way linux does on x86:
+    the first thread of every core first, then the SMT siblings. e.g. 4 cores / 8 threads: core 0 = cpus 0 and 4.
+    """
+    total_cores = sockets * cores_per_socket
+    cores_per_llc = max(1, cores_per_socket // llcs_per_socket)
+    topology = []
+    for thread in range(threads_per_core):
+        for socket in range(sockets):
+            for core in range(cores_per_socket):
+                core_number = socket * cores_per_socket + core
+                topology.append(LogicalCpu(
+                    cpu=thread * total_cores + core_number,
+                    core=(socket, core_number),
+                    llc=(socket, core // cores_per_llc),
+                    node=socket))
+    return topology
+
+
+class PlacementPlanner:
+    """
+    Maps game server instance ids to logical cpus.
+
+    svr_total_per_core keeps its existing meaning:
+        0.5     each server gets 2 logical cpus. A whole physical core (both SMT threads) where possible.
+        1       each server gets 1 logical cpu
+        2, 3    that many servers share 1 logical cpu
+    """
+    def __init__(self, topology, reserved_cpus=1):
+        self.topology = sorted(topology, key=lambda lcpu: lcpu.cpu)
+
+        cores = {}
+        for lcpu in self.topology:
+            cores.setdefault(lcpu.core, []).append(lcpu)
+
+        # reserve whole physical cores from the bottom, until at least reserved_cpus logical cpus are set aside
+        self.reserved = []
+        for core in sorted(cores, key=lambda core: cores[core][0].cpu):
+            if len(self.reserved) >= reserved_cpus:
+                break
+            self.reserved.extend(lcpu.cpu for lcpu in cores.pop(core))
+
+        # group the remaining cores into NUMA node / LLC domains. Highest cpus first, in keeping with the legacy placement.
+        domains = {}
+        for core, threads in cores.items():
+            domains.setdefault((threads[0].node, threads[0].llc), []).append(threads)
+        self.domains = sorted(domains.values(), key=lambda domain: -max(t.cpu for threads in domain for t in threads))
+        for domain in self.domains:
+            domain.sort(key=lambda threads: -threads[0].cpu)
+
+        self.slots = self.build_slots()
+        self.pairs = self.build_pairs()
+
+    def build_slots(self):
+        """One entry per logical cpu. The first thread of every core comes before any SMT sibling."""
+        slots = []
+        max_threads = max((len(threads) for domain in self.domains for threads in domain), default=0)
+        for thread_index in range(max_threads):
+            for domain in self.domains:
+                for threads in domain:
+                    if thread_index < len(threads):
+                        slots.append([threads[thread_index].cpu])
+        return slots
+
+    def build_pairs(self):
+        """Two logical cpus per entry, for servers given 2 cpus. Both threads of a core, else two cores in the same LLC."""
+        pairs = []
+        for domain in self.domains:
+            spare = []
+            for threads in domain:
+                cpus = [lcpu.cpu for lcpu in threads]
+                while len(cpus) >= 2:
+                    pairs.append(sorted(cpus[:2]))
+                    cpus = cpus[2:]
+                spare.extend(cpus)
+            while len(spare) >= 2:
+                pairs.append(sorted(spare[:2]))
+                spare = spare[2:]
+        return pairs
+
+    def get_capacity(self, svr_total_per_core):
+        if svr_total_per_core == 0.5:
+            return len(self.pairs)
+        return int(len(self.slots) * svr_total_per_core)
+
+    def get_affinity(self, server_id, svr_total_per_core):
+        """
+        Returns:
+            list: logical cpu numbers for the given server, or None if there are no cpus left to place servers on.
+        """
+        if svr_total_per_core == 0.5:
+            if not self.pairs:
+                return None
+            return list(self.pairs[(server_id - 1) % len(self.pairs)])
+        if not self.slots:
+            return None
+        return list(self.slots[((server_id - 1) // int(svr_total_per_core)) % len(self.slots)])
+
+    def plan(self, total_servers, svr_total_per_core):
+        return {server_id: self.get_affinity(server_id, svr_total_per_core) for server_id in range(1, total_servers + 1)}
+
+
+def check_plan(planner, topology, svr_total_per_core, total_servers=None):
+    """
+    Validate a plan against the placement rules.
+
+    Returns:
+        list: a description of each rule that was broken. Empty if the plan is good.
+    """
+    by_cpu = {lcpu.cpu: lcpu for lcpu in topology}
+    capacity = planner.get_capacity(svr_total_per_core)
+    total_servers = capacity if total_servers is None else total_servers
+    plan = planner.plan(total_servers, svr_total_per_core)
+    problems = []
+
+    used_cores = {}
+    for server_id, cpus in plan.items():
+        if cpus is None:
+            problems.append(f"server {server_id} has no cpus")
+            continue
+        for cpu in cpus:
+            if cpu in planner.reserved:
+                problems.append(f"server {server_id} placed on reserved cpu {cpu}")
+            used_cores.setdefault(by_cpu[cpu].core, set()).add(server_id)
+        if len({by_cpu[cpu].llc for cpu in cpus}) > 1:
+            problems.append(f"server {server_id} spans LLC domains: {cpus}")
+
+    free_cores = {lcpu.core for lcpu in topology if lcpu.cpu not in planner.reserved}
+    if svr_total_per_core == 1 and total_servers <= len(free_cores):
+        shared = {core: ids for core, ids in used_cores.items() if len(ids) > 1}
+        if shared:
+            problems.append(f"physical cores shared while others are idle: {shared}")
+    return problems
+
+
+def simulate():
+    scenarios = [
+        ("4c/4t", dict(cores_per_socket=4)),
+        ("4c/8t", dict(cores_per_socket=4, threads_per_core=2)),
+        ("8c/16t 2xCCX", dict(cores_per_socket=8, threads_per_core=2, llcs_per_socket=2)),
+        ("16c/32t 4xCCX", dict(cores_per_socket=16, threads_per_core=2, llcs_per_socket=4)),
+        ("2S 12c/24t", dict(sockets=2, cores_per_socket=6, threads_per_core=2)),
+    ]
+    failures = 0
+    for name, shape in scenarios:
+        topology = synthetic_topology(**shape)
+        for reserved in (1, 2, 4):
+            planner = PlacementPlanner(topology, reserved_cpus=reserved)
+            for svr_total_per_core in (0.5, 1, 2, 3):
+                problems = check_plan(planner, topology, svr_total_per_core)
+                status = "ok" if not problems else "FAILED"
+                failures += bool(problems)
+                print(f"{name:<16} reserved={reserved} per_core={svr_total_per_core:<4} capacity={planner.get_capacity(svr_total_per_core):<3} {status}")
+                for problem in problems:
+                    print(f"    {problem}")
+        example = PlacementPlanner(topology, reserved_cpus=1)
+        print(f"{name:<16} reserved cpus {example.reserved}, first servers at 1 per core: {example.plan(min(6, example.get_capacity(1)), 1)}")
+
+    host = read_linux_topology()
+    if host:
+        planner = PlacementPlanner(host, reserved_cpus=1)
+        print(f"this host: {len(host)} cpus, reserved {planner.reserved}, 1 per core: {planner.plan(planner.get_capacity(1), 1)}")
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if simulate() else 0)
@@ -1,5 +1,8 @@
 import subprocess as sp
 import sys
+import os
+import hashlib
+import sysconfig
 import traceback
 
 class PrepareDependencies:
@@ -15,6 +18,38 @@ class PrepareDependencies:
         else:
             minor_version = self.python_version[1]
             self.pip_requirements = home_path / f"py3.{minor_version}" / "requirements.txt"
+        self.requirements_hash_file = home_path / "config" / ".requirements_hash"
+
+    def get_requirements_hash(self):
+        """
+        Hash of everything that decides whether the installed packages satisfy requirements.txt:
+        the requirements themselves, the interpreter, and the state of site-packages (its mtime changes when packages are added or removed).
+        """
+        digest = hashlib.sha256()
+        with open(self.pip_requirements, 'rb') as f:
+            digest.update(f.read())
+        digest.update(sys.executable.encode())
+        for key in ('purelib', 'platlib'):
+            try:
+                digest.update(str(os.stat(sysconfig.get_paths()[key]).st_mtime_ns).encode())
+            except (KeyError, OSError):
+                pass
+        return digest.hexdigest()
+
+    def is_unchanged(self):
+        try:
+            with open(self.requirements_hash_file) as f:
+                return f.read().strip() == self.get_requirements_hash()
+        except OSError:
+            return False
+
+    def save_requirements_hash(self):
+        try:
+            os.makedirs(self.requirements_hash_file.parent, exist_ok=True)
+            with open(self.requirements_hash_file, 'w') as f:
+                f.write(self.get_requirements_hash())
+        except OSError as e:
+            print(f"Unable to save the requirements hash: {e}")
 
     def get_required_packages(self):
         try:
@@ -30,6 +65,11 @@ class PrepareDependencies:
 
     def update_dependencies(self):
         try:
+            # pip freeze takes a second or more. Skip it when nothing has changed since the last successful check
+            if self.is_unchanged():
+                print("Packages OK (requirements unchanged).")
+                return True
+
             required = self.get_required_packages()
             required = [pkg.replace('-', '_') for pkg in required]
             if len(required) == 0:
@@ -51,12 +91,14 @@ class PrepareDependencies:
                     result = sp.run([python_path, '-m', 'pip', 'install', *missing])
                 if result.returncode == 0:
                     print(f"SUCCESS, upgraded the following packages: {', '.join(missing)}")
+                    self.save_requirements_hash()
                     return result
                 else:
                     print(f"Error updating packages: {missing}\n error {result.stderr}")
                     return result
             else:
                 print("Packages OK.")
+                self.save_requirements_hash()
                 return True
         except Exception:
             print(traceback.format_exc())
@@ -0,0 +1,67 @@
+"""
+Event loop selection.
+
+The manager runs everything on one event loop: the game server listener, the chat / master server connections, the API
+server (uvicorn, in process) and every per instance task. The loop implementation is chosen with the man_event_loop
+configuration item, or --event-loop on the command line:
+    auto        uvloop on linux when it is installed, otherwise asyncio
+    uvloop      uvloop. Falls back to asyncio (with a warning) when it is not installed, or not supported on this platform
+    asyncio     the standard library loop. A selector loop on windows
+
+The asyncio loop is made re-entrant with nest_asyncio, as it always has been. uvloop can't be patched, so under uvloop a
+nested asyncio.run() raises. Blocking helpers that may be called from the event loop must not rely on it
+(see PublicIPResolver.resolve_blocking).
+
+Must be called in the main thread, before anything asyncio is created.
+"""
+
+import asyncio
+import sys
+import json
+
+EVENT_LOOP_CHOICES = ['auto', 'uvloop', 'asyncio']
+
+
+def get_configured_event_loop(config_file):
+    """
+    The man_event_loop configuration item, read straight from the configuration file, as the loop is created before
+    the configuration is loaded and validated.
+    """
+    try:
+        with open(config_file) as f:
+            choice = json.load(f)['hon_data'].get('man_event_loop', 'auto')
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return 'auto'
+    return choice if choice in EVENT_LOOP_CHOICES else 'auto'
+
+
+def create_event_loop(choice='auto'):
+    """
+    Create the manager's event loop, and set it as the current event loop.
+
+    Returns:
+        tuple: (loop, description of the loop in use, warning or None)
+    """
+    warning = None
+    if choice in ('auto', 'uvloop'):
+        if sys.platform == "win32":
+            if choice == 'uvloop':
+                warning = "uvloop is not supported on windows. Using the asyncio event loop."
+        else:
+            try:
+                import uvloop
+                loop = uvloop.new_event_loop()
+                asyncio.set_event_loop(loop)
+                return loop, f"uvloop {uvloop.__version__}", None
+            except ImportError:
+                if choice == 'uvloop':
+                    warning = "uvloop is not installed. Using the asyncio event loop. Install it with 'pip install uvloop'."
+
+    import nest_asyncio
+    if sys.platform == "win32":
+        loop = asyncio.SelectorEventLoop()
+    else:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    nest_asyncio.apply(loop)
+    return loop, f"asyncio ({type(loop).__name__}, re-entrant)", warning
@@ -3,6 +3,9 @@ import logging
 import os
 import logging.config
 import json
+import atexit
+import copy
+import queue
 from prompt_toolkit.shortcuts import print_formatted_text
 
 
@@ -71,11 +74,45 @@ class PromptToolkitLogHandler(logging.Handler):
         msg = self.format(record)
         print_formatted_text(msg)
 
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log shippers. To use it, add the formatter to config/logging.json and point a handler at it:
+        "formatters": {"json": {"()": "cogs.misc.logger.JsonFormatter"}}
+        "handlers": {"file": {..., "formatter": "json"}}
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': logging.getLevelName(record.levelno),
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread. Formatting is left to the writer thread's handlers, so the calling thread
+    (normally the event loop) only merges the message arguments, so later changes to them can't alter the message.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 FILEBEAT_AUTH_TOKEN = None
 FILEBEAT_AUTH_URL = None
 MQTT = None
 DISCORD_USERNAME = None
 ROLES_DATABASE = None
+LOG_LISTENER = None
 
 # Get the path of the current script
 def get_script_dir(file):
@@ -104,12 +141,12 @@ def set_discord_username(username):
 def get_discord_username():
     return DISCORD_USERNAME
 
-def set_logger():
+def set_logger(log_file_name='server.log'):
     global HOME_PATH
 
     # Define the logging directory (in this case, a subdirectory called 'logs')
     log_dir = os.path.join(HOME_PATH, 'logs')
-    log_file = os.path.join(log_dir, 'server.log')
+    log_file = os.path.join(log_dir, log_file_name)
 
     # Create the logging directory if it doesn't already exist
     if not os.path.exists(log_dir):
@@ -129,6 +166,8 @@ def set_logger():
         logger = logging.getLogger('Server')
         # Set appropriate formatters for each handler
         for handler in logger.handlers:
+            if isinstance(handler.formatter, JsonFormatter):
+                continue
             if isinstance(handler, logging.StreamHandler) and handler.name == 'console':
                 handler.setFormatter(ColorFormatter())
             elif isinstance(handler, logging.FileHandler):
@@ -151,6 +190,40 @@ def set_logger():
 
         logger.propagate = False
 
+    start_log_listener(logger)
+
+
+def start_log_listener(logger):
+    """
+    Move the logger's handlers onto a writer thread. Logging calls then only put the record on a queue, so
+    disk and console writes never stall the event loop.
+    Unless configured, the logger's own level is set to the lowest handler level, so messages no handler would write
+    are dropped at the logging call, before a record is even created.
+    """
+    global LOG_LISTENER
+    stop_logger()
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+    if not handlers:
+        return
+    if logger.level == logging.NOTSET:
+        logger.setLevel(min(handler.level or logging.DEBUG for handler in handlers))
+
+    log_queue = queue.SimpleQueue()
+    LOG_LISTENER = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(LogQueueHandler(log_queue))
+    LOG_LISTENER.start()
+    atexit.register(stop_logger)
+
+
+def stop_logger():
+    """Write out everything still queued, and stop the writer thread. Logging calls made afterwards are queued, but not written."""
+    global LOG_LISTENER
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
 
 def get_logger():
     global logger
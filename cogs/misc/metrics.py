@@ -0,0 +1,174 @@
+"""
+Counters, gauges and histograms for the /metrics endpoint, in the Prometheus text exposition format.
+
+Recording a value is a dict lookup and an addition, with no locks. Every series is only written from one thread:
+the event loop, except the autoping counter (the autoping listener thread) and the MQTT acknowledgement metrics (the
+MQTT network thread). The GIL makes each single write safe to read from the event loop when the metrics are scraped.
+"""
+
+import bisect
+import math
+
+
+class Series:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramSeries:
+    __slots__ = ('upper_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)     # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.series = {}
+        if not self.label_names:
+            self.labels()   # export unlabelled metrics from the start, rather than from their first update
+        REGISTRY.append(self)
+
+    def new_series(self):
+        return Series()
+
+    def labels(self, *values):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = self.new_series()
+        return series
+
+    def remove(self, *values):
+        self.series.pop(values, None)
+
+    @staticmethod
+    def format_value(value):
+        if value == math.inf:
+            return "+Inf"
+        return repr(float(value))
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def format_labels(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{self.escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in list(self.series.items()):
+            lines.append(f"{self.name}{self.format_labels(values)} {self.format_value(series.value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), function=None):
+        """
+        Args:
+            function (callable): optional. If given, the gauge's value is read from it when scraped.
+        """
+        super().__init__(name, description, labels)
+        self.function = function
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, description, labels)
+
+    def new_series(self):
+        return HistogramSeries(self.upper_bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in list(self.series.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.upper_bounds + (math.inf,), list(series.counts)):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self.format_labels(values, [('le', self.format_value(upper_bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(values)} {self.format_value(series.sum)}")
+            lines.append(f"{self.name}_count{self.format_labels(values)} {series.count}")
+        return lines
+
+
+REGISTRY = []
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+PACKET_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.025)
+
+GAMESERVER_PACKETS = Counter("honfigurator_gameserver_packets_total", "Packets received from game servers, by packet type.", ["packet_type"])
+GAMESERVER_PACKET_PARSE_SECONDS = Histogram("honfigurator_gameserver_packet_parse_seconds", "Time spent handling a game server packet, by packet type.", ["packet_type"], buckets=PACKET_BUCKETS)
+SHARD_CONNECTIONS = Gauge("honfigurator_shard_connections", "Game server connections read by each connection shard (man_shards).", ["shard"])
+SHARD_PACKETS_COALESCED = Counter("honfigurator_shard_packets_coalesced_total", "Unchanged status packets a connection shard did not forward to the manager.", ["shard"])
+EVENTS = Counter("honfigurator_events_total", "Events emitted on the manager's event bus, by event type.", ["event_type"])
+EVENT_BUS_PENDING_TASKS = Gauge("honfigurator_event_bus_pending_tasks", "Event bus callbacks scheduled, but not yet finished.")
+EVENT_LOOP_LAG_SECONDS = Histogram("honfigurator_event_loop_lag_seconds", "How late the event loop ran a timer that should have fired immediately.", buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+MQTT_PUBLISH_SECONDS = Histogram("honfigurator_mqtt_publish_seconds", "Time the caller spent in MQTTHandler.publish_json.", buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+MQTT_ACK_SECONDS = Histogram("honfigurator_mqtt_ack_seconds", "Time from publishing an MQTT message to the broker acknowledging it.", buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+MQTT_IN_FLIGHT = Gauge("honfigurator_mqtt_in_flight_messages", "MQTT messages published, and not yet acknowledged by the broker.")
+INSTANCE_START_SECONDS = Histogram("honfigurator_instance_start_seconds", "Seconds from a game server start being queued to reaching each startup phase.", ["phase"], buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+AUTOPING_REQUESTS = Counter("honfigurator_autoping_requests_total", "Datagrams received by the autoping responder.")
+SKIPPED_FRAMES_MILLISECONDS = Counter("honfigurator_skipped_frames_milliseconds_total", "Server frame time skipped during matches, by game server instance.", ["instance"])
+LONG_FRAMES = Counter("honfigurator_long_frames_total", "Long frame (skipped frames) reports received during matches, by game server instance.", ["instance"])
+
@@ -0,0 +1,231 @@
+"""
+Public IPv4 lookup.
+
+Every provider (HTTP "what is my IP" services, and STUN servers) is asked at once, and the first address reported by
+QUORUM of them is used, so a dead or slow provider costs nothing. Where fewer providers answer, the best answer available
+is used, and where none do, a globally routable address on a local interface (a host that isn't behind NAT) is used.
+Results are cached for CACHE_TTL seconds.
+"""
+
+import asyncio
+import ipaddress
+import os
+import socket
+import struct
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import psutil
+from cogs.misc.logger import get_logger
+
+LOGGER = get_logger()
+
+HTTP_PROVIDERS = ['https://4.ident.me', 'https://api.ipify.org', 'https://ifconfig.me/ip', 'https://myexternalip.com/raw', 'https://wtfismyip.com/text', 'http://4.ident.me', 'http://api.ipify.org']
+STUN_SERVERS = [('stun.l.google.com', 19302), ('stun.cloudflare.com', 3478)]
+QUORUM = 2                  # providers that must agree on the address before it is used without waiting for the rest
+LOOKUP_TIMEOUT = 5          # seconds, for the whole lookup
+CACHE_TTL = 300             # seconds a looked up address is reused for
+
+STUN_BINDING_REQUEST = 0x0001
+STUN_BINDING_RESPONSE = 0x0101
+STUN_MAGIC_COOKIE = 0x2112A442
+STUN_MAPPED_ADDRESS = 0x0001
+STUN_XOR_MAPPED_ADDRESS = 0x0020
+
+
+class StunProtocol(asyncio.DatagramProtocol):
+    def __init__(self, transaction_id):
+        self.transaction_id = transaction_id
+        self.response = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.response.done() and data[8:20] == self.transaction_id:
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+def parse_stun_response(data, transaction_id):
+    """
+    Returns:
+        str: the IPv4 address from a STUN binding response, or None.
+    """
+    if len(data) < 20:
+        return None
+    message_type, length, cookie = struct.unpack("!HHI", data[:8])
+    if message_type != STUN_BINDING_RESPONSE or cookie != STUN_MAGIC_COOKIE or data[8:20] != transaction_id:
+        return None
+    offset = 20
+    while offset + 4 <= min(len(data), 20 + length):
+        attribute_type, attribute_length = struct.unpack("!HH", data[offset:offset + 4])
+        value = data[offset + 4:offset + 4 + attribute_length]
+        if attribute_type in (STUN_XOR_MAPPED_ADDRESS, STUN_MAPPED_ADDRESS) and len(value) >= 8 and value[1] == 0x01:
+            address = struct.unpack("!I", value[4:8])[0]
+            if attribute_type == STUN_XOR_MAPPED_ADDRESS:
+                address ^= STUN_MAGIC_COOKIE
+            return str(ipaddress.IPv4Address(address))
+        # attributes are padded to 4 bytes
+        offset += 4 + attribute_length + (-attribute_length % 4)
+    return None
+
+
+class PublicIPResolver:
+    def __init__(self, http_providers=HTTP_PROVIDERS, stun_servers=STUN_SERVERS, quorum=QUORUM, cache_ttl=CACHE_TTL):
+        self.http_providers = http_providers
+        self.stun_servers = stun_servers
+        self.quorum = quorum
+        self.cache_ttl = cache_ttl
+        self.cached_ip = None
+        self.cached_at = 0
+        self.session = None
+        self.session_loop = None
+        self.last_answers = {}
+
+    def get_session(self):
+        """One session, and connection pool, shared by every lookup on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            connector = aiohttp.TCPConnector(family=socket.AF_INET, limit_per_host=1)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=LOOKUP_TIMEOUT))
+            self.session_loop = loop
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def validate(ip_str):
+        ip = ipaddress.ip_address(ip_str.strip())
+        if ip.version != 4:
+            raise ValueError(f"{ip} is not an IPv4 address")
+        return str(ip)
+
+    async def ask_http(self, session, provider):
+        async with session.get(provider) as response:
+            response.raise_for_status()
+            return self.validate(await response.text())
+
+    async def ask_stun(self, host, port):
+        loop = asyncio.get_running_loop()
+        transaction_id = os.urandom(12)
+        transport, protocol = await loop.create_datagram_endpoint(lambda: StunProtocol(transaction_id), remote_addr=(host, port), family=socket.AF_INET)
+        try:
+            request = struct.pack("!HHI", STUN_BINDING_REQUEST, 0, STUN_MAGIC_COOKIE) + transaction_id
+            # UDP, so resend in case the request or response is dropped
+            for _ in range(3):
+                transport.sendto(request)
+                try:
+                    data = await asyncio.wait_for(asyncio.shield(protocol.response), timeout=1)
+                    break
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                raise asyncio.TimeoutError
+        finally:
+            transport.close()
+        ip = parse_stun_response(data, transaction_id)
+        if ip is None:
+            raise ValueError("no IPv4 mapped address in the STUN response")
+        return self.validate(ip)
+
+    @staticmethod
+    def get_interface_ip():
+        """A globally routable IPv4 address on a local interface, if the host has one (i.e. it isn't behind NAT)."""
+        for addresses in psutil.net_if_addrs().values():
+            for address in addresses:
+                if address.family == socket.AF_INET and ipaddress.ip_address(address.address).is_global:
+                    return address.address
+        return None
+
+    async def lookup(self):
+        """Ask every provider at once. Returns as soon as QUORUM of them agree."""
+        session = self.get_session()
+        tasks = {asyncio.create_task(self.ask_http(session, provider)): provider for provider in self.http_providers}
+        tasks.update({asyncio.create_task(self.ask_stun(host, port)): f"stun:{host}:{port}" for host, port in self.stun_servers})
+
+        votes = Counter()
+        answers = {}
+        pending = set(tasks)
+        deadline = time.monotonic() + LOOKUP_TIMEOUT
+        try:
+            while pending and time.monotonic() < deadline:
+                done, pending = await asyncio.wait(pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        votes[task.result()] += 1
+                if votes and votes.most_common(1)[0][1] >= self.quorum:
+                    break
+        finally:
+            for task, provider in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    answers[provider] = "no answer in time"
+                elif task.exception() is not None:
+                    answers[provider] = repr(task.exception())
+                else:
+                    answers[provider] = task.result()
+            self.last_answers = answers
+
+        if votes:
+            ip, count = votes.most_common(1)[0]
+            if count < self.quorum:
+                LOGGER.debug(f"Public IP {ip} is only confirmed by {count} provider(s). Answers: {answers}")
+            if len(votes) > 1:
+                LOGGER.warn(f"Public IP providers disagree. Using {ip}. Answers: {answers}")
+            return ip
+        return self.get_interface_ip()
+
+    async def resolve(self, max_age=None):
+        """
+        Args:
+            max_age (int): seconds a cached address may be reused for. Defaults to the cache TTL. 0 forces a new lookup.
+
+        Returns:
+            str: the public IPv4 address, or None if it could not be determined.
+        """
+        max_age = self.cache_ttl if max_age is None else max_age
+        if self.cached_ip and time.monotonic() - self.cached_at < max_age:
+            return self.cached_ip
+        try:
+            ip = await self.lookup()
+        except Exception:
+            LOGGER.error(f"Public IP lookup failed. {traceback.format_exc()}")
+            ip = None
+        if ip:
+            self.cached_ip = ip
+            self.cached_at = time.monotonic()
+        else:
+            LOGGER.critical(f"Tried all public IP providers and could not determine public IP address. This will most likely cause issues. Answers: {self.last_answers}")
+        return ip
+
+    def resolve_blocking(self, max_age=None):
+        """
+        For callers outside the event loop, such as the startup phases. Runs the lookup on a private event loop.
+        When called from the event loop thread, the private loop runs in a worker thread, as uvloop can't nest event loops.
+        """
+        async def resolve_and_close():
+            try:
+                return await self.resolve(max_age)
+            finally:
+                await self.close()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(resolve_and_close())
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, resolve_and_close()).result()
+
+
+PUBLIC_IP_RESOLVER = None
+
+def get_public_ip_resolver():
+    global PUBLIC_IP_RESOLVER
+    if PUBLIC_IP_RESOLVER is None:
+        PUBLIC_IP_RESOLVER = PublicIPResolver()
+    return PUBLIC_IP_RESOLVER
@@ -12,6 +12,7 @@ from cogs.misc.logger import get_logger, get_home, get_misc, get_discord_usernam
 from utilities.filebeat import get_discord_user_id_from_api
 from cogs.db.roles_db_connector import RolesDatabase
 from cogs.misc.hide_pass import getpass
+from cogs.misc.event_loop import EVENT_LOOP_CHOICES
 
 ALLOWED_REGIONS = ["AU", "BR", "EU", "RU",
                    "SEA", "TH", "USE", "USW", "NEWERTH", "TEST"]
@@ -35,8 +36,8 @@ class SetupEnvironment:
         self.OTHER_CONFIG_EXCLUSIONS = ["svr_ip", "svr_version", "hon_executable",
                                         'architecture', 'hon_executable_name', 'autoping_responder_port']
         self.WINDOWS_SPECIFIC_CONFIG_ITEMS = [
-            'svr_noConsole', 'svr_override_affinity', 'man_enableProxy']
-        self.LINUX_SPECIFIC_CONFIG_ITEMS = ['man_use_cowmaster']
+            'svr_noConsole', 'svr_override_affinity']
+        self.LINUX_SPECIFIC_CONFIG_ITEMS = ['man_use_cowmaster', 'man_cowmaster_warm_pool', 'man_use_cgroups', 'man_cgroup_memory_high_mb']
         self.config_file_hon = config_file_hon
         self.config_file_logging = HOME_PATH / "config" / "logging.json"
         self.default_configuration = self.get_default_hon_configuration()
@@ -55,6 +56,9 @@ class SetupEnvironment:
                 },
                 "simple": {
                     "format": "%(asctime)s - %(levelname)s - %(message)s"
+                },
+                "json": {
+                    "()": "cogs.misc.logger.JsonFormatter"
                 }
             },
             "handlers": {
@@ -107,12 +111,24 @@ class SetupEnvironment:
                 "svr_start_on_launch": True,
                 "svr_override_affinity": False,
                 "svr_max_start_at_once": 5,
+                "man_adaptive_start": True,
                 "svr_starting_gamePort": 10001,
                 "svr_starting_voicePort": 10061,
                 "svr_managerPort": 1134,
                 "svr_startup_timeout": 180,
                 "svr_api_port": 5000,
                 "man_use_cowmaster": False,
+                "man_cowmaster_warm_pool": 0,
+                "man_use_cgroups": False,
+                "man_autoscale": False,
+                "man_autoscale_free_buffer": 2,
+                "man_rolling_restart_floor": 2,
+                "man_blue_green_patching": False,
+                "man_cgroup_memory_high_mb": 1536,
+                "man_event_loop": "auto",
+                "man_api_process": False,
+                "man_metrics_public": False,
+                "man_shards": 0,
                 "svr_restart_between_games": False,
                 "svr_beta_mode": False,
             },
@@ -410,6 +426,14 @@ class SetupEnvironment:
                             self.hon_data['svr_total']
                         minor_issues.append(
                             f"Resolved: Starting voice port reassigned to {self.hon_data[key]}. Must be at least {self.hon_data['svr_total']} (svr_total) higher than the starting game port.")
+                elif key == "man_event_loop" and new_value not in EVENT_LOOP_CHOICES:
+                    self.hon_data[key] = "auto"
+                    minor_issues.append(
+                        f"Resolved: man_event_loop reset to auto. Must be one of {', '.join(EVENT_LOOP_CHOICES)}.")
+                elif key == "man_shards" and new_value < 0:
+                    self.hon_data[key] = 0
+                    minor_issues.append(
+                        "Resolved: man_shards reset to 0 (off). Must be 0 or more.")
                 elif key == "svr_location" and new_value not in ALLOWED_REGIONS:
                     major_issues.append(
                         f"Incorrect region. Can only be one of {(',').join(ALLOWED_REGIONS)}")
@@ -0,0 +1,103 @@
+"""
+Runs the manager's launch steps as a dependency graph, rather than one after the other.
+
+Each phase declares the phases it needs. Phases run in a thread pool as soon as those have finished, so the independent,
+mostly I/O bound steps (git fetch, the public IP lookup, git describe, importing the API stack) overlap.
+The start / end of every phase is recorded, and printed as a timeline with --profile-startup.
+
+This module runs before the python dependencies have been checked, so it must only use the standard library.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class StartupPhaseError(Exception):
+    """A startup phase raised an exception. The original exception is chained."""
+
+
+class StartupGraph:
+    def __init__(self, max_workers=6):
+        self.max_workers = max_workers
+        self.phases = {}        # name -> (function, names of the phases it runs after)
+        self.timeline = []      # dicts of name, start, end, thread, after, error. Times are seconds since the graph was created
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, name, function, after=()):
+        """
+        Args:
+            function (callable): takes no arguments. Its return value is discarded.
+            after (iterable): names of the phases that must complete before this one starts.
+        """
+        for dependency in after:
+            if dependency not in self.phases:
+                raise ValueError(f"Startup phase '{name}' runs after '{dependency}', which hasn't been added yet.")
+        self.phases[name] = (function, tuple(after))
+
+    def run_phase(self, name, function, after=()):
+        start = time.perf_counter() - self.origin
+        error = None
+        try:
+            return function()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self.lock:
+                self.timeline.append({
+                    'name': name,
+                    'start': start,
+                    'end': time.perf_counter() - self.origin,
+                    'thread': threading.current_thread().name,
+                    'after': after,
+                    'error': None if error is None else f"{type(error).__name__}: {error}"
+                })
+
+    def run(self):
+        """
+        Run every phase that has been added, and wait for them to finish. Blocking.
+
+        Raises:
+            StartupPhaseError: as soon as any phase fails. Phases already running are allowed to finish, no further phases are started.
+        """
+        completed = set()
+        running = {}
+        remaining = dict(self.phases)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="startup") as executor:
+            while remaining or running:
+                for name, (function, after) in list(remaining.items()):
+                    if all(dependency in completed for dependency in after):
+                        running[executor.submit(self.run_phase, name, function, after)] = name
+                        del remaining[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        raise StartupPhaseError(f"Startup phase '{name}' failed") from future.exception()
+                    completed.add(name)
+        self.phases = {}
+
+    def format_timeline(self, width=50):
+        if not self.timeline:
+            return "No startup phases have run."
+        timeline = sorted(self.timeline, key=lambda phase: phase['start'])
+        total = max(phase['end'] for phase in timeline)
+        scale = width / total if total else 0
+        name_width = max(len(phase['name']) for phase in timeline)
+        lines = [f"Startup timeline ({total * 1000:.0f} ms total)", f"  {'phase':<{name_width}}  {'start':>10}  {'duration':>10}"]
+        for phase in timeline:
+            offset = int(phase['start'] * scale)
+            length = max(1, int((phase['end'] - phase['start']) * scale))
+            bar = " " * offset + "#" * length
+            line = f"  {phase['name']:<{name_width}}  {phase['start'] * 1000:>7.0f} ms  {(phase['end'] - phase['start']) * 1000:>7.0f} ms  |{bar:<{width}}|"
+            if phase['after']:
+                line += f"  after {', '.join(phase['after'])}"
+            if phase['error']:
+                line += f"  FAILED ({phase['error']})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def print_timeline(self):
+        print(self.format_timeline())
@@ -1,21 +1,20 @@
 import subprocess, psutil
 import os
-import hashlib
-import crcmod
+import json
+import platform
 import zipfile
-import binascii
 from os.path import exists
 from pathlib import Path
 import sys
 from cpuinfo import get_cpu_info
-import requests
-import aiohttp
-from cogs.misc.logger import get_logger, get_home
+from cogs.misc.logger import get_logger, get_home, stop_logger
 from cogs.misc.exceptions import HoNUnexpectedVersionError, HoNCompatibilityError
-import ipaddress
-import asyncio
+from cogs.misc.cpu_topology import PlacementPlanner, read_linux_topology
+from cogs.misc.checksums import get_checksum_service
+from cogs.misc.public_ip import get_public_ip_resolver
 import schedule
 import time
+import traceback
 
 
 LOGGER = get_logger()
@@ -24,18 +23,69 @@ HOME_PATH = get_home()
 class Misc:
     def __init__(self):
         self.cpu_count = psutil.cpu_count(logical=True)
-        self.cpu_name = get_cpu_info().get('brand_raw', 'Unknown CPU')
+        self.cpu_name = None
         self.total_ram = psutil.virtual_memory().total
         self.os_platform = sys.platform
         self.total_allowed_servers = None
-        self.github_branch_all = self.get_all_branch_names()
-        self.github_branch = self.get_current_branch_name()
-        self.public_ip = self.lookup_public_ip()
+        self.placement_planner = None
+        # the below are filled in by the startup phases (see get_startup_phases), or looked up on first use
+        self.github_branch_all = None
+        self.github_branch = None
+        self.public_ip = None
         self.tag = None
-        self.tag = self.get_github_tag()
         schedule.every(10).minutes.do(self.check_github_tag)
         self.hon_version = None
 
+    def get_startup_phases(self):
+        """
+        The slow lookups needed at launch, for the startup graph in main.py. None of them depend on each other,
+        other than the branch list, which reads the refs updated by 'git fetch'.
+
+        Returns:
+            list: (name, function, names of the phases it runs after)
+        """
+        return [
+            ('cpu_info', self.load_cpu_name, ()),
+            ('git_fetch', self.fetch_github_remote, ()),
+            ('git_branches', self.load_github_branches, ('git_fetch',)),
+            ('git_tag', self.load_github_tag, ()),
+            ('public_ip', self.lookup_public_ip, ())
+        ]
+
+    def load_cpu_name(self):
+        """
+        cpuinfo takes around a second, as it starts a subprocess to probe the CPU. Its result is cached on disk,
+        against the hostname, architecture, processor and core count, so it only runs again when the hardware changes.
+        """
+        if self.get_os_platform() == "linux":
+            self.cpu_name = self.get_cpu_name()
+            return self.cpu_name
+        cache_file = HOME_PATH / "config" / "cpu_info.json"
+        key = f"{platform.node()}|{platform.machine()}|{platform.processor()}|{self.cpu_count}"
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                self.cpu_name = cached['brand_raw']
+                return self.cpu_name
+        except (OSError, ValueError, KeyError):
+            pass
+        self.cpu_name = get_cpu_info().get('brand_raw', 'Unknown CPU')
+        try:
+            os.makedirs(cache_file.parent, exist_ok=True)
+            with open(cache_file, 'w') as f:
+                json.dump({'key': key, 'brand_raw': self.cpu_name}, f)
+        except OSError:
+            LOGGER.debug(f"Unable to cache the CPU details. {traceback.format_exc()}")
+        return self.cpu_name
+
+    def load_github_branches(self):
+        self.github_branch_all = self.get_all_branch_names(fetch=False)
+        self.github_branch = self.get_current_branch_name()
+
+    def load_github_tag(self):
+        self.tag = self.get_github_tag()
+
     def build_commandline_args(self, config_local, config_global, cowmaster=False):
 
         # remove host_affinity if override is enabled, which is used by the game to manage it's affinity. Instead, lets the code handle affinity assignment
@@ -126,6 +176,43 @@ class Misc:
                 return psutil.Process(connection.pid)
         return None
 
+    def get_port_pid_map(self, protocol='udp'):
+        """
+        Read the socket table once, and map every bound local port to the pid that owns it.
+        Much cheaper than calling get_process_by_port once per port when checking many servers.
+
+        Returns:
+            dict: {port: pid}
+        """
+        port_map = {}
+        for connection in psutil.net_connections(kind=protocol):
+            if connection.pid is not None:
+                port_map.setdefault(connection.laddr.port, connection.pid)
+        return port_map
+
+    def get_memory_rollup(self, pid):
+        """
+        Linux only. Read /proc/<pid>/smaps_rollup, which summarises the memory mappings of a process.
+
+        Rss counts every resident page, Pss divides shared pages between the processes sharing them,
+        so Rss - Pss is the memory saved by sharing (e.g. instances forked from the cowmaster).
+
+        Returns:
+            dict: {field: bytes} e.g. {'Rss': .., 'Pss': .., 'Shared_Clean': .., 'Private_Dirty': ..}, or None if unavailable.
+        """
+        if self.get_os_platform() != "linux":
+            return None
+        rollup = {}
+        try:
+            with open(f"/proc/{pid}/smaps_rollup", 'r') as smaps:
+                for line in smaps:
+                    parts = line.split()
+                    if len(parts) == 3 and parts[2] == "kB":
+                        rollup[parts[0].rstrip(':')] = int(parts[1]) * 1024
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return None
+        return rollup
+
     def get_client_pid_by_tcp_source_port(self, local_server_port, client_source_port):
         """
         Get the Process object of a local client based on its source port and the server port it's connecting to.
@@ -163,7 +250,7 @@ class Misc:
 
     def get_cpu_name(self):
         if self.get_os_platform() == "win32":
-            return self.cpu_name
+            return self.cpu_name or self.load_cpu_name()
         elif self.get_os_platform() == "linux":
             # Linux uses the /proc/cpuinfo file
             with open('/proc/cpuinfo') as f:
@@ -204,7 +291,26 @@ class Misc:
         elif self.cpu_count >12:
             return 4
 
+    def get_placement_planner(self):
+        """
+            Topology aware placement is used on linux, where the cpu topology can be read from sysfs.
+            Returns None elsewhere, and the simple arithmetic placement is used.
+        """
+        if self.placement_planner is None:
+            self.placement_planner = False
+            if self.get_os_platform() == "linux":
+                try:
+                    topology = read_linux_topology()
+                    if topology:
+                        self.placement_planner = PlacementPlanner(topology, reserved_cpus=self.get_num_reserved_cpus())
+                except Exception:
+                    LOGGER.warn(f"Unable to read the CPU topology, using the default server placement. {traceback.format_exc()}")
+        return self.placement_planner or None
+
     def get_total_allowed_servers(self,svr_total_per_core):
+        planner = self.get_placement_planner()
+        if planner:
+            return planner.get_capacity(svr_total_per_core)
         total = svr_total_per_core * self.cpu_count
         if self.cpu_count < 5:
             total -= 1
@@ -221,6 +327,12 @@ class Misc:
         if svr_total_per_core > 3 or svr_total_per_core < 0.5 or (svr_total_per_core != 0.5 and svr_total_per_core != int(svr_total_per_core)):
             raise Exception("Value must be 0.5, 1, 2, or 3.")
 
+        planner = self.get_placement_planner()
+        if planner:
+            cpus = planner.get_affinity(server_id, svr_total_per_core)
+            if cpus:
+                return [str(cpu) for cpu in cpus]
+
         if svr_total_per_core == 0.5:
             cores_per_server = 2
             starting_core = (self.cpu_count) - (server_id * cores_per_server) % self.cpu_count
@@ -243,39 +355,19 @@ class Misc:
         return self.lookup_public_ip()
 
     def lookup_public_ip(self):
-        try:
-            self.public_ip = requests.get('https://4.ident.me').text
-        except Exception:
-            try:
-                self.public_ip = requests.get('http://api.ipify.org').text
-            except Exception:
-                LOGGER.error("Failed to fetch public IP")
-                self.public_ip = None
+        """Blocking. Used by the startup phases, before the event loop is running."""
+        self.public_ip = get_public_ip_resolver().resolve_blocking()
         return self.public_ip
 
-    async def lookup_public_ip_async(self):
-        providers = ['http://4.ident.me','https://4.ident.me', 'http://api.ipify.org/', 'https://api.ipify.org', 'https://ifconfig.me','https://myexternalip.com/raw','https://wtfismyip.com/text']
-        timeout = aiohttp.ClientTimeout(total=5)  # Set the timeout for the request in seconds
-
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            for provider in providers:
-                try:
-                    async with session.get(provider) as response:
-                        if response.status == 200:
-                            ip_str = await response.text()
-                            try:
-                                # Try to construct an IP address object. If it fails, this is not a valid IP.
-                                ipaddress.ip_address(ip_str)
-                                return ip_str
-                            except ValueError:
-                                LOGGER.warn(f"Invalid IP received from {provider}. Trying another provider...")
-                except asyncio.TimeoutError:
-                    LOGGER.warn(f"Timeout when trying to fetch IP from {provider}. Trying another provider...")
-                    continue
-                except Exception as e:
-                    LOGGER.warn(f"Error occurred when trying to fetch IP from {provider}: {e}")
-                    continue
-            LOGGER.critical("Tried all public IP providers and could not determine public IP address. This will most likely cause issues.")
+    async def lookup_public_ip_async(self, max_age=None):
+        """
+        Args:
+            max_age (int): seconds a previously looked up address may be reused for. Defaults to the resolver's cache TTL.
+        """
+        public_ip = await get_public_ip_resolver().resolve(max_age)
+        if public_ip:
+            self.public_ip = public_ip
+        return public_ip
 
     def get_svr_description(self):
         return f"84b3P#$bHCBaoFgC" # not a secret :) Just needed a value for the description
@@ -360,6 +452,7 @@ class Misc:
             # Check if the update was successful
             if "Already up to date." not in result.stdout and "Fast-forward" in result.stdout:
                 LOGGER.info("Update successful. Relaunching the code...")
+                stop_logger()
 
                 # Relaunch the code
                 os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -369,24 +462,12 @@ class Misc:
             LOGGER.error(f"Error updating the code: {e}")
 
     def calculate_crc32(self, file_path):
-        crc32_func = crcmod.predefined.mkCrcFun('crc-32')
-        crc = 0
-
-        with open(file_path, 'rb') as file:
-            for chunk in iter(lambda: file.read(4096), b''):
-                crc = crc32_func(chunk, crc)
-
-        return binascii.hexlify(crc.to_bytes(4, 'big')).decode()
+        """Blocking. In coroutines, use `await get_checksum_service().checksum(file_path)` instead."""
+        return get_checksum_service().compute(file_path, 'crc32')
 
     def calculate_md5(self, file_path):
-        with open(file_path, "rb") as file:
-            md5_hash = hashlib.md5()
-            chunk_size = 4096
-
-            while chunk := file.read(chunk_size):
-                md5_hash.update(chunk)
-
-            return md5_hash.hexdigest()
+        """Blocking. In coroutines, use `await get_checksum_service().checksum(file_path, 'md5')` instead."""
+        return get_checksum_service().compute(file_path, 'md5')
 
     def unzip_file(self, source_zip, dest_unzip):
         extracted_files = []
@@ -438,14 +519,20 @@ class Misc:
         result = subprocess.run(command, shell=True, capture_output=True, text=True)
         return result.stdout.strip()
 
-    def get_all_branch_names(self):
-        try:
-            os.chdir(HOME_PATH)
-            # Fetch the latest information from the remote repository
-            subprocess.run(['git', 'fetch'])
+    def fetch_github_remote(self):
+        os.chdir(HOME_PATH)
+        # Fetch the latest information from the remote repository
+        subprocess.run(['git', 'fetch'])
 
-            # Remove any stale remote-tracking branches
-            subprocess.run(['git', 'remote', 'prune', 'origin'])
+        # Remove any stale remote-tracking branches
+        subprocess.run(['git', 'remote', 'prune', 'origin'])
+
+    def get_all_branch_names(self, fetch=True):
+        try:
+            if fetch:
+                self.fetch_github_remote()
+            else:
+                os.chdir(HOME_PATH)
 
             # Retrieve the branch names from the remote repository
             branch_names = subprocess.check_output(
@@ -39,42 +39,82 @@ sys.excepthook = show_exception_and_exit
 
 HOME_PATH = Path(os.path.dirname(os.path.abspath(__file__)))
 
+# The launch steps run as a dependency graph, so the independent, slow ones (git, the public IP lookup, imports) overlap.
+# Run with --profile-startup to print how long each one took.
+from cogs.misc.startup import StartupGraph
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+startup = StartupGraph()
+
 # set up dependencies first
 from cogs.misc.dependencies_check import PrepareDependencies
 requirements_check = PrepareDependencies(HOME_PATH)
-requirements_check.update_dependencies()
+startup.run_phase("dependencies", requirements_check.update_dependencies)
 
 import asyncio
 import argparse
+import importlib
 
 #   This must be first, to initialise logging which all other classes rely on.
 from cogs.misc.logger import get_logger,set_logger,set_home,print_formatted_text,set_misc,set_setup,set_mqtt,get_mqtt
-set_home(HOME_PATH)
-set_logger()
+def initialise_logging():
+    set_home(HOME_PATH)
+    set_logger()
+startup.run_phase("logging", initialise_logging)
+LOGGER = get_logger()
 
-from cogs.misc.utilities import Misc
-MISC = Misc()
-set_misc(MISC)
+def initialise_misc():
+    global MISC
+    from cogs.misc.utilities import Misc
+    MISC = Misc()
+    set_misc(MISC)
+startup.run_phase("misc", initialise_misc)
 
-# check for update at launch
-MISC.update_github_repository()
+for phase_name, phase_function, phase_after in MISC.get_startup_phases():
+    startup.add(phase_name, phase_function, after=phase_after)
+
+# check for update at launch. 'git pull' waits for 'git fetch', rather than contending with it for the repository lock
+startup.add("update_check", MISC.update_github_repository, after=("git_branches",))
 
 from cogs.misc.setup import SetupEnvironment
 CONFIG_FILE = HOME_PATH / 'config' / 'config.json'
-setup = SetupEnvironment(CONFIG_FILE)
-set_setup(setup)
 
+def initialise_setup():
+    global setup
+    setup = SetupEnvironment(CONFIG_FILE)
+    set_setup(setup)
+startup.add("setup", initialise_setup)
+
+# The event loop is created here in the main thread, before anything asyncio. uvloop by default on linux, when installed.
+# The import thread below has no event loop of its own.
+from cogs.misc.event_loop import EVENT_LOOP_CHOICES, get_configured_event_loop, create_event_loop
+loop_parser = argparse.ArgumentParser(add_help=False)
+loop_parser.add_argument("--event-loop", choices=EVENT_LOOP_CHOICES)
+EVENT_LOOP_CHOICE = loop_parser.parse_known_args()[0].event_loop or get_configured_event_loop(CONFIG_FILE)
+loop, event_loop_description, event_loop_warning = create_event_loop(EVENT_LOOP_CHOICE)
+if event_loop_warning:
+    LOGGER.warn(event_loop_warning)
+LOGGER.info(f"Event loop: {event_loop_description} (man_event_loop: {EVENT_LOOP_CHOICE})")
+
+# created here, rather than in the import thread below. On python 3.9, asyncio primitives look up the thread's event loop when created
 from cogs.handlers.events import stop_event
+
+# the manager / API modules pull in fastapi, uvicorn, cryptography etc. Import them while the network lookups are in flight
+startup.add("imports", lambda: importlib.import_module("cogs.game.game_server_manager"), after=("setup",))
+startup.run()
+
+if PROFILE_STARTUP:
+    startup.print_timeline()
+
 from cogs.misc.exceptions import HoNConfigError
 from cogs.game.game_server_manager import GameServerManager
 from cogs.misc.scheduled_tasks import HonfiguratorSchedule
 # from cogs.handlers.mqtt import MQTTHandler
 
-LOGGER = get_logger()
-
 def parse_arguments():
     parser = argparse.ArgumentParser(description="HoNfigurator API and Server Manager")
     parser.add_argument("-hondir", "--hon_install_directory", type=str, help="Path to the HoN install directory")
+    parser.add_argument("--profile-startup", action="store_true", help="Print a timeline of the launch steps, and how long each took")
+    parser.add_argument("--event-loop", choices=EVENT_LOOP_CHOICES, help="Event loop implementation. Overrides man_event_loop in the configuration")
     # Add other arguments here
     return parser.parse_args()
 
@@ -151,12 +191,8 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        if sys.platform == "win32":
-            loop = asyncio.SelectorEventLoop()
-            asyncio.set_event_loop(loop)
-            
         args = parse_arguments()
-        asyncio.run(main())
+        loop.run_until_complete(main())
     except KeyboardInterrupt:
         LOGGER.warn("KeyBoardInterrupt: Manager shutting down...")
         stop_event.set()
@@ -0,0 +1,60 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+HOME_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(HOME_PATH))
+
+# as in main.py, the shared objects are set up before the modules that read them at import are imported
+from cogs.misc.logger import set_home, set_misc
+set_home(HOME_PATH)
+from cogs.misc.utilities import Misc
+set_misc(Misc())
+
+from cogs.game import memory_admission
+from cogs.misc.exceptions import HoNServerError
+
+GB = 1000000000
+
+
+def game_server(instance_id):
+    return SimpleNamespace(id=instance_id, global_config={'hon_data': {'man_use_cowmaster': False}})
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    # room for one default sized instance, not two
+    available = memory_admission.DEFAULT_INSTANCE_FOOTPRINT + memory_admission.MIN_FREE_RAM_BYTES + GB // 2
+    monkeypatch.setattr(memory_admission.psutil, "virtual_memory", lambda: SimpleNamespace(available=available))
+    monkeypatch.setattr(memory_admission, "ADMISSION_RETRY_INTERVAL", 0.01)
+    return memory_admission.MemoryAdmission()
+
+
+def test_concurrent_admissions_reserve_against_each_other(admission):
+    async def admit_both():
+        return await asyncio.gather(admission.admit(game_server(1), timeout=0.1), admission.admit(game_server(2), timeout=0.1), return_exceptions=True)
+
+    results = asyncio.run(admit_both())
+
+    assert [result for result in results if result is True] == [True]
+    assert [type(result) for result in results if result is not True] == [HoNServerError]
+    assert list(admission.reservations) == [1]
+
+
+def test_released_reservation_admits_the_next_start(admission):
+    asyncio.run(admission.admit(game_server(1)))
+    admission.release(game_server(1))
+
+    assert asyncio.run(admission.admit(game_server(2), timeout=0.1)) is True
+
+
+def test_sampled_instance_releases_its_reservation(admission):
+    asyncio.run(admission.admit(game_server(1)))
+    sampled_at = memory_admission.time.monotonic()
+    admission.current = {1: {'footprint': GB // 10, 'forked': False, 'key': ('idle', None, False)}}
+    admission.release_sampled(sampled_at)
+
+    assert admission.reservations == {}